@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import config
+from chatbot import generate_suggested_questions, extract_keywords_from_documents, summarize_documents, generate_concept_map_data, extract_timeline_from_documents
+from llm_client import background_priority
+
+# Post-ingest analyses run on a process-wide pool as soon as indexing is done.
+# Jobs are keyed by (corpus, role, language), so every session looking at the
+# same documents shares them instead of starting its own. Generation itself is
+# still throttled by the LLM queue in llm_client, where these jobs run at
+# background priority: interactive questions go ahead of them and always have
+# a slot of their own. A session that moves to another corpus, role or language
+# cancels the queued jobs of the group it left; a session still using that
+# group resubmits them on its next call.
+
+ANALYSIS_TASKS = OrderedDict([
+    ("suggested_questions", lambda chunks, role, lang: generate_suggested_questions(chunks, role, lang, num_questions=3)),
+    ("keywords", lambda chunks, role, lang: extract_keywords_from_documents(chunks, role, lang, num_keywords=10)),
+    ("summary", summarize_documents),
+    ("concept_map", generate_concept_map_data),
+    ("timeline", extract_timeline_from_documents),
+])
+
+_executor = ThreadPoolExecutor(max_workers=config.ANALYSIS_JOB_WORKERS, thread_name_prefix="analysis")
+_job_groups = OrderedDict()
+_lock = threading.Lock()
+
+def analysis_job_key(corpus_key, role, language_code):
+    return f"{corpus_key}:{hashlib.sha256(f'{role}|{language_code}'.encode('utf-8')).hexdigest()[:16]}"
+
+def _run_task(task, chunks, role, language_code, job, run=None):
+    job["state"] = "running"
+    job["started_at"] = time.time()
+    try:
+        # Results are cached by the result cache, keyed on model and prompt; failures raise and are never stored.
+        with background_priority():
+            if run is not None:
+                result = run(task, role, language_code)
+            else:
+                result = ANALYSIS_TASKS[task](chunks() if callable(chunks) else chunks, role, language_code)
+        job["result"] = result
+        job["state"] = "done"
+        return result
+    except Exception as e:
+        print(f"Background analysis '{task}' failed: {e}")
+        job["error"] = str(e)
+        job["state"] = "failed"
+        raise
+    finally:
+        job["finished_at"] = time.time()
+
+def _cancel_queued(group):
+    for job in group.values():
+        if job["state"] == "queued" and job["future"].cancel():
+            job["state"] = "cancelled"
+            job["finished_at"] = time.time()
+
+def cancel_analysis_jobs(job_key):
+    """Cancel the jobs of job_key that have not started yet."""
+    with _lock:
+        if job_key in _job_groups:
+            _cancel_queued(_job_groups[job_key])
+
+def start_analysis_jobs(corpus_key, chunks, role, language_code, tasks=None, replaces=None, run=None):
+    """Start the analyses of one (corpus, role, language) unless they already run; returns the job key.
+
+    ``chunks`` is a list, or a function returning one that each job calls only
+    when it runs, so documents too large to keep in memory are read just for the
+    analysis. ``run(task, role, language_code)``, if given, produces each result
+    instead, e.g. on the API service, which reads the chunks from its own index.
+    ``replaces`` is the job key the caller used before; its jobs that have not
+    started yet are cancelled.
+    """
+    job_key = analysis_job_key(corpus_key, role, language_code)
+    with _lock:
+        if replaces and replaces != job_key and replaces in _job_groups:
+            _cancel_queued(_job_groups[replaces])
+        group = _job_groups.get(job_key)
+        if group is None:
+            group = _job_groups[job_key] = {}
+            while len(_job_groups) > config.ANALYSIS_JOB_GROUPS_KEPT:
+                _cancel_queued(_job_groups.popitem(last=False)[1])
+        else:
+            _job_groups.move_to_end(job_key)
+        for task in tasks or ANALYSIS_TASKS:
+            if task in group and group[task]["state"] not in ("failed", "cancelled"):
+                continue
+            job = {"state": "queued", "submitted_at": time.time(), "result": None, "error": None}
+            job["future"] = _executor.submit(_run_task, task, chunks, role, language_code, job, run)
+            group[task] = job
+    return job_key
+
+def analysis_status(job_key):
+    with _lock:
+        group = dict(_job_groups.get(job_key, {}))
+    status = {}
+    for task, job in group.items():
+        finished_at = job.get("finished_at")
+        status[task] = {
+            "state": job["state"],
+            "result": job["result"],
+            "error": job["error"],
+            "seconds": (finished_at or time.time()) - job.get("started_at", job["submitted_at"]),
+        }
+    return status
+
+def wait_for_analysis(job_key, task, timeout=None):
+    """The result of one job, once it is done; raises what the job raised (AnalysisError when the model failed)."""
+    with _lock:
+        job = _job_groups.get(job_key, {}).get(task)
+    if job is None:
+        return None
+    return job["future"].result(timeout=timeout)
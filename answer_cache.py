@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import config
+from lexical_index import tokenize
+from vectorstore_registry import index_version
+
+# Answers to earlier questions, reused when a new question is the same or a
+# close paraphrase. Entries are scoped by (index version, role, language): a
+# cached answer is only valid for the exact set of indexed chunks it was
+# retrieved from, so every index save makes the previous scopes unreachable
+# and they are dropped on the next lookup.
+
+def _question_key(question):
+    # Case, spacing and punctuation differences do not make a new question.
+    return " ".join(tokenize(question))
+
+def _unit(vector):
+    # A new array: the caller's vector goes on to retrieval unchanged.
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+def _remove_semantic(entries, entry):
+    for index, other in enumerate(entries["entries"]):
+        if other is entry:
+            del entries["entries"][index]
+            del entries["vectors"][index]
+            return
+
+class AnswerCache:
+    def __init__(self, max_entries, threshold):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._scopes = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def _scope(self, db_path, role, language_code):
+        version = json.dumps(index_version(db_path))
+        if self._versions.get(db_path) != version:
+            for scope in [scope for scope in self._scopes if scope[0] == db_path]:
+                del self._scopes[scope]
+            self._versions[db_path] = version
+        return (db_path, version, role, language_code)
+
+    def lookup(self, db_path, role, language_code, question, embed_fn):
+        """Return (entry or None, similarity, question_vector).
+
+        Exact repeats are found without embedding; otherwise the question is
+        embedded once and the vector (as the model returned it) is given back
+        for retrieval to reuse. With no embed_fn only exact repeats are looked up.
+        """
+        with self._lock:
+            scope = self._scope(db_path, role, language_code)
+            entries = self._scopes.get(scope)
+            entry = entries["by_key"].get(_question_key(question)) if entries else None
+            if entry is not None:
+                self._scopes.move_to_end(scope)
+                entry["last_used"] = time.time()
+                self.hits += 1
+                return entry, 1.0, None
+            if embed_fn is None:
+                self.misses += 1
+                return None, 0.0, None
+        question_vector = np.asarray(embed_fn(question), dtype=np.float32)
+        vector = _unit(question_vector)
+        with self._lock:
+            entries = self._scopes.get(scope)
+            if entries and entries["vectors"]:
+                similarities = np.stack(entries["vectors"]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry = entries["entries"][best]
+                    entry["last_used"] = time.time()
+                    self._scopes.move_to_end(scope)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return entry, float(similarities[best]), question_vector
+            self.misses += 1
+            return None, 0.0, question_vector
+
+    def put(self, db_path, role, language_code, question, vector, answer, source_documents):
+        with self._lock:
+            scope = self._scope(db_path, role, language_code)
+            entries = self._scopes.setdefault(scope, {"by_key": {}, "entries": [], "vectors": []})
+            self._scopes.move_to_end(scope)
+            entry = {"question": question, "answer": answer, "source_documents": list(source_documents), "created_at": time.time(), "last_used": time.time()}
+            replaced = entries["by_key"].get(_question_key(question))
+            if replaced is not None:
+                # The old answer must not keep matching paraphrases.
+                _remove_semantic(entries, replaced)
+            entries["by_key"][_question_key(question)] = entry
+            if vector is not None:
+                entries["entries"].append(entry)
+                entries["vectors"].append(_unit(vector))
+            self._evict()
+
+    def _evict(self):
+        while sum(len(entries["by_key"]) for entries in self._scopes.values()) > self.max_entries:
+            scope, entries = next(iter(self._scopes.items()))
+            oldest = min(entries["by_key"], key=lambda key: entries["by_key"][key]["last_used"])
+            _remove_semantic(entries, entries["by_key"].pop(oldest))
+            if not entries["by_key"]:
+                del self._scopes[scope]
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(entries["by_key"]) for entries in self._scopes.values()),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache(config.ANSWER_CACHE_MAX_ENTRIES, config.ANSWER_CACHE_THRESHOLD)
+        return _cache
@@ -0,0 +1,90 @@
+import json
+import httpx
+from langchain.docstore.document import Document
+import config
+
+# Client for api_server.py. With RAG_API_URL set, the Streamlit app ingests
+# uploads, runs the analyses and answers questions through a shared API
+# service instead of in its own process, so the two need not share a disk.
+# stream_answer mirrors chatbot.stream_answer; the answer's source chunks come
+# back with it, and the app keeps its own copy of each PDF only for previews.
+
+class APIError(Exception):
+    pass
+
+_client = None
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = httpx.Client(base_url=config.API_URL, timeout=httpx.Timeout(config.OLLAMA_TIMEOUT_SECONDS, connect=10.0))
+    return _client
+
+def _error_message(response):
+    try:
+        return response.json().get("error", response.text)
+    except ValueError:
+        return response.text
+
+def _tokens(response, lines, stats):
+    try:
+        for line in lines:
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "token":
+                yield event["text"]
+            elif event["type"] == "done":
+                stats.update(event["stats"])
+            elif event["type"] == "error":
+                raise APIError(event["error"])
+    finally:
+        response.close()
+
+def stream_answer(role, question, language_code="tr", retrieval_mode=None, namespace=None):
+    """Return (source_documents, token_iterator, stats) like chatbot.stream_answer."""
+    client = _get_client()
+    request = client.build_request("POST", "/query", json={"question": question, "role": role, "language": language_code, "mode": retrieval_mode, "namespace": namespace, "stream": True})
+    try:
+        response = client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        raise APIError(f"API service at {config.API_URL} is unreachable: {e}") from e
+    if response.status_code != 200:
+        response.read()
+        response.close()
+        raise APIError(f"{response.status_code}: {_error_message(response)}")
+    lines = response.iter_lines()
+    first = json.loads(next(line for line in lines if line))
+    if first["type"] == "error":
+        response.close()
+        raise APIError(first["error"])
+    sources = [Document(id=doc["id"], page_content=doc["page_content"], metadata=doc["metadata"]) for doc in first["documents"]]
+    stats = {}
+    return sources, _tokens(response, lines, stats), stats
+
+def _request(method, url, **kwargs):
+    try:
+        response = _get_client().request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        raise APIError(f"API service at {config.API_URL} is unreachable: {e}") from e
+    if response.status_code != 200:
+        raise APIError(f"{response.status_code}: {_error_message(response)}")
+    return response.json()
+
+def run_analysis(task, role, language_code="tr", doc_ids=None, namespace=None):
+    return _request("POST", f"/{task.replace('_', '-')}", json={"role": role, "language": language_code, "documents": doc_ids, "namespace": namespace})["result"]
+
+def list_documents(namespace=None):
+    """The indexed documents: [{"doc_id", "source", "chunk_count", ...}]."""
+    return _request("GET", "/documents", params={"namespace": namespace} if namespace else None)["documents"]
+
+def remove_document(doc_id, namespace=None):
+    """Remove one document from the index; returns the server's report."""
+    return _request("DELETE", f"/documents/{doc_id}", params={"namespace": namespace} if namespace else None)
+
+def ingest(files, replace=False, namespace=None):
+    """Upload [(file_name, file_bytes)] and return the server's ingest report."""
+    params = {"replace": "1" if replace else "0"}
+    if namespace:
+        params["namespace"] = namespace
+    return _request("POST", "/ingest", params=params, files=[("files", (name, data, "application/pdf")) for name, data in files])
@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+import fitz
+import httpx
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+import config
+from analysis_jobs import ANALYSIS_TASKS, start_analysis_jobs, wait_for_analysis
+from chatbot import AnalysisError, stream_answer
+from embedder import embed_documents
+from index_manager import is_complete, iter_document_chunks, load_manifest, remove_documents, sync_index
+from ingest_cache import corpus_key, file_sha256, ingest_key, load_entry, save_entry
+from ingest_pipeline import ingest_pdf_streaming
+from lexical_index import get_lexical_index
+from namespaces import list_namespaces, namespace_path, write_lock
+from pdf_handler import extract_and_chunk_pdfs
+from retrieval import RETRIEVAL_MODES
+from telemetry import increment, prometheus_text
+from vectorstore_registry import cache_stats, get_vectorstore
+
+# Headless HTTP API over the same pipeline the Streamlit app runs: ingest,
+# streaming Q&A and the corpus analyses. The event loop only parses requests
+# and moves bytes; extraction, embedding, retrieval and generation run on the
+# thread pool, and each kind of work waits in its own bounded queue so a burst
+# of uploads cannot starve questions. A full queue answers 503 right away.
+#
+#     python api_server.py --port 8000
+
+class QueueFull(Exception):
+    pass
+
+class BadRequest(Exception):
+    pass
+
+class RequestQueue:
+    """At most `concurrency` requests run and `max_waiting` wait; the rest are rejected."""
+
+    def __init__(self, name, concurrency, max_waiting, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def acquire(self):
+        if self.waiting >= self.max_waiting:
+            self._reject("full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._reject("timeout")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def _reject(self, reason):
+        self.rejected += 1
+        increment("api_rejected_requests", queue=self.name, reason=reason)
+        raise QueueFull(f"The {self.name} queue is {'full' if reason == 'full' else 'busy'}, retry later.")
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def saturated(self):
+        return self.waiting >= self.max_waiting
+
+    def stats(self):
+        return {"active": self.active, "waiting": self.waiting, "concurrency": self.concurrency, "max_waiting": self.max_waiting, "rejected": self.rejected}
+
+def _queue_full_response(error):
+    return JSONResponse({"error": str(error)}, status_code=503, headers={"Retry-After": str(config.API_RETRY_AFTER_SECONDS)})
+
+def _document_json(doc):
+    return {"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata}
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+def _page_count(file_bytes):
+    """Page count of a PDF in memory; BadRequest if it is not a readable PDF."""
+    try:
+        with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+            if doc.needs_pass:
+                raise BadRequest("The PDF is password-protected.")
+            if doc.page_count == 0:
+                raise BadRequest("The PDF has no pages.")
+            return doc.page_count
+    except (RuntimeError, ValueError) as e:  # fitz.FileDataError is a RuntimeError
+        raise BadRequest(f"Not a readable PDF: {e}") from e
+
+def ingest_uploads(uploads, db_path=config.VECTORDB_PATH, replace=False):
+    """Index [(file_name, file_bytes)] like the app does, reusing the ingest cache.
+
+    Documents already in the index are kept unless ``replace`` is set, in
+    which case the index ends up holding exactly the uploaded files. An earlier
+    version of an uploaded file (same name, other content) is replaced. Files that
+    are not readable PDFs are reported as "rejected" and not indexed.
+    """
+    files, rejected = [], []
+    for file_name, file_bytes in uploads:
+        file_name = os.path.basename(file_name)
+        doc_id = ingest_key(file_sha256(file_bytes))
+        try:
+            page_count = _page_count(file_bytes)
+        except BadRequest as e:
+            rejected.append({"name": file_name, "doc_id": doc_id, "pages": 0, "status": "rejected", "error": str(e)})
+            continue
+        file_dir = os.path.join(config.DATA_DIR, doc_id[:16])
+        os.makedirs(file_dir, exist_ok=True)
+        file_path = os.path.join(file_dir, file_name)
+        with open(file_path, "wb") as f:
+            f.write(file_bytes)
+        files.append({"name": file_name, "path": file_path, "doc_id": doc_id, "pages": page_count})
+    if not files:
+        return {"files": rejected, "index": None, "documents": None}
+    # Held from reading the manifest to publishing, so concurrent uploads to one namespace do not drop each other's files.
+    with write_lock(db_path):
+        result = _index_files(files, db_path, replace)
+    result["files"] += rejected
+    return result
+
+def _index_files(files, db_path, replace):
+    manifest = load_manifest(db_path)
+    documents_by_id = {}
+    to_extract = []
+    seen = set()
+    for file in files:
+        if file["doc_id"] in seen:
+            file["status"] = "duplicate"
+            continue
+        seen.add(file["doc_id"])
+        cached_entry = load_entry(file["doc_id"])
+        if is_complete(manifest, file["doc_id"]):
+            file["status"] = "kept"
+            documents_by_id[file["doc_id"]] = {"documents": [], "source": file["name"]}
+        elif cached_entry:
+            file["status"] = "cached"
+            documents_by_id[file["doc_id"]] = {"documents": cached_entry["chunks"], "vectors": cached_entry["vectors"], "source": file["name"]}
+        elif file["pages"] >= config.STREAMING_PAGE_THRESHOLD:
+            # Resumes from its checkpoint if an earlier ingest of this file was interrupted.
+            ingest_pdf_streaming(file["path"], file["doc_id"], db_path=db_path, source=file["name"])
+            file["status"] = "streamed"
+            documents_by_id[file["doc_id"]] = {"documents": [], "source": file["name"]}
+        else:
+            file["status"] = "extracting"
+            to_extract.append(file)
+
+    for file, (pages_data, chunks) in zip(to_extract, extract_and_chunk_pdfs([file["path"] for file in to_extract])):
+        vectors = embed_documents(chunks) if chunks else []
+        save_entry(file["doc_id"], pages_data, chunks, vectors, source=file["name"])
+        file["status"] = "indexed" if chunks else "empty"
+        if chunks:
+            documents_by_id[file["doc_id"]] = {"documents": chunks, "vectors": vectors, "source": file["name"]}
+
+    _, manifest, stats = sync_index(documents_by_id, db_path, keep_existing=not replace)
+    for file in files:
+        # Report what the sync did, not what was planned: a file only counts if its document is indexed now.
+        if file["status"] not in ("empty", "duplicate") and not is_complete(manifest, file["doc_id"]):
+            file["status"] = "failed"
+    if manifest["documents"]:
+        get_lexical_index(db_path)
+    return {
+        "files": [{"name": file["name"], "doc_id": file["doc_id"], "pages": file["pages"], "status": file["status"]} for file in files],
+        "index": stats,
+        "documents": len(manifest["documents"]),
+    }
+
+def corpus_chunks(db_path=config.VECTORDB_PATH, doc_ids=None):
+    """Return (corpus key, chunks) for the indexed documents, read from the ingest cache where possible."""
+    manifest = load_manifest(db_path)
+    doc_ids = [doc_id for doc_id in (doc_ids or manifest["documents"]) if doc_id in manifest["documents"]]
+    chunks = []
+    vectorstore = None
+    for doc_id in doc_ids:
+        entry = load_entry(doc_id, with_vectors=False)
+        if entry:
+            chunks.extend(entry["chunks"])
+            continue
+        vectorstore = vectorstore or get_vectorstore(db_path)
+        if vectorstore is not None:
+            chunks.extend(iter_document_chunks(vectorstore, doc_id, manifest["documents"][doc_id]["chunk_count"]))
+    return corpus_key(doc_ids), chunks
+
+def run_analysis(task, db_path, role, language_code, doc_ids=None):
+    corpus, chunks = corpus_chunks(db_path, doc_ids)
+    if not chunks:
+        return corpus, None
+    job_key = start_analysis_jobs(corpus, chunks, role, language_code, tasks=[task])
+    return corpus, wait_for_analysis(job_key, task)
+
+def create_app(default_db_path=config.VECTORDB_PATH):
+    queues = {
+        "query": RequestQueue("query", config.API_MAX_CONCURRENT_QUERIES, config.API_MAX_QUEUED_QUERIES, config.API_QUEUE_TIMEOUT_SECONDS),
+        "ingest": RequestQueue("ingest", config.API_MAX_CONCURRENT_INGESTS, config.API_MAX_QUEUED_INGESTS, config.API_QUEUE_TIMEOUT_SECONDS),
+        "analysis": RequestQueue("analysis", config.API_MAX_CONCURRENT_ANALYSES, config.API_MAX_QUEUED_ANALYSES, config.API_QUEUE_TIMEOUT_SECONDS),
+    }
+
+    def namespace_db_path(request, body=None):
+        # Every endpoint takes ?namespace=<workspace or corpus>; JSON endpoints also accept it in the body.
+        namespace = request.query_params.get("namespace") or (body or {}).get("namespace")
+        try:
+            return namespace_path(namespace) if namespace else default_db_path
+        except ValueError as e:
+            raise BadRequest(str(e)) from e
+
+    async def bad_request(request, error):
+        return JSONResponse({"error": str(error)}, status_code=400)
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    async def ready(request):
+        checks = {"index": bool((await run_in_threadpool(load_manifest, namespace_db_path(request)))["documents"])}
+        try:
+            async with httpx.AsyncClient(timeout=2.0) as client:
+                checks["model_server"] = (await client.get(f"{config.OLLAMA_BASE_URL}/api/tags")).status_code == 200
+        except httpx.HTTPError:
+            checks["model_server"] = False
+        checks["queues"] = not any(queue.saturated() for queue in queues.values())
+        # An empty index still accepts uploads, so it does not make the service unready.
+        is_ready = checks["model_server"] and checks["queues"]
+        return JSONResponse({"ready": is_ready, "checks": checks, "queues": {name: queue.stats() for name, queue in queues.items()}}, status_code=200 if is_ready else 503)
+
+    async def metrics(request):
+        return PlainTextResponse(prometheus_text(), media_type="text/plain; version=0.0.4")
+
+    async def namespaces(request):
+        return JSONResponse({"namespaces": await run_in_threadpool(list_namespaces), "loaded": cache_stats()})
+
+    async def documents(request):
+        manifest = await run_in_threadpool(load_manifest, namespace_db_path(request))
+        return JSONResponse({"documents": [{"doc_id": doc_id, **entry} for doc_id, entry in manifest["documents"].items()]})
+
+    async def remove_document(request):
+        db_path = namespace_db_path(request)
+        try:
+            async with queues["ingest"].slot():
+                removed = await run_in_threadpool(remove_documents, [request.path_params["doc_id"]], db_path)
+        except QueueFull as e:
+            return _queue_full_response(e)
+        if not removed:
+            return JSONResponse({"error": "No such document in this index."}, status_code=404)
+        documents = len((await run_in_threadpool(load_manifest, db_path))["documents"])
+        if documents:
+            await run_in_threadpool(get_lexical_index, db_path)
+        return JSONResponse({"removed": removed, "documents": documents})
+
+    async def ingest(request):
+        form = await request.form(max_part_size=config.API_MAX_UPLOAD_MB * 1024 * 1024)
+        uploads = [(upload.filename, await upload.read()) for upload in form.getlist("files") if hasattr(upload, "filename")]
+        if not uploads:
+            return JSONResponse({"error": "Send one or more PDFs as multipart 'files'."}, status_code=400)
+        replace = request.query_params.get("replace", "0").lower() in ("1", "true", "yes")
+        db_path = namespace_db_path(request)
+        try:
+            async with queues["ingest"].slot():
+                result = await run_in_threadpool(ingest_uploads, uploads, db_path, replace)
+        except QueueFull as e:
+            return _queue_full_response(e)
+        if result["index"] is None:
+            return JSONResponse({"error": "None of the files is a readable PDF.", **result}, status_code=422)
+        return JSONResponse(result)
+
+    async def query(request):
+        body = await _json_body(request)
+        if not body or not str(body.get("question", "")).strip():
+            return JSONResponse({"error": "A non-empty 'question' is required."}, status_code=400)
+        mode = body.get("mode")
+        if mode is not None and mode not in RETRIEVAL_MODES:
+            return JSONResponse({"error": f"'mode' must be one of {', '.join(RETRIEVAL_MODES)}."}, status_code=400)
+        role = body.get("role") or config.API_DEFAULT_ROLE
+        language_code = body.get("language") or config.API_DEFAULT_LANGUAGE
+        db_path = namespace_db_path(request, body)
+        try:
+            await queues["query"].acquire()
+        except QueueFull as e:
+            return _queue_full_response(e)
+        try:
+            vectorstore = await run_in_threadpool(get_vectorstore, db_path)
+            if vectorstore is None:
+                queues["query"].release()
+                return JSONResponse({"error": "No documents are indexed yet."}, status_code=409)
+            sources, tokens, stats = await run_in_threadpool(stream_answer, vectorstore, role, body["question"], language_code, mode, db_path)
+        except Exception:
+            queues["query"].release()
+            raise
+
+        if not body.get("stream", True):
+            try:
+                answer = "".join([token async for token in iterate_in_threadpool(tokens)])
+            finally:
+                queues["query"].release()
+            return JSONResponse({"answer": answer, "sources": [_document_json(doc) for doc in sources], "stats": stats})
+
+        async def ndjson_lines():
+            # The slot is held until the last token is sent.
+            try:
+                yield json.dumps({"type": "sources", "documents": [_document_json(doc) for doc in sources]}, ensure_ascii=False) + "\n"
+                async for token in iterate_in_threadpool(tokens):
+                    yield json.dumps({"type": "token", "text": token}, ensure_ascii=False) + "\n"
+                yield json.dumps({"type": "done", "stats": stats}, ensure_ascii=False, default=str) + "\n"
+            except Exception as e:
+                yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+            finally:
+                queues["query"].release()
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    def analysis_endpoint(task):
+        async def endpoint(request):
+            body = await _json_body(request) or {}
+            role = body.get("role") or config.API_DEFAULT_ROLE
+            language_code = body.get("language") or config.API_DEFAULT_LANGUAGE
+            db_path = namespace_db_path(request, body)
+            started_at = time.perf_counter()
+            try:
+                async with queues["analysis"].slot():
+                    corpus, result = await run_in_threadpool(run_analysis, task, db_path, role, language_code, body.get("documents"))
+            except QueueFull as e:
+                return _queue_full_response(e)
+            except AnalysisError as e:
+                # Not cached anywhere, so the next request tries again.
+                return JSONResponse({"error": str(e)}, status_code=502)
+            if result is None:
+                return JSONResponse({"error": f"No {task.replace('_', ' ')} could be produced; is anything indexed?", "corpus": corpus}, status_code=409)
+            return JSONResponse({"task": task, "corpus": corpus, "result": result, "seconds": time.perf_counter() - started_at})
+        return endpoint
+
+    routes = [
+        Route("/healthz", health),
+        Route("/readyz", ready),
+        Route("/metrics", metrics),
+        Route("/namespaces", namespaces),
+        Route("/documents", documents),
+        Route("/documents/{doc_id}", remove_document, methods=["DELETE"]),
+        Route("/ingest", ingest, methods=["POST"]),
+        Route("/query", query, methods=["POST"]),
+    ]
+    routes += [Route(f"/{task.replace('_', '-')}", analysis_endpoint(task), methods=["POST"]) for task in ANALYSIS_TASKS]
+    routes.append(Route("/summarize", analysis_endpoint("summary"), methods=["POST"]))
+    app = Starlette(routes=routes, exception_handlers={BadRequest: bad_request})
+    app.state.queues = queues
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HTTP API for ingestion and Q&A.")
+    parser.add_argument("--host", default=config.API_HOST)
+    parser.add_argument("--port", type=int, default=config.API_PORT)
+    args = parser.parse_args()
+    import uvicorn
+    uvicorn.run(create_app(), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,36 @@
 import streamlit as st
 import os
-from pdf_handler import extract_pages_from_pdf, chunk_pages, get_pdf_page_image_bytes
+import time
+import functools
+import itertools
+from pdf_handler import extract_and_chunk_pdfs, get_pdf_page_image_bytes
+from preview_service import get_preview_service
 import fitz
-from embedder import embed_and_store, load_vectorstore
-from chatbot import get_qa_chain, generate_suggested_questions, summarize_documents, extract_keywords_from_documents, generate_concept_map_data, extract_timeline_from_documents
+from embedder import embed_documents
+from vectorstore_registry import get_vectorstore, registry_stats, cache_stats
+from namespaces import namespace_path, corpus_namespace
+from index_manager import sync_index, iter_document_chunks, load_manifest, remove_documents
+from lexical_index import get_lexical_index
+from retrieval import RETRIEVAL_MODES, retrieval_stats
+from ingest_pipeline import ingest_pdf_streaming
+from embedding_cache import get_embedding_cache
+from result_cache import get_result_cache
+from answer_cache import get_answer_cache
+from chatbot import AnalysisError, stream_answer, stream_refine_answer, stream_summary, generate_concept_map_data, extract_timeline_from_documents
+from analysis_jobs import start_analysis_jobs, cancel_analysis_jobs, analysis_status
 import json
 import pandas as pd 
 from collections import defaultdict 
+import config
+from ingest_cache import file_sha256, ingest_key, corpus_key, load_entry, save_entry
+from telemetry import span_summary, recent_spans, counters, start_metrics_server
+import api_client
 
 st.set_page_config(page_title="PDF Chatbot", layout="wide")
 
+if config.METRICS_PORT:
+    start_metrics_server()
+
 
 if 'pdf_previews' not in st.session_state:
     st.session_state.pdf_previews = {}
@@ -37,6 +58,96 @@ if 'timeline_data' not in st.session_state:
     st.session_state.timeline_data = ""
 if 'page_chunk_counts' not in st.session_state: 
     st.session_state.page_chunk_counts = {}
+if 'ingested_corpus_key' not in st.session_state:
+    st.session_state.ingested_corpus_key = None
+if 'session_chunks' not in st.session_state:
+    st.session_state.session_chunks = []
+if 'streamed_documents' not in st.session_state:
+    st.session_state.streamed_documents = {}
+if 'remote_documents' not in st.session_state:
+    st.session_state.remote_documents = []
+if 'analysis_job_key' not in st.session_state:
+    st.session_state.analysis_job_key = None
+if 'index_path' not in st.session_state:
+    st.session_state.index_path = None
+if 'analysis_applied' not in st.session_state:
+    st.session_state.analysis_applied = set()
+if 'last_answer_stats' not in st.session_state:
+    st.session_state.last_answer_stats = {}
+if 'refined_answer_stats' not in st.session_state:
+    st.session_state.refined_answer_stats = {}
+if 'summary_stats' not in st.session_state:
+    st.session_state.summary_stats = {}
+
+
+def render_token_stream(token_iterator, error_message="An error occurred while generating the answer."):
+    placeholder = st.empty()
+    text = ""
+    try:
+        for token in token_iterator:
+            text += token
+            placeholder.markdown(text + "▌")
+    except Exception as e:
+        print(f"Error while streaming model output: {e}")
+        text = text or error_message
+    placeholder.empty()
+    return text
+
+
+def format_generation_stats(stats):
+    if stats and stats.get("answer_cache") == "hit":
+        return f"⚡ Answered from cache in {stats['retrieval_seconds'] * 1000:.0f} ms (similarity {stats['cache_similarity']:.2f} to \"{stats['cached_question']}\")"
+    if not stats or "tokens" not in stats:
+        return ""
+    parts = []
+    if "retrieval_seconds" in stats:
+        parts.append(f"{stats['mode']} retrieval {stats['retrieval_seconds']:.2f}s" if "mode" in stats else f"retrieval {stats['retrieval_seconds']:.2f}s")
+    if "time_to_first_token" in stats:
+        parts.append(f"first token {stats['time_to_first_token']:.2f}s")
+    parts.append(f"{stats['tokens']} tokens at {stats['tokens_per_sec']:.1f} tokens/sec")
+    return "⏱️ " + ", ".join(parts)
+
+
+ANALYSIS_LABELS = {"suggested_questions": "💡 Questions", "keywords": "🔑 Keywords", "summary": "🧮 Summary", "concept_map": "🧠 Concept map", "timeline": "⏳ Timeline"}
+ANALYSIS_STATE_ICONS = {"queued": "🕒", "running": "⏳", "done": "✅", "failed": "⚠️", "cancelled": "⏹️"}
+
+
+def load_session_chunks(chunks, index_path, streamed_documents):
+    """The session's chunks, with those of streamed PDFs ({doc_id: chunk count}) read from the index's docstore."""
+    if not streamed_documents:
+        return chunks
+    vectorstore = get_vectorstore(index_path)
+    if vectorstore is None:
+        return chunks
+    return chunks + [chunk for doc_id, count in streamed_documents.items() for chunk in iter_document_chunks(vectorstore, doc_id, count)]
+
+
+def run_remote_analysis(doc_ids, namespace, task, role, language_code):
+    """Run an analysis on the API service (RAG_API_URL), which reads the chunks from its own index."""
+    try:
+        return api_client.run_analysis(task, role, language_code, doc_ids=doc_ids, namespace=namespace)
+    except api_client.APIError as e:
+        raise AnalysisError(f"The API service could not run the analysis: {e}") from e
+
+
+def finished_analysis(task):
+    """The background result of task if it is already there; buttons never wait for a job still running."""
+    status = analysis_status(st.session_state.analysis_job_key).get(task) if st.session_state.analysis_job_key else None
+    return status["result"] if status and status["state"] == "done" else None
+
+
+# Re-run just this panel on a timer while jobs are pending, and the whole app
+# once a result that is shown elsewhere on the page becomes available.
+@st.fragment(run_every=config.ANALYSIS_POLL_SECONDS)
+def render_analysis_progress(job_key):
+    statuses = analysis_status(job_key)
+    if any(statuses.get(task, {}).get("state") == "done" and task not in st.session_state.analysis_applied for task in ("suggested_questions", "keywords")):
+        st.rerun()
+    finished = sum(1 for status in statuses.values() if status["state"] in ("done", "failed"))
+    if not statuses or finished == len(statuses):
+        return
+    st.progress(finished / len(statuses), text=f"🔄 Preparing document analyses in the background: {finished}/{len(statuses)}")
+    st.caption(" · ".join(f"{ANALYSIS_LABELS.get(task, task)} {ANALYSIS_STATE_ICONS[status['state']]}" + (f" {status['seconds']:.0f}s" if status["state"] != "queued" else "") for task, status in statuses.items()))
 
 
 st.title("📄 PDF-Supported Role-Based Chatbot")
@@ -44,7 +155,7 @@ st.title("📄 PDF-Supported Role-Based Chatbot")
 st.info(
     "🔒 **Data Privacy and Security:** This application runs entirely on your local machine. "
     "The PDFs you upload and the questions you ask are never sent to any external server. "
-    "All processes — text extraction, embedding, and answer generation — are performed locally on your computer using Ollama and your gemma:2b model."
+    f"All processes — text extraction, embedding, and answer generation — are performed locally on your computer using Ollama and your {config.LLM_MODEL} model."
 )
 st.markdown("---")
 
@@ -70,84 +181,238 @@ selected_language_label = st.selectbox("🌐 Select response language", list(ava
 selected_language_code = available_languages[selected_language_label]
 
 
+workspace_name = st.sidebar.text_input("🗂️ Workspace (optional)", help="Uploads in the same workspace share one index. Without a workspace, each set of files gets its own index.").strip()
+selected_retrieval_mode = st.sidebar.selectbox("🔎 Retrieval mode", RETRIEVAL_MODES, index=RETRIEVAL_MODES.index(config.RETRIEVAL_MODE), help="auto: keyword search for short keyword queries, hybrid (keyword + semantic) otherwise.")
+
+
 uploaded_files = st.file_uploader("📤 Upload PDF (You can select multiple files)", type=["pdf"], accept_multiple_files=True)
 processed_pdf_paths = []
-all_chunks_for_session = [] 
+session_has_chunks = False
 
 if uploaded_files:
 
-    st.session_state.pdf_previews = {}
-    st.session_state.suggested_questions = []
-    st.session_state.document_summary = ""
-    st.session_state.extracted_keywords = []
-    st.session_state.concept_map_data = ""
-    st.session_state.timeline_data = ""
-    st.session_state.page_chunk_counts = {}
-    st.session_state.last_answer = ""
-    st.session_state.refined_answer = ""
-    st.session_state.source_documents = []
-
-    current_file_chunks = []
-    data_dir = "data"
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-
+    uploaded_entries = []
     for uploaded_file in uploaded_files:
-        file_path = os.path.join(data_dir, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.read())
-        processed_pdf_paths.append(file_path)
-
-        try:
-            doc = fitz.open(file_path)
-            st.session_state.pdf_previews[uploaded_file.name] = {
-                "total_pages": doc.page_count,
-                "current_page_display": 1,
-                "path": file_path
-            }
-            doc.close()
-        except Exception as e:
-            st.error(f"{uploaded_file.name} Page count could not be retrieved: {e}")
-            continue
-
-        pages_data = extract_pages_from_pdf(file_path)
-        if pages_data:
-            chunks_from_file = chunk_pages(pages_data)
-            current_file_chunks.extend(chunks_from_file)
-            st.write(f"📄 {uploaded_file.name} ({st.session_state.pdf_previews.get(uploaded_file.name, {}).get('total_pages', 'N/A')} pages)  processed ({len(chunks_from_file)} chunk).")
-        else:
-            st.write(f"⚠️ {uploaded_file.name} Text could not be extracted from the file or the file is empty.")
-
-    all_chunks_for_session = current_file_chunks
-
-    if all_chunks_for_session:
-
-        page_counts = defaultdict(lambda: defaultdict(int))
-        for chunk in all_chunks_for_session:
-            source = chunk.metadata.get("source", "Unknown Source")
-            page = chunk.metadata.get("page", 0)
-            if page > 0: 
-                page_counts[source][page] += 1
-        st.session_state.page_chunk_counts = {k: dict(v) for k, v in page_counts.items()} 
-
-
-        if not os.path.exists("vectordb"):
-            os.makedirs("vectordb")
-        embed_and_store(all_chunks_for_session)
-        st.success("✅ All PDFs have been processed and the database has been created/updated!")
-
-        with st.spinner("🤔 Sample questions and keywords are being prepared...."):
-            st.session_state.suggested_questions = generate_suggested_questions(all_chunks_for_session, final_selected_role, selected_language_code, num_questions=3)
-            st.session_state.extracted_keywords = extract_keywords_from_documents(all_chunks_for_session, final_selected_role, selected_language_code, num_keywords=10)
-    else:
-        st.warning("⚠️ Text could not be extracted from the uploaded PDFs or the PDFs are empty.")
+        file_bytes = uploaded_file.getvalue()
+        uploaded_entries.append((uploaded_file.name, file_bytes, ingest_key(file_sha256(file_bytes))))
+    current_corpus_key = corpus_key([key for _, _, key in uploaded_entries])
+
+    try:
+        current_index_path = namespace_path(workspace_name) if workspace_name else corpus_namespace(current_corpus_key)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        st.stop()
+
+    if st.session_state.ingested_corpus_key != current_corpus_key or st.session_state.index_path != current_index_path:
+        st.session_state.pdf_previews = {}
         st.session_state.suggested_questions = []
+        st.session_state.document_summary = ""
         st.session_state.extracted_keywords = []
         st.session_state.concept_map_data = ""
         st.session_state.timeline_data = ""
         st.session_state.page_chunk_counts = {}
-
-
+        st.session_state.last_answer = ""
+        st.session_state.refined_answer = ""
+        st.session_state.source_documents = []
+        st.session_state.session_chunks = []
+        st.session_state.streamed_documents = {}
+        st.session_state.remote_documents = []
+        if st.session_state.analysis_job_key:
+            # Analyses of the previous upload that have not started would only hold up these.
+            cancel_analysis_jobs(st.session_state.analysis_job_key)
+        st.session_state.analysis_job_key = None
+
+        current_file_chunks = []
+        streamed_documents = {}
+        remote_documents = []
+        documents_by_id = {}
+
+        readable_entries = []
+        for file_name, file_bytes, file_ingest_key in uploaded_entries:
+            # Files are stored by content, so two users uploading the same file name do not overwrite each other.
+            file_dir = os.path.join(config.DATA_DIR, file_ingest_key[:16])
+            os.makedirs(file_dir, exist_ok=True)
+            file_path = os.path.join(file_dir, file_name)
+            with open(file_path, "wb") as f:
+                f.write(file_bytes)
+            processed_pdf_paths.append(file_path)
+
+            try:
+                doc = fitz.open(file_path)
+                st.session_state.pdf_previews[file_name] = {
+                    "total_pages": doc.page_count,
+                    "current_page_display": 1,
+                    "path": file_path,
+                    "file_key": file_ingest_key
+                }
+                doc.close()
+            except Exception as e:
+                st.error(f"{file_name} Page count could not be retrieved: {e}")
+                continue
+            # Large PDFs are never loaded whole, not even from the ingest cache: the streaming ingest indexes them batch by batch.
+            is_large = st.session_state.pdf_previews[file_name]["total_pages"] >= config.STREAMING_PAGE_THRESHOLD
+            readable_entries.append((file_name, file_path, file_ingest_key, None if is_large or config.API_URL else load_entry(file_ingest_key)))
+
+        if config.API_URL:
+            # The API service extracts, embeds and indexes the files in its own storage; the local copies only serve previews.
+            file_bytes_by_name = {file_name: file_bytes for file_name, file_bytes, _ in uploaded_entries}
+            ingest_report = {"files": [], "index": None}
+            if readable_entries:
+                with st.spinner(f"📤 Sending {len(readable_entries)} PDF(s) to the API service..."):
+                    try:
+                        ingest_report = api_client.ingest([(file_name, file_bytes_by_name[file_name]) for file_name, _, _, _ in readable_entries], replace=not workspace_name, namespace=os.path.basename(current_index_path))
+                    except api_client.APIError as e:
+                        st.error(f"❌ The API service could not index the PDFs: {e}")
+                        st.stop()
+            for file_report in ingest_report["files"]:
+                if file_report["status"] in ("kept", "cached", "streamed", "indexed"):
+                    remote_documents.append(file_report["doc_id"])
+                    st.write(f"📄 {file_report['name']} ({file_report['pages']} pages)  processed ({file_report['status']} by the API service).")
+                elif file_report["status"] != "duplicate":
+                    st.write(f"⚠️ {file_report['name']} could not be indexed by the API service ({file_report['status']}).")
+            if remote_documents:
+                index_stats = ingest_report["index"]
+                st.success(f"✅ All PDFs have been processed and the database has been created/updated! ({index_stats['added']} added, {index_stats['removed']} removed, {index_stats['kept']} unchanged)")
+            else:
+                st.warning("⚠️ Text could not be extracted from the uploaded PDFs or the PDFs are empty.")
+        else:
+            streamed_counts = {}
+            for file_name, file_path, file_ingest_key, cached_entry in readable_entries:
+                if st.session_state.pdf_previews[file_name]["total_pages"] < config.STREAMING_PAGE_THRESHOLD:
+                    continue
+                streaming_progress = st.progress(0.0, text=f"📚 Streaming {file_name}...")
+                def report_streaming_progress(pages_done, page_count, chunks_done, chunks_per_sec, bar=streaming_progress, name=file_name):
+                    bar.progress(pages_done / max(page_count, 1), text=f"📚 {name}: page {pages_done}/{page_count}, {chunks_done} chunks ({chunks_per_sec:.1f} chunks/sec)")
+                _, _, streaming_stats = ingest_pdf_streaming(file_path, file_ingest_key, db_path=current_index_path, source=file_name, progress_callback=report_streaming_progress)
+                streaming_progress.empty()
+                if streaming_stats["cached"]:
+                    st.caption(f"📚 {file_name}: {streaming_stats['chunks']} cached chunks, {streaming_stats['new_chunks']} indexed in {streaming_stats['seconds']:.1f}s")
+                else:
+                    resumed_note = f", resumed from page {streaming_stats['resumed_from_page'] + 1}" if streaming_stats["resumed_from_page"] else ""
+                    st.caption(f"📚 {file_name}: {streaming_stats['chunks']} chunks streamed in {streaming_stats['seconds']:.1f}s{resumed_note}")
+                streamed_counts[file_name] = streaming_stats["chunks"]
+
+            uncached_entries = [(file_name, file_path) for file_name, file_path, _, cached_entry in readable_entries if not cached_entry and file_name not in streamed_counts]
+            extracted_by_name = {}
+            if uncached_entries:
+                with st.spinner(f"📑 Extracting text from {len(uncached_entries)} PDF(s)..."):
+                    extraction_results = extract_and_chunk_pdfs([file_path for _, file_path in uncached_entries])
+                extracted_by_name = {file_name: result for (file_name, _), result in zip(uncached_entries, extraction_results)}
+
+            for file_name, file_path, file_ingest_key, cached_entry in readable_entries:
+                if file_name in streamed_counts:
+                    # Already indexed batch by batch. Only the reference is kept; its chunks are read from the docstore when needed.
+                    if streamed_counts[file_name]:
+                        streamed_documents[file_ingest_key] = streamed_counts[file_name]
+                        documents_by_id[file_ingest_key] = {"documents": [], "source": file_name}
+                        st.write(f"📄 {file_name} ({st.session_state.pdf_previews[file_name]['total_pages']} pages)  processed ({streamed_counts[file_name]} chunk, streamed).")
+                    else:
+                        st.write(f"⚠️ {file_name} Text could not be extracted from the file or the file is empty.")
+                    continue
+                if cached_entry:
+                    chunks_from_file = cached_entry["chunks"]
+                    vectors_from_file = cached_entry["vectors"]
+                else:
+                    pages_data, chunks_from_file = extracted_by_name[file_name]
+                    vectors_from_file = []
+                    if chunks_from_file:
+                        embedding_progress = st.progress(0.0, text=f"🔢 Embedding {file_name}...")
+                        def report_embedding_progress(done, total, chunks_per_sec, bar=embedding_progress, name=file_name):
+                            bar.progress(done / total, text=f"🔢 Embedding {name}: {done}/{total} chunks ({chunks_per_sec:.1f} chunks/sec)")
+                        embedding_started_at = time.perf_counter()
+                        vectors_from_file = embed_documents(chunks_from_file, progress_callback=report_embedding_progress)
+                        embedding_progress.empty()
+                        embedding_seconds = time.perf_counter() - embedding_started_at
+                        st.caption(f"🔢 {file_name}: {len(chunks_from_file)} chunks embedded in {embedding_seconds:.1f}s ({len(chunks_from_file) / max(embedding_seconds, 1e-9):.1f} chunks/sec)")
+                        if config.EMBED_CACHE_ENABLED:
+                            embedding_cache_stats = get_embedding_cache().stats()
+                            st.caption(f"🗃️ Embedding cache: {embedding_cache_stats['hit_rate']:.0%} hit rate ({embedding_cache_stats['hits']} hits / {embedding_cache_stats['misses']} misses, {embedding_cache_stats['entries']} vectors, {embedding_cache_stats['bytes'] / 1024 / 1024:.1f} MB)")
+                    save_entry(file_ingest_key, pages_data, chunks_from_file, vectors_from_file, source=file_name)
+
+                if chunks_from_file:
+                    current_file_chunks.extend(chunks_from_file)
+                    documents_by_id[file_ingest_key] = {"documents": chunks_from_file, "vectors": vectors_from_file, "source": file_name}
+                    st.write(f"📄 {file_name} ({st.session_state.pdf_previews.get(file_name, {}).get('total_pages', 'N/A')} pages)  processed ({len(chunks_from_file)} chunk{', cached' if cached_entry else ''}).")
+                else:
+                    st.write(f"⚠️ {file_name} Text could not be extracted from the file or the file is empty.")
+
+            if current_file_chunks or streamed_documents:
+                # A workspace is shared: other users' documents stay. A corpus namespace holds exactly these files.
+                _, _, index_stats = sync_index(documents_by_id, current_index_path, keep_existing=bool(workspace_name))
+                # Build the keyword index now rather than on the first question.
+                get_lexical_index(current_index_path)
+
+                page_counts = defaultdict(lambda: defaultdict(int))
+                streamed_vectorstore = get_vectorstore(current_index_path) if streamed_documents else None
+                streamed_chunks = (chunk for doc_id, count in streamed_documents.items() for chunk in iter_document_chunks(streamed_vectorstore, doc_id, count)) if streamed_vectorstore else ()
+                for chunk in itertools.chain(current_file_chunks, streamed_chunks):
+                    source = chunk.metadata.get("source", "Unknown Source")
+                    page = chunk.metadata.get("page", 0)
+                    if page > 0: 
+                        page_counts[source][page] += 1
+                st.session_state.page_chunk_counts = {k: dict(v) for k, v in page_counts.items()} 
+                st.success(f"✅ All PDFs have been processed and the database has been created/updated! ({index_stats['added']} added, {index_stats['removed']} removed, {index_stats['kept']} unchanged)")
+            else:
+                st.warning("⚠️ Text could not be extracted from the uploaded PDFs or the PDFs are empty.")
+
+        st.session_state.session_chunks = current_file_chunks
+        st.session_state.streamed_documents = streamed_documents
+        st.session_state.remote_documents = remote_documents
+        st.session_state.ingested_corpus_key = current_corpus_key
+        st.session_state.index_path = current_index_path
+
+    session_has_chunks = bool(st.session_state.session_chunks or st.session_state.streamed_documents or st.session_state.remote_documents)
+    # Chunks of streamed PDFs are read only while an analysis runs, never kept in session state.
+    load_chunks = functools.partial(load_session_chunks, st.session_state.session_chunks, st.session_state.index_path, dict(st.session_state.streamed_documents))
+    remote_analysis = functools.partial(run_remote_analysis, list(st.session_state.remote_documents), os.path.basename(st.session_state.index_path)) if config.API_URL and st.session_state.index_path else None
+    processed_pdf_paths = [preview["path"] for preview in st.session_state.pdf_previews.values()]
+
+    if session_has_chunks:
+        # Every analysis starts in the background right after indexing; results
+        # land in session state on the next rerun as each one finishes.
+        analysis_job_key = start_analysis_jobs(current_corpus_key, load_chunks, final_selected_role, selected_language_code, replaces=st.session_state.analysis_job_key, run=remote_analysis)
+        if st.session_state.analysis_job_key != analysis_job_key:
+            st.session_state.suggested_questions = []
+            st.session_state.extracted_keywords = []
+            st.session_state.analysis_applied = set()
+            st.session_state.analysis_job_key = analysis_job_key
+        analysis_state = analysis_status(analysis_job_key)
+        for task, session_key in (("suggested_questions", "suggested_questions"), ("keywords", "extracted_keywords")):
+            if task in analysis_state and analysis_state[task]["state"] == "done" and task not in st.session_state.analysis_applied:
+                st.session_state[session_key] = analysis_state[task]["result"] or []
+                st.session_state.analysis_applied.add(task)
+
+
+try:
+    workspace_path = namespace_path(workspace_name) if workspace_name else None
+except ValueError:
+    workspace_path = None
+if workspace_path:
+    # Documents stay in a workspace after they leave the uploader; they are removed here.
+    uploaded_doc_ids = {preview["file_key"] for preview in st.session_state.pdf_previews.values()} if uploaded_files else set()
+    if config.API_URL:
+        uploaded_doc_ids.update(st.session_state.remote_documents)
+        try:
+            workspace_documents = {entry["doc_id"]: entry for entry in api_client.list_documents(namespace=os.path.basename(workspace_path))}
+        except api_client.APIError:
+            workspace_documents = {}
+    else:
+        workspace_documents = load_manifest(workspace_path)["documents"]
+    other_documents = {doc_id: entry for doc_id, entry in workspace_documents.items() if doc_id not in uploaded_doc_ids}
+    if other_documents:
+        st.sidebar.markdown("---")
+        st.sidebar.subheader("🗂️ Other documents in this workspace")
+        for doc_id, entry in other_documents.items():
+            if st.sidebar.button(f"🗑️ {entry.get('source') or doc_id[:12]} ({entry['chunk_count']} chunks)", key=f"remove_document_{doc_id}"):
+                if config.API_URL:
+                    try:
+                        api_client.remove_document(doc_id, namespace=os.path.basename(workspace_path))
+                    except api_client.APIError as e:
+                        st.sidebar.error(f"❌ The document could not be removed: {e}")
+                        st.stop()
+                else:
+                    remove_documents([doc_id], workspace_path)
+                st.rerun()
 
 if st.session_state.pdf_previews:
     st.markdown("---")
@@ -166,17 +431,35 @@ if st.session_state.pdf_previews:
                 page_num_fitz = page_to_show_user - 1
 
                 texts_to_highlight_on_page = []
+                rects_to_highlight_on_page = []
                 if st.session_state.source_documents:
                     for src_doc in st.session_state.source_documents:
-                        if src_doc.metadata.get('source') == pdf_name and \
-                           src_doc.metadata.get('page') == page_to_show_user:
-                            texts_to_highlight_on_page.append(src_doc.page_content)
-
-                img_bytes = get_pdf_page_image_bytes(preview_data['path'], page_num_fitz, texts_to_highlight_on_page)
+                        if src_doc.metadata.get('source') != pdf_name:
+                            continue
+                        # Chunks running across a page break carry their boxes per page.
+                        page_spans = src_doc.metadata.get('page_spans')
+                        if page_spans:
+                            for span in page_spans:
+                                if span['page'] == page_to_show_user:
+                                    rects_to_highlight_on_page.extend(span.get('bboxes', []))
+                        elif src_doc.metadata.get('page') == page_to_show_user:
+                            # Chunks indexed before word boxes were recorded fall back to text search.
+                            if 'bboxes' in src_doc.metadata:
+                                rects_to_highlight_on_page.extend(src_doc.metadata['bboxes'])
+                            else:
+                                texts_to_highlight_on_page.append(src_doc.page_content)
+
+                img_bytes = get_pdf_page_image_bytes(preview_data['path'], page_num_fitz, texts_to_highlight_on_page, file_key=preview_data.get('file_key'), highlight_rects=rects_to_highlight_on_page)
                 if img_bytes:
-                    st.image(img_bytes, caption=f"{pdf_name} - page {page_to_show_user}{' (highlighted)' if texts_to_highlight_on_page else ''}", use_column_width=True)
+                    st.image(img_bytes, caption=f"{pdf_name} - page {page_to_show_user}{' (highlighted)' if texts_to_highlight_on_page or rects_to_highlight_on_page else ''}", use_column_width=True)
                 else:
                     st.warning(f"{pdf_name} - page {page_to_show_user} Preview could not be generated.")
+
+                first_thumbnail = max(0, min(page_num_fitz - config.PREVIEW_THUMBNAILS // 2, preview_data['total_pages'] - config.PREVIEW_THUMBNAILS))
+                thumbnail_pages = range(first_thumbnail, min(first_thumbnail + config.PREVIEW_THUMBNAILS, preview_data['total_pages']))
+                thumbnails = [get_preview_service().thumbnail(preview_data['path'], thumbnail_page, file_key=preview_data.get('file_key')) for thumbnail_page in thumbnail_pages]
+                if thumbnails and all(thumbnails):
+                    st.image(thumbnails, caption=[f"page {thumbnail_page + 1}" for thumbnail_page in thumbnail_pages])
             else:
                 st.info(f"{pdf_name} The content is empty or unreadable.")
 if st.session_state.page_chunk_counts:
@@ -190,7 +473,9 @@ if st.session_state.page_chunk_counts:
             else:
                 st.info(f"Density data could not be calculated for {pdf_name}.")
 
-if uploaded_files and all_chunks_for_session:
+if uploaded_files and session_has_chunks:
+    render_analysis_progress(st.session_state.analysis_job_key)
+
     if st.session_state.extracted_keywords:
         st.sidebar.markdown("---")
         st.sidebar.subheader("🔑 Keywords")
@@ -207,12 +492,12 @@ if uploaded_files and all_chunks_for_session:
                 with cols[i % num_suggestion_cols]:
                     if st.button(sq, key=f"suggested_q_{i}", use_container_width=True):
                         st.session_state.current_question_input = sq
-                        st.experimental_rerun()
+                        st.rerun()
 
     question = st.text_input("❓ Ask a Question", value=st.session_state.current_question_input, key="main_question_input_field")
     if st.session_state.main_question_input_field != st.session_state.current_question_input:
         st.session_state.current_question_input = st.session_state.main_question_input_field
-        st.experimental_rerun()
+        st.rerun()
 
     action_cols = st.columns(4)
     with action_cols[0]:
@@ -222,20 +507,26 @@ if uploaded_files and all_chunks_for_session:
             st.session_state.document_summary = ""
             st.session_state.concept_map_data = ""
             st.session_state.timeline_data = ""
-            vectorstore = load_vectorstore()
-            if vectorstore:
-                with st.spinner("Preparing answer..."):
-                    qa_chain = get_qa_chain(vectorstore, final_selected_role, selected_language_code)
-                    input_data = {"query": st.session_state.current_question_input}
-                    response_data = qa_chain.invoke(input_data)
-                    current_answer = response_data["result"]
-                    current_sources = response_data.get("source_documents", [])
-                    st.session_state.last_answer = current_answer
-                    st.session_state.source_documents = current_sources
-                    st.session_state.conversation_history.append({
-                        "question": st.session_state.current_question_input, "answer": current_answer, "sources": current_sources,
-                        "role": final_selected_role, "language": selected_language_label, "refined_answer": ""
-                    })
+            # With RAG_API_URL set, questions go to the shared API service instead of this process.
+            vectorstore = None if config.API_URL or not st.session_state.index_path else get_vectorstore(st.session_state.index_path)
+            if config.API_URL or vectorstore:
+                with st.spinner("Searching the documents..."):
+                    if config.API_URL:
+                        try:
+                            current_sources, answer_tokens, answer_stats = api_client.stream_answer(final_selected_role, st.session_state.current_question_input, selected_language_code, retrieval_mode=selected_retrieval_mode, namespace=os.path.basename(st.session_state.index_path) if st.session_state.index_path else None)
+                        except api_client.APIError as e:
+                            st.error(f"❌ The API service could not answer: {e}")
+                            st.stop()
+                    else:
+                        current_sources, answer_tokens, answer_stats = stream_answer(vectorstore, final_selected_role, st.session_state.current_question_input, selected_language_code, retrieval_mode=selected_retrieval_mode, db_path=st.session_state.index_path)
+                current_answer = render_token_stream(answer_tokens)
+                st.session_state.last_answer = current_answer
+                st.session_state.source_documents = current_sources
+                st.session_state.last_answer_stats = answer_stats
+                st.session_state.conversation_history.append({
+                    "question": st.session_state.current_question_input, "answer": current_answer, "sources": current_sources,
+                    "role": final_selected_role, "language": selected_language_label, "refined_answer": "", "stats": answer_stats
+                })
             else:
                 st.error("❌ Vector database could not be loaded. Please upload and process a PDF.")
                 st.session_state.last_answer = ""
@@ -248,10 +539,27 @@ if uploaded_files and all_chunks_for_session:
             st.session_state.source_documents = []
             st.session_state.concept_map_data = ""
             st.session_state.timeline_data = ""
-            if all_chunks_for_session:
+            # Until the background summary is done, summarize here with streaming and per-section progress;
+            # section results are shared through the result cache, so neither run repeats the other's work.
+            summary_from_job = finished_analysis("summary")
+            if summary_from_job:
+                st.session_state.document_summary = summary_from_job
+                st.session_state.summary_stats = {}
+            elif remote_analysis:
+                with st.spinner("📚 Summarizing documents on the API service... This may take some time."):
+                    try:
+                        st.session_state.document_summary = remote_analysis("summary", final_selected_role, selected_language_code)
+                    except AnalysisError as e:
+                        st.session_state.document_summary = str(e)
+                st.session_state.summary_stats = {}
+            elif session_has_chunks:
+                summary_progress = st.progress(0.0, text="📚 Summarizing document sections...")
+                def report_summary_progress(done, total):
+                    summary_progress.progress(done / max(total, 1), text=f"📚 Summarizing document sections: {done}/{total}")
                 with st.spinner("📚 Summarizing documents... This may take some time."):
-                    summary = summarize_documents(all_chunks_for_session, final_selected_role, selected_language_code)
-                    st.session_state.document_summary = summary
+                    summary_tokens, st.session_state.summary_stats = stream_summary(load_chunks(), final_selected_role, selected_language_code, progress_callback=report_summary_progress)
+                summary_progress.empty()
+                st.session_state.document_summary = render_token_stream(summary_tokens, "An error occurred while generating the summary.")
             else:
                 st.warning("⚠️ No document found to summarize. Please upload a PDF first.")
                 st.session_state.document_summary = ""
@@ -263,9 +571,12 @@ if uploaded_files and all_chunks_for_session:
             st.session_state.source_documents = []
             st.session_state.document_summary = ""
             st.session_state.timeline_data = ""
-            if all_chunks_for_session:
+            if session_has_chunks:
                 with st.spinner("🗺️ Creating concept map..."):
-                    map_data = generate_concept_map_data(all_chunks_for_session, final_selected_role, selected_language_code)
+                    try:
+                        map_data = finished_analysis("concept_map") or (remote_analysis("concept_map", final_selected_role, selected_language_code) if remote_analysis else generate_concept_map_data(load_chunks(), final_selected_role, selected_language_code))
+                    except AnalysisError as e:
+                        map_data = str(e)
                     st.session_state.concept_map_data = map_data
             else:
                 st.warning("⚠️ No document found for concept map. Please upload a PDF first.")
@@ -278,9 +589,12 @@ if uploaded_files and all_chunks_for_session:
             st.session_state.source_documents = []
             st.session_state.document_summary = ""
             st.session_state.concept_map_data = ""
-            if all_chunks_for_session:
+            if session_has_chunks:
                 with st.spinner("📅 Extracting timeline..."):
-                    timeline = extract_timeline_from_documents(all_chunks_for_session, final_selected_role, selected_language_code)
+                    try:
+                        timeline = finished_analysis("timeline") or (remote_analysis("timeline", final_selected_role, selected_language_code) if remote_analysis else extract_timeline_from_documents(load_chunks(), final_selected_role, selected_language_code))
+                    except AnalysisError as e:
+                        timeline = str(e)
                     st.session_state.timeline_data = timeline
             else:
                 st.warning("⚠️ No document found for timeline. Please upload a PDF first.")
@@ -291,6 +605,8 @@ if uploaded_files and all_chunks_for_session:
     if st.session_state.document_summary:
         st.markdown("### 📜 Document Summary")
         st.write(st.session_state.document_summary)
+        if format_generation_stats(st.session_state.summary_stats):
+            st.caption(format_generation_stats(st.session_state.summary_stats))
 
     if st.session_state.concept_map_data:
         st.markdown("### 🗺️ Concept Map")
@@ -307,35 +623,37 @@ if uploaded_files and all_chunks_for_session:
     if st.session_state.last_answer:
         st.markdown("### 💡 Latest Answer")
         st.write(st.session_state.last_answer)
+        if format_generation_stats(st.session_state.last_answer_stats):
+            st.caption(format_generation_stats(st.session_state.last_answer_stats))
 
         col_refine1, col_refine2 = st.columns(2)
         with col_refine1:
             if st.button("🔁 Elaborate Answer"):
-                from chatbot import refine_answer
                 if st.session_state.last_question and st.session_state.last_answer:
-                    with st.spinner("Elaborating answer..."):
-                        refined_text = refine_answer(st.session_state.last_question, st.session_state.last_answer, "elaborate", final_selected_role, selected_language_code)
-                        st.session_state.refined_answer = refined_text
-                        if st.session_state.conversation_history:
-                            st.session_state.conversation_history[-1]["refined_answer"] = refined_text
+                    refined_tokens, st.session_state.refined_answer_stats = stream_refine_answer(st.session_state.last_question, st.session_state.last_answer, "elaborate", final_selected_role, selected_language_code)
+                    refined_text = render_token_stream(refined_tokens, "An error occurred while refining the answer.")
+                    st.session_state.refined_answer = refined_text
+                    if st.session_state.conversation_history:
+                        st.session_state.conversation_history[-1]["refined_answer"] = refined_text
                 else:
                     st.warning("You must have an answer first to elaborate.")
 
         with col_refine2:
             if st.button("🔀 Simplify Answer"):
-                from chatbot import refine_answer
                 if st.session_state.last_question and st.session_state.last_answer:
-                    with st.spinner("Simplifying answer..."):
-                        refined_text = refine_answer(st.session_state.last_question, st.session_state.last_answer, "simplify", final_selected_role, selected_language_code)
-                        st.session_state.refined_answer = refined_text
-                        if st.session_state.conversation_history:
-                            st.session_state.conversation_history[-1]["refined_answer"] = refined_text
+                    refined_tokens, st.session_state.refined_answer_stats = stream_refine_answer(st.session_state.last_question, st.session_state.last_answer, "simplify", final_selected_role, selected_language_code)
+                    refined_text = render_token_stream(refined_tokens, "An error occurred while refining the answer.")
+                    st.session_state.refined_answer = refined_text
+                    if st.session_state.conversation_history:
+                        st.session_state.conversation_history[-1]["refined_answer"] = refined_text
                 else:
                     st.warning("You must have an answer first to simplify.")
 
         if st.session_state.refined_answer:
             st.markdown("#### ✨ Latest Refined Answer:")
             st.write(st.session_state.refined_answer)
+            if format_generation_stats(st.session_state.refined_answer_stats):
+                st.caption(format_generation_stats(st.session_state.refined_answer_stats))
 
         if st.session_state.source_documents:
             st.markdown("📚 **References:**")
@@ -343,10 +661,53 @@ if uploaded_files and all_chunks_for_session:
             for doc in st.session_state.source_documents:
                 source_name = doc.metadata.get("source", "Unknown Source")
                 page_number = doc.metadata.get("page", "Unknown Page")
+                if doc.metadata.get("page_end", page_number) != page_number:
+                    page_number = f"{page_number}-{doc.metadata['page_end']}"
+                if doc.metadata.get("duplicate_pages"):
+                    page_number = f"{page_number}; also on {', '.join(map(str, doc.metadata['duplicate_pages']))}"
                 references.add(f"- {source_name} (Page: {page_number})")
             for ref in sorted(list(references)):
                 st.markdown(ref)
 
+loaded_index_stats = registry_stats().get(st.session_state.index_path)
+if loaded_index_stats:
+    st.sidebar.caption(f"🗂️ Vector index in memory: {loaded_index_stats['vectors']} vectors, ~{loaded_index_stats['bytes'] / 1024 / 1024:.1f} MB (loaded in {loaded_index_stats['load_seconds']:.2f}s, reused {loaded_index_stats['hits']}×)")
+    index_cache = cache_stats()
+    st.sidebar.caption(f"🗄️ Loaded indexes: {index_cache['indexes']} using ~{index_cache['bytes'] / 1024 / 1024:.0f} of {index_cache['budget_bytes'] / 1024 / 1024:.0f} MB ({index_cache['evictions']} evicted)")
+
+if config.RESULT_CACHE_ENABLED:
+    analysis_cache_stats = get_result_cache().stats()
+    if analysis_cache_stats["hits"] + analysis_cache_stats["misses"]:
+        st.sidebar.caption(f"🗃️ Analysis cache: {analysis_cache_stats['hit_rate']:.0%} hit rate ({analysis_cache_stats['hits']} hits / {analysis_cache_stats['misses']} misses, {analysis_cache_stats['entries']} stored results)")
+
+for mode, mode_stats in retrieval_stats().items():
+    st.sidebar.caption(f"🔎 {mode} retrieval: {mode_stats['queries']} queries, p50 {mode_stats['p50_seconds'] * 1000:.0f} ms, p95 {mode_stats['p95_seconds'] * 1000:.0f} ms")
+
+if config.ANSWER_CACHE_ENABLED:
+    answer_cache_stats = get_answer_cache().stats()
+    if answer_cache_stats["hits"] + answer_cache_stats["misses"]:
+        st.sidebar.caption(f"⚡ Answer cache: {answer_cache_stats['hit_rate']:.0%} hit rate ({answer_cache_stats['hits']} hits, {answer_cache_stats['semantic_hits']} paraphrased / {answer_cache_stats['misses']} misses, {answer_cache_stats['entries']} answers)")
+
+preview_stats = get_preview_service().stats()
+if preview_stats["hits"] + preview_stats["misses"]:
+    st.sidebar.caption(f"🖼️ Preview cache: {preview_stats['hit_rate']:.0%} hit rate ({preview_stats['renders']} pages, {preview_stats['bytes'] / 1024 / 1024:.1f} MB, {preview_stats['documents']} open PDFs)")
+
+if config.TRACE_ENABLED and st.sidebar.checkbox("🩺 Diagnostics"):
+    with st.sidebar.expander("Pipeline stages", expanded=True):
+        stage_summary = span_summary()
+        if stage_summary:
+            st.dataframe(pd.DataFrame.from_dict(stage_summary, orient="index").sort_values("total_seconds", ascending=False), use_container_width=True)
+        else:
+            st.caption("No stages traced yet.")
+        counter_values = counters()
+        if counter_values:
+            st.dataframe(pd.DataFrame([
+                {"counter": name, "labels": ", ".join(f"{key}={value}" for key, value in labels), "value": value}
+                for (name, labels), value in sorted(counter_values.items())
+            ]), use_container_width=True, hide_index=True)
+        for finished in reversed(recent_spans(limit=20)):
+            st.caption(f"{finished['name']}: {finished['duration'] * 1000:.1f} ms {json.dumps(finished['attributes'], ensure_ascii=False, default=str)}")
+
 st.sidebar.title("📜 Conversation History")
 if not st.session_state.conversation_history:
     st.sidebar.info("No conversation history yet.")
@@ -367,6 +728,10 @@ else:
                 for doc_ref in entry['sources']:
                     source_name_ref = doc_ref.metadata.get("source", "Unknown Source")
                     page_number_ref = doc_ref.metadata.get("page", "Unknown Page")
+                    if doc_ref.metadata.get("page_end", page_number_ref) != page_number_ref:
+                        page_number_ref = f"{page_number_ref}-{doc_ref.metadata['page_end']}"
+                    if doc_ref.metadata.get("duplicate_pages"):
+                        page_number_ref = f"{page_number_ref}; also on {', '.join(map(str, doc_ref.metadata['duplicate_pages']))}"
                     current_references.add(f"- {source_name_ref} (Page: {page_number_ref})")
                 for r_ref in sorted(list(current_references)):
                     st.markdown(r_ref)
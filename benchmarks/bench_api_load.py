@@ -0,0 +1,145 @@
+"""Load test of api_server.py against the fake Ollama server.
+
+Starts the fake model server and the API (uvicorn, in-process), uploads a
+synthetic PDF through /ingest, then keeps --concurrency clients asking
+streaming questions for --duration seconds. Reports throughput, time to first
+token and full-answer latency percentiles, and how many requests the queue
+turned away with 503. Point --api-url at an already running service to load
+test that instead.
+
+    python benchmarks/bench_api_load.py --concurrency 32 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+from fake_ollama import start_fake_ollama
+from synthetic_pdf import make_synthetic_pdf, synthetic_paragraph
+
+
+def percentiles(samples):
+    if not samples:
+        return {"p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    samples = sorted(samples)
+    pick = lambda fraction: samples[min(len(samples) - 1, int(len(samples) * fraction))]
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": samples[-1]}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(port):
+    import uvicorn
+    import api_server
+    server = uvicorn.Server(uvicorn.Config(api_server.create_app(), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def client_loop(client, questions, deadline, results, rng):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        first_token = None
+        try:
+            async with client.stream("POST", "/query", json={"question": rng.choice(questions), "stream": True}) as response:
+                if response.status_code == 503:
+                    results["rejected"] += 1
+                    await asyncio.sleep(0.05)
+                    continue
+                if response.status_code != 200:
+                    results["errors"] += 1
+                    continue
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "token" and first_token is None:
+                        first_token = time.perf_counter() - started
+                    elif event["type"] == "error":
+                        results["errors"] += 1
+        except httpx.HTTPError:
+            results["errors"] += 1
+            continue
+        results["latencies"].append(time.perf_counter() - started)
+        if first_token is not None:
+            results["first_tokens"].append(first_token)
+
+
+async def run_load(api_url, questions, concurrency, duration, seed):
+    results = {"latencies": [], "first_tokens": [], "rejected": 0, "errors": 0}
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=api_url, timeout=120.0, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, questions, deadline, results, random.Random(seed + i)) for i in range(concurrency)))
+        results["seconds"] = time.perf_counter() - started
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--api-url", help="Load test this running API instead of starting one.")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-token-latency-ms", type=float, default=150.0)
+    parser.add_argument("--token-latency-ms", type=float, default=10.0)
+    parser.add_argument("--generate-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    questions = [f"What does the document say about {' '.join(synthetic_paragraph(rng, words=4).split()[:3])}?" for _ in range(200)]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        api_url = args.api_url
+        if not api_url:
+            fake = start_fake_ollama(first_token_latency=args.first_token_latency_ms / 1000, token_latency=args.token_latency_ms / 1000, generate_tokens=args.generate_tokens)
+            config.OLLAMA_BASE_URL = fake.base_url
+            config.CACHE_DIR = os.path.join(work_dir, "cache")
+            config.DATA_DIR = os.path.join(work_dir, "data")
+            config.VECTORDB_PATH = os.path.join(work_dir, "vectordb")
+            # Measure answering, not the answer cache.
+            config.ANSWER_CACHE_ENABLED = False
+            port = free_port()
+            start_api(port)
+            api_url = f"http://127.0.0.1:{port}"
+
+            pdf_path = os.path.join(work_dir, "synthetic.pdf")
+            make_synthetic_pdf(pdf_path, pages=args.pages, seed=args.seed)
+            started = time.perf_counter()
+            with open(pdf_path, "rb") as f:
+                report = httpx.post(f"{api_url}/ingest", files=[("files", ("synthetic.pdf", f.read(), "application/pdf"))], timeout=600).json()
+            print(f"ingested {args.pages} pages in {time.perf_counter() - started:.1f}s: {report['index']}")
+
+        print(f"readiness: {httpx.get(f'{api_url}/readyz').json()['checks']}")
+        results = asyncio.run(run_load(api_url, questions, args.concurrency, args.duration, args.seed))
+
+    completed = len(results["latencies"])
+    latency = percentiles(results["latencies"])
+    first_token = percentiles(results["first_tokens"])
+    print(f"{args.concurrency} clients for {results['seconds']:.1f}s: {completed} answers ({completed / results['seconds']:.1f}/s), "
+          f"{results['rejected']} rejected (503), {results['errors']} errors")
+    print(f"  first token  p50 {first_token['p50'] * 1000:8.1f} ms  p90 {first_token['p90'] * 1000:8.1f} ms  p99 {first_token['p99'] * 1000:8.1f} ms")
+    print(f"  full answer  p50 {latency['p50'] * 1000:8.1f} ms  p90 {latency['p90'] * 1000:8.1f} ms  p99 {latency['p99'] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Document-level token chunker against the per-page character splitter.
+
+Extracts synthetic PDFs once, then chunks the same pages with
+pdf_handler.chunk_pages (RecursiveCharacterTextSplitter on every page) and
+pdf_handler.chunk_document (one pass over the whole text, token-sized).
+Reports chunks/sec, the number of chunks (each one is an embedding call and a
+FAISS vector), chunk size spread in estimated tokens, small tail chunks and
+chunks that run across a page break. The "dedup" row is the document chunker
+after ingest_dedup has blanked repeated headers, footers and pages and dropped
+near-duplicate chunks; --boilerplate gives the synthetic PDFs a running header,
+a numbered footer and a repeated page to remove.
+
+    python benchmarks/bench_chunking.py --files 4 --pages 200
+    python benchmarks/bench_chunking.py --boilerplate --repeat-every 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+from context_packer import estimate_tokens
+from ingest_dedup import remove_document_duplicates, dedupe_chunks
+from pdf_handler import extract_pages_from_pdf, chunk_pages, chunk_document
+from synthetic_pdf import make_synthetic_pdf
+
+
+def measure(name, chunk_fn, documents, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = [chunk for pages_data in documents for chunk in chunk_fn(pages_data)]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tokens = [estimate_tokens(chunk.page_content) for chunk in chunks]
+    small = sum(1 for count in tokens if count < config.CHUNK_TOKENS / 4)
+    spanning = sum(1 for chunk in chunks if chunk.metadata.get("page_end", chunk.metadata.get("page")) != chunk.metadata.get("page"))
+    pages = sum(len(pages_data) for pages_data in documents)
+    print(f"{name:>10} {len(chunks):>8} {len(chunks) / best:>12.0f} {pages / best:>10.0f} {best * 1000:>9.1f} "
+          f"{statistics.median(tokens):>8.0f} {min(tokens):>6} {max(tokens):>6} {small:>7} {spanning:>9}")
+    return chunks
+
+
+def chunk_deduplicated(pages_data):
+    # Boilerplate removal replaces page_content and words, so shallow copies keep the input intact.
+    pages_data = [dict(page_data) for page_data in pages_data]
+    duplicate_pages = remove_document_duplicates(pages_data)
+    return dedupe_chunks(duplicate_pages.annotate_chunks(chunk_document(pages_data)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=200, help="Pages per synthetic PDF.")
+    parser.add_argument("--paragraphs-per-page", type=int, default=6)
+    parser.add_argument("--uniform", action="store_true", help="Same amount of text on every page (default: varying, like real documents).")
+    parser.add_argument("--boilerplate", action="store_true", help="Synthetic PDFs get a running header, a page-numbered footer and repeated pages.")
+    parser.add_argument("--repeat-every", type=int, default=20, help="With --boilerplate, every n-th page repeats the same text.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per chunker; the fastest is reported.")
+    parser.add_argument("--pdf", nargs="*", default=[], help="Chunk these PDFs instead of synthetic ones.")
+    args = parser.parse_args()
+
+    boilerplate = {"header": "Synthetic Holdings Ltd. - Annual Report", "footer": "Page {page}", "repeat_every": args.repeat_every} if args.boilerplate else {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = args.pdf or [make_synthetic_pdf(os.path.join(tmp_dir, f"doc{i}.pdf"), args.pages, seed=i, paragraphs_per_page=args.paragraphs_per_page, ragged=not args.uniform,
+                                      **boilerplate) for i in range(args.files)]
+        documents = [extract_pages_from_pdf(path) for path in paths]
+
+    print(f"{sum(len(pages) for pages in documents)} pages in {len(documents)} files; "
+          f"page splitter {config.CHUNK_SIZE} chars / {config.CHUNK_OVERLAP} overlap, "
+          f"document chunker {config.CHUNK_TOKENS} tokens / {config.CHUNK_OVERLAP_TOKENS} overlap")
+    print(f"{'chunker':>10} {'chunks':>8} {'chunks/sec':>12} {'pages/sec':>10} {'ms':>9} {'median':>8} {'min':>6} {'max':>6} {'small':>7} {'spanning':>9}")
+    page_chunks = measure("page", chunk_pages, documents, args.repeat)
+    document_chunks = measure("document", chunk_document, documents, args.repeat)
+    dedup_chunks = measure("dedup", chunk_deduplicated, documents, args.repeat)
+    print(f"document chunker: {len(document_chunks) / len(page_chunks):.0%} of the page splitter's chunks; "
+          f"with dedup: {len(dedup_chunks) / len(document_chunks):.0%} of the document chunker's")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Embedding throughput for different batch sizes and concurrency levels.
+
+Runs embedder.embed_texts against benchmarks/fake_ollama.py, or against a real
+Ollama server when --base-url is given.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+import embedder
+from fake_ollama import start_fake_ollama
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-sizes", default="1,8,32,64")
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--base-url", help="Use this Ollama server instead of the fake one.")
+    parser.add_argument("--latency-ms", type=float, default=15.0, help="Fake server latency per request.")
+    parser.add_argument("--per-item-ms", type=float, default=1.0, help="Fake server latency per embedded text.")
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        config.OLLAMA_BASE_URL = args.base_url
+    else:
+        server = start_fake_ollama(embed_latency=args.latency_ms / 1000, embed_latency_per_item=args.per_item_ms / 1000)
+        config.OLLAMA_BASE_URL = server.base_url
+
+    texts = [f"Synthetic chunk {i}. " + "lorem ipsum dolor sit amet " * 30 for i in range(args.chunks)]
+    print(f"{'batch':>6} {'workers':>8} {'seconds':>9} {'chunks/s':>10}")
+    for batch_size in map(int, args.batch_sizes.split(",")):
+        for workers in map(int, args.concurrency.split(",")):
+            started = time.perf_counter()
+            embedder.embed_texts(texts, batch_size=batch_size, max_workers=workers)
+            elapsed = time.perf_counter() - started
+            print(f"{batch_size:>6} {workers:>8} {elapsed:>9.2f} {len(texts) / elapsed:>10.1f}")
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
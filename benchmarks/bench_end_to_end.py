@@ -0,0 +1,206 @@
+"""End-to-end ingestion and answering benchmark against a fake Ollama server.
+
+Generates a synthetic PDF, then times extract_pages_from_pdf, split_pages
+(the configured chunker), embed_and_store, load_vectorstore, get_qa_chain and
+stream_answer. For each stage it reports throughput, latency percentiles and
+peak resident memory. Results are written as JSON; pass --compare with an
+earlier file to see the change per stage.
+
+    python benchmarks/bench_end_to_end.py --pages 200 --queries 20
+    python benchmarks/bench_end_to_end.py --compare benchmarks/results/<earlier>.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+from fake_ollama import start_fake_ollama
+from synthetic_pdf import make_synthetic_pdf
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is KiB on Linux and bytes on macOS; either way it only grows.
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class MemorySampler:
+    """Polls resident memory on a thread and keeps the peak seen during a stage."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_bytes = self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda fraction: samples[min(len(samples) - 1, int(len(samples) * fraction))]
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": samples[-1]}
+
+
+def run_stage(results, name, fn, items=None, unit=None, repeat=1):
+    """Run fn `repeat` times; record total seconds, per-call latency, throughput and peak RSS."""
+    latencies = []
+    with MemorySampler() as memory:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            value = fn()
+            latencies.append(time.perf_counter() - started)
+    stage = {
+        "seconds": sum(latencies),
+        "calls": repeat,
+        "latency_seconds": percentiles(latencies),
+        "peak_rss_mb": memory.peak / 1024 / 1024,
+        "rss_growth_mb": (memory.peak - memory.start_bytes) / 1024 / 1024,
+    }
+    if items is not None:
+        count = items(value) if callable(items) else items
+        stage[f"{unit}"] = count
+        stage[f"{unit}_per_sec"] = count * repeat / stage["seconds"] if stage["seconds"] > 0 else 0.0
+    results[name] = stage
+    print(f"{name:>18}: {stage['seconds']:8.3f}s  p50 {stage['latency_seconds']['p50'] * 1000:8.2f} ms  peak RSS {stage['peak_rss_mb']:7.1f} MB"
+          + (f"  {stage[unit + '_per_sec']:9.1f} {unit}/s" if items is not None else ""))
+    return value
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current, previous_path):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous['meta']['commit']} ({previous['meta']['timestamp']}):")
+    for name, stage in current["stages"].items():
+        before = previous["stages"].get(name)
+        if not before:
+            continue
+        change = stage["latency_seconds"]["p50"] / before["latency_seconds"]["p50"] - 1 if before["latency_seconds"]["p50"] else 0.0
+        print(f"{name:>18}: p50 {before['latency_seconds']['p50'] * 1000:8.2f} -> {stage['latency_seconds']['p50'] * 1000:8.2f} ms ({change:+.0%}), "
+              f"peak RSS {before['peak_rss_mb']:7.1f} -> {stage['peak_rss_mb']:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--loads", type=int, default=5, help="How many times to time load_vectorstore.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-latency-ms", type=float, default=15.0)
+    parser.add_argument("--embed-latency-per-item-ms", type=float, default=1.0)
+    parser.add_argument("--first-token-latency-ms", type=float, default=150.0)
+    parser.add_argument("--token-latency-ms", type=float, default=10.0)
+    parser.add_argument("--generate-tokens", type=int, default=64)
+    parser.add_argument("--output", help="JSON result path (default: benchmarks/results/e2e-<commit>-<time>.json).")
+    parser.add_argument("--compare", help="Earlier JSON result to compare against.")
+    args = parser.parse_args()
+
+    server = start_fake_ollama(
+        embed_latency=args.embed_latency_ms / 1000,
+        embed_latency_per_item=args.embed_latency_per_item_ms / 1000,
+        first_token_latency=args.first_token_latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000,
+        generate_tokens=args.generate_tokens,
+    )
+    config.OLLAMA_BASE_URL = server.base_url
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Every cache starts empty, so each run measures the uncached path.
+        config.CACHE_DIR = os.path.join(work_dir, "cache")
+        config.ANSWER_CACHE_ENABLED = False
+        config.RESULT_CACHE_ENABLED = False
+        import chatbot
+        import embedder
+        import pdf_handler
+
+        pdf_path = os.path.join(work_dir, "synthetic.pdf")
+        db_path = os.path.join(work_dir, "vectordb")
+        make_synthetic_pdf(pdf_path, pages=args.pages, seed=args.seed)
+        stages = {}
+
+        pages = run_stage(stages, "extract_pages", lambda: pdf_handler.extract_pages_from_pdf(pdf_path), items=args.pages, unit="pages")
+        chunks = run_stage(stages, "split_pages", lambda: pdf_handler.split_pages(pages), items=len, unit="chunks")
+        run_stage(stages, "embed_and_store", lambda: embedder.embed_and_store(chunks, db_path), items=len(chunks), unit="chunks")
+        vectorstore = run_stage(stages, "load_vectorstore", lambda: embedder.load_vectorstore(db_path), repeat=args.loads)
+
+        questions = [f"What does section {i} say about {chunks[i * 7 % len(chunks)].page_content.split()[3]}?" for i in range(args.queries)]
+        question_iter = iter(questions * 2)
+        qa_chain = chatbot.get_qa_chain(vectorstore, "Analyst", "en")
+        run_stage(stages, "qa_chain_invoke", lambda: qa_chain.invoke({"query": next(question_iter)}), items=1, unit="queries", repeat=args.queries)
+
+        first_tokens = []
+        def stream_one():
+            started = time.perf_counter()
+            _, tokens, _ = chatbot.stream_answer(vectorstore, "Analyst", next(question_iter), "en", db_path=db_path)
+            for i, _ in enumerate(tokens):
+                if i == 0:
+                    first_tokens.append(time.perf_counter() - started)
+        run_stage(stages, "stream_answer", stream_one, items=1, unit="queries", repeat=args.queries)
+        stages["stream_answer"]["time_to_first_token_seconds"] = percentiles(first_tokens)
+
+    server.shutdown()
+    result = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "chunker": config.CHUNKER,
+            "chunk_size": config.CHUNK_SIZE,
+            "chunk_overlap": config.CHUNK_OVERLAP,
+            "chunk_tokens": config.CHUNK_TOKENS,
+            "chunk_overlap_tokens": config.CHUNK_OVERLAP_TOKENS,
+            "embed_batch_size": config.EMBED_BATCH_SIZE,
+            "embed_concurrency": config.EMBED_CONCURRENCY,
+        },
+        "stages": stages,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e-{result['meta']['commit']}-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
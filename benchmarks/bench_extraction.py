@@ -0,0 +1,53 @@
+"""Scaling of pdf_handler.extract_and_chunk_pdfs from 1 to N worker processes.
+
+The sequential baseline is split_pages(extract_pages_from_pdf(path)), i.e. the
+configured chunker (RAG_CHUNKER) and dedup (RAG_DEDUP); the parallel output
+must match it chunk for chunk.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pdf_handler import extract_and_chunk_pdfs, extract_pages_from_pdf, split_pages
+from synthetic_pdf import make_synthetic_pdf
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=200, help="Pages per synthetic PDF.")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pages-per-shard", type=int, default=25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [make_synthetic_pdf(os.path.join(tmp_dir, f"doc{i}.pdf"), args.pages, seed=i) for i in range(args.files)]
+        total_pages = args.files * args.pages
+
+        started = time.perf_counter()
+        sequential = []
+        for path in paths:
+            pages_data = extract_pages_from_pdf(path)
+            sequential.append(split_pages(pages_data))
+        baseline = time.perf_counter() - started
+        print(f"{total_pages} pages in {args.files} files")
+        print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+        print(f"{'seq':>8} {baseline:>9.2f} {total_pages / baseline:>9.1f} {1.0:>8.2f}")
+
+        worker_counts = sorted({2 ** i for i in range(args.max_workers.bit_length()) if 2 ** i <= args.max_workers} | {args.max_workers})
+        for workers in worker_counts:
+            # Warm the pool so process start-up is not counted.
+            extract_and_chunk_pdfs(paths[:1], max_workers=workers, pages_per_shard=args.pages_per_shard)
+            started = time.perf_counter()
+            results = extract_and_chunk_pdfs(paths, max_workers=workers, pages_per_shard=args.pages_per_shard)
+            elapsed = time.perf_counter() - started
+            same = [[c.page_content for c in chunks] for _, chunks in results] == [[c.page_content for c in chunks] for chunks in sequential]
+            print(f"{workers:>8} {elapsed:>9.2f} {total_pages / elapsed:>9.1f} {baseline / elapsed:>8.2f}{'' if same else '  OUTPUT MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
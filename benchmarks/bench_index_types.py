@@ -0,0 +1,71 @@
+"""Recall@k, query latency and memory of each FAISS index type against exact search.
+
+Uses clustered random vectors (embeddings are never uniformly spread), so no
+Ollama server is needed. Pass --vectors with a .npy file of real embeddings,
+e.g. vectors.f32 from an ingest cache entry reshaped to (n, dim).
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+import index_types
+
+
+def clustered_vectors(count, dim, clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)] + 0.35 * rng.normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=2048, help="gemma:2b embeddings have 2048 dimensions.")
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--types", default="flat,hnsw,ivf,ivfsq,ivfpq")
+    parser.add_argument("--vectors", help="Benchmark these vectors (.npy) instead of synthetic ones.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+    else:
+        vectors = clustered_vectors(args.count, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    query_rows = rng.choice(len(vectors), args.queries, replace=False)
+    queries = vectors[query_rows] + 0.05 * rng.normal(size=(args.queries, vectors.shape[1])).astype(np.float32)
+
+    exact = index_types.build_index(vectors, "flat")
+    _, truth = exact.search(queries, args.k)
+    flat_bytes = index_types.index_bytes(exact)
+
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, nprobe {config.INDEX_NPROBE}, efSearch {config.INDEX_HNSW_EF_SEARCH}")
+    print(f"{'type':>7} {'build s':>8} {'MB':>8} {'vs flat':>8} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for index_type in args.types.split(","):
+        started = time.perf_counter()
+        index = exact if index_type == "flat" else index_types.build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - started
+        latencies = []
+        found = np.empty((args.queries, args.k), dtype=np.int64)
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            _, labels = index.search(query[None, :], args.k)
+            latencies.append(time.perf_counter() - started)
+            found[i] = labels[0]
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / args.k for i in range(args.queries)])
+        size = index_types.index_bytes(index)
+        print(f"{index_type:>7} {build_seconds:>8.1f} {size / 1024 / 1024:>8.1f} {size / flat_bytes:>8.2f} {recall:>9.2%} "
+              f"{np.percentile(latencies, 50) * 1000:>8.3f} {np.percentile(latencies, 99) * 1000:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
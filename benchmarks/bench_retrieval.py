@@ -0,0 +1,85 @@
+"""Recall@k and query latency of vector, lexical, hybrid and auto retrieval.
+
+Builds a throwaway index of synthetic chunks, each tagged with a unique
+reference code (the kind of exact term embeddings match poorly), then asks
+keyword-style and question-style queries whose answer is a known chunk. Runs
+against benchmarks/fake_ollama.py, or a real Ollama server with --base-url.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config
+from langchain_core.documents import Document
+import embedder
+import index_manager
+import retrieval
+from fake_ollama import start_fake_ollama
+from synthetic_pdf import synthetic_paragraph
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=3000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--modes", default=",".join(retrieval.RETRIEVAL_MODES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--base-url", help="Use this Ollama server instead of the fake one.")
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        config.OLLAMA_BASE_URL = args.base_url
+    else:
+        server = start_fake_ollama()
+        config.OLLAMA_BASE_URL = server.base_url
+
+    rng = random.Random(args.seed)
+    codes = [f"REF-{rng.randrange(10**6):06d}-{i}" for i in range(args.chunks)]
+    documents = [Document(page_content=f"{synthetic_paragraph(rng, words=120)} See {code}.", metadata={"source": "synthetic.pdf", "page": i // 6 + 1}) for i, code in enumerate(codes)]
+
+    with tempfile.TemporaryDirectory() as db_path:
+        started = time.perf_counter()
+        vectors = embedder.embed_documents(documents)
+        vectorstore, manifest = index_manager.open_index(db_path)
+        vectorstore = index_manager.add_document(vectorstore, manifest, "synthetic", documents, vectors, source="synthetic.pdf")
+        index_manager.save_index(vectorstore, manifest, db_path)
+        print(f"indexed {len(documents)} chunks in {time.perf_counter() - started:.1f}s")
+
+        targets = rng.sample(range(args.chunks), min(args.queries, args.chunks))
+        queries = []
+        for target in targets:
+            words = documents[target].page_content.split()
+            queries.append(("keyword", codes[target], target))
+            queries.append(("question", f"What does the document say about {' '.join(rng.sample(words[:-2], 3))} in {codes[target]}?", target))
+
+        print(f"{'mode':>8} {'queries':>9} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for mode in args.modes.split(","):
+            for kind in ("keyword", "question"):
+                hits, latencies = 0, []
+                for query_kind, query, target in queries:
+                    if query_kind != kind:
+                        continue
+                    started = time.perf_counter()
+                    found, _ = retrieval.retrieve(vectorstore, query, mode=mode, k=args.k, db_path=db_path)
+                    latencies.append(time.perf_counter() - started)
+                    hits += any(doc.id == f"synthetic:{target}" for doc in found)
+                print(f"{mode:>8} {kind:>9} {hits / len(latencies):>10.2%} {percentile(latencies, 0.5) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
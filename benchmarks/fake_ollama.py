@@ -0,0 +1,198 @@
+"""Deterministic stand-in for the parts of the Ollama HTTP API this app uses.
+
+Run it and point the app at it:
+
+    python benchmarks/fake_ollama.py --port 11535 --embed-latency-ms 20
+    OLLAMA_BASE_URL=http://127.0.0.1:11535 streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_embedding(text, dim):
+    # Signed feature hashing of the words, so texts that share words get similar
+    # vectors and retrieval benchmarks measure something; a small text-specific
+    # component keeps different texts from colliding.
+    values = [0.0] * dim
+    for word in text.lower().split():
+        digest = hashlib.sha256(word.encode("utf-8")).digest()
+        values[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    for i, b in enumerate(digest):
+        values[(i * 7919) % dim] += (b - 127.5) / 1275.0
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def fake_completion(prompt, tokens):
+    """Deterministic pseudo-answer: words drawn from the prompt, seeded by its hash."""
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    words = prompt.split() or ["ok"]
+    return [("" if i == 0 else " ") + rng.choice(words) for i in range(tokens)]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOllama/0.1"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, payload):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def _generate(self, payload, prompt, make_message):
+        tokens = fake_completion(prompt, self.server.generate_tokens)
+        self.server.record("generate", len(tokens))
+        time.sleep(self.server.first_token_latency)
+        if self._maybe_fail():
+            return
+        model = payload.get("model")
+        final = {
+            "model": model, "created_at": "1970-01-01T00:00:00Z", "done": True, "done_reason": "stop",
+            "prompt_eval_count": len(prompt.split()), "eval_count": len(tokens),
+        }
+        if payload.get("stream", True) is False:
+            time.sleep(self.server.token_latency * len(tokens))
+            self._send_json(dict(final, **make_message("".join(tokens))))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.server.token_latency)
+            self._send_chunk(dict({"model": model, "created_at": "1970-01-01T00:00:00Z", "done": False}, **make_message(token)))
+        self._send_chunk(dict(final, **make_message("")))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _maybe_fail(self):
+        if self.server.failure_rate and random.random() < self.server.failure_rate:
+            self._send_json({"error": "injected failure"}, status=500)
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json({"version": "0.0.0-fake"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name} for name in self.server.models]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == "/api/embed":
+            inputs = payload.get("input") or []
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self.server.record("embed", len(inputs))
+            time.sleep(self.server.embed_latency + self.server.embed_latency_per_item * len(inputs))
+            if self._maybe_fail():
+                return
+            self._send_json({"model": payload.get("model"), "embeddings": [fake_embedding(t, self.server.dim) for t in inputs]})
+        elif self.path == "/api/embeddings":
+            self.server.record("embed", 1)
+            time.sleep(self.server.embed_latency)
+            if self._maybe_fail():
+                return
+            self._send_json({"embedding": fake_embedding(payload.get("prompt", ""), self.server.dim)})
+        elif self.path == "/api/generate":
+            self._generate(payload, payload.get("prompt", ""), lambda text: {"response": text})
+        elif self.path == "/api/chat":
+            prompt = "\n".join(message.get("content", "") for message in payload.get("messages", []))
+            self._generate(payload, prompt, lambda text: {"message": {"role": "assistant", "content": text}})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dim=256, embed_latency=0.0, embed_latency_per_item=0.0, first_token_latency=0.0, token_latency=0.0, generate_tokens=64, failure_rate=0.0, models=("gemma:2b",), verbose=False):
+        super().__init__(address, FakeOllamaHandler)
+        self.dim = dim
+        self.embed_latency = embed_latency
+        self.embed_latency_per_item = embed_latency_per_item
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.generate_tokens = generate_tokens
+        self.failure_rate = failure_rate
+        self.models = list(models)
+        self.verbose = verbose
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, kind, items):
+        with self._lock:
+            requests, total = self.counters.get(kind, (0, 0))
+            self.counters[kind] = (requests + 1, total + items)
+
+
+def start_fake_ollama(host="127.0.0.1", port=0, **kwargs):
+    server = FakeOllamaServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11535)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Fixed latency per embed request.")
+    parser.add_argument("--embed-latency-per-item-ms", type=float, default=0.0, help="Extra latency per embedded text.")
+    parser.add_argument("--first-token-latency-ms", type=float, default=0.0, help="Delay before the first generated token.")
+    parser.add_argument("--token-latency-ms", type=float, default=0.0, help="Delay between generated tokens.")
+    parser.add_argument("--generate-tokens", type=int, default=64, help="Tokens per generated answer.")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500.")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(
+        (args.host, args.port),
+        dim=args.dim,
+        embed_latency=args.embed_latency_ms / 1000,
+        embed_latency_per_item=args.embed_latency_per_item_ms / 1000,
+        first_token_latency=args.first_token_latency_ms / 1000,
+        token_latency=args.token_latency_ms / 1000,
+        generate_tokens=args.generate_tokens,
+        failure_rate=args.failure_rate,
+        verbose=args.verbose,
+    )
+    print(f"Fake Ollama listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
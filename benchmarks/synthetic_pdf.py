@@ -0,0 +1,40 @@
+"""Generate reproducible text-heavy PDFs for the benchmarks."""
+import random
+import fitz
+
+WORDS = (
+    "contract article clause liability patient dosage diagnosis statute court evidence "
+    "engineering tolerance load bearing inflation interest market therapy behaviour cognitive "
+    "report section annex table figure regulation compliance procedure analysis summary result "
+    "method protocol safety standard requirement 2019 2020 2021 2022 2023 ISO-9001 Art.12"
+).split()
+
+
+def synthetic_paragraph(rng, words=80):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def make_synthetic_pdf(path, pages, seed=0, paragraphs_per_page=6, header=None, footer=None, ragged=False, repeat_every=0):
+    """ragged: pages hold 1..paragraphs_per_page paragraphs of varying length, like real documents.
+    repeat_every: every n-th page repeats the same text (like standard terms printed after each section)."""
+    rng = random.Random(seed)
+    repeated = "\n\n".join(synthetic_paragraph(random.Random(-1 - seed)) for _ in range(paragraphs_per_page))
+    doc = fitz.open()
+    for page_number in range(1, pages + 1):
+        page = doc.new_page()
+        if repeat_every and page_number % repeat_every == 0:
+            body = repeated
+        elif ragged:
+            body = "\n\n".join(synthetic_paragraph(rng, words=rng.randint(20, 120)) for _ in range(rng.randint(1, paragraphs_per_page)))
+        else:
+            body = "\n\n".join(synthetic_paragraph(rng) for _ in range(paragraphs_per_page))
+        top = 72
+        if header:
+            page.insert_text((72, 40), header, fontsize=9)
+        page.insert_textbox(fitz.Rect(72, top, page.rect.width - 72, page.rect.height - 60), body, fontsize=9)
+        if footer:
+            page.insert_text((72, page.rect.height - 30), footer.format(page=page_number), fontsize=9)
+    doc.save(path)
+    doc.close()
+    return path
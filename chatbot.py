@@ -1,9 +1,22 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from langchain.chains import RetrievalQA
-from langchain_ollama import OllamaLLM
+from llm_client import get_llm, generate, stream
+from result_cache import cached_generate, cached_stream
 from prompts import get_prompt_template
+from retrieval import retrieve, is_keyword_query
+from answer_cache import get_answer_cache
+from embedder import embed_texts
+from context_packer import pack_context, dedupe_texts
+from telemetry import traced, annotate, increment, record_span, current_trace
+import config
+
+class AnalysisError(Exception):
+    """The model could not produce an analysis. The message is meant for the user; the result is never cached."""
 
 def get_qa_chain(vectorstore, role, language_code="tr"):
-    llm = OllamaLLM(model="gemma:2b")
+    llm = get_llm()
     prompt = get_prompt_template(role, language_code)
     qa_chain = RetrievalQA.from_chain_type(
         llm=llm,
@@ -14,20 +27,85 @@ def get_qa_chain(vectorstore, role, language_code="tr"):
     )
     return qa_chain
 
-def refine_answer(original_question, original_answer, refinement_type, role, language_code="tr"):
-    llm = OllamaLLM(model="gemma:2b")
-    if refinement_type == "detaylandır":
+def _stream_with_stats(prompt_text, stats, cache_task=None, trace=None):
+    # Ollama streams roughly one token per chunk, so chunks are counted as tokens.
+    # The body runs when the caller consumes it, so the span that created it is passed in as `trace`.
+    trace_id, parent_id = trace or current_trace()
+    started_at = time.perf_counter()
+    first_token_at = None
+    token_count = 0
+    for token in (cached_stream(cache_task, prompt_text) if cache_task else stream(prompt_text)):
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+            stats["time_to_first_token"] = first_token_at - started_at
+        token_count += 1
+        yield token
+    finished_at = time.perf_counter()
+    generation_seconds = finished_at - (first_token_at or finished_at)
+    stats["tokens"] = token_count
+    stats["generation_seconds"] = finished_at - started_at
+    stats["tokens_per_sec"] = token_count / generation_seconds if generation_seconds > 0 else 0.0
+    stats["prompt_chars"] = len(prompt_text)
+    span_attributes = {key: stats.get(key) for key in ("tokens", "tokens_per_sec", "time_to_first_token", "prompt_chars")}
+    record_span("answer.generate", stats["generation_seconds"], span_attributes, trace_id=trace_id, parent_id=parent_id)
+
+def _embed_question(question):
+    return embed_texts([question])[0]
+
+def _stream_and_cache_answer(token_iterator, db_path, role, language_code, question, question_vector, source_documents):
+    parts = []
+    for token in token_iterator:
+        parts.append(token)
+        yield token
+    if parts:
+        get_answer_cache().put(db_path, role, language_code, question, question_vector, "".join(parts), source_documents)
+
+@traced("answer.prepare")
+def stream_answer(vectorstore, role, question, language_code="tr", retrieval_mode=None, db_path=config.VECTORDB_PATH):
+    """Retrieve first, then stream the answer.
+
+    Returns (source_documents, token_iterator, stats); ``stats`` is filled in
+    while the iterator is consumed. Repeated and near-duplicate questions are
+    answered from the answer cache without retrieval or generation.
+    """
+    question_vector = None
+    if config.ANSWER_CACHE_ENABLED:
+        started_at = time.perf_counter()
+        try:
+            # Keyword queries are served by BM25 alone, so they are not embedded just for the cache.
+            mode = retrieval_mode or config.RETRIEVAL_MODE
+            lexical_only = mode == "lexical" or (mode == "auto" and is_keyword_query(question))
+            cached, similarity, question_vector = get_answer_cache().lookup(db_path, role, language_code, question, None if lexical_only else _embed_question)
+        except Exception as e:
+            print(f"Answer cache lookup failed: {e}")
+            cached, similarity = None, 0.0
+        increment("answer_cache_lookups", result="miss" if cached is None else ("exact_hit" if similarity >= 1.0 else "semantic_hit"))
+        annotate(answer_cache="miss" if cached is None else "hit")
+        if cached is not None:
+            stats = {"answer_cache": "hit", "cache_similarity": similarity, "cached_question": cached["question"], "retrieval_seconds": time.perf_counter() - started_at}
+            return cached["source_documents"], iter([cached["answer"]]), stats
+    source_documents, stats = retrieve(vectorstore, question, mode=retrieval_mode, db_path=db_path, query_vector=question_vector)
+    context = "\n\n".join(doc.page_content for doc in source_documents)
+    prompt_text = get_prompt_template(role, language_code).format(context=context, question=question)
+    annotate(mode=stats["mode"], documents=len(source_documents), prompt_chars=len(prompt_text))
+    token_iterator = _stream_with_stats(prompt_text, stats, trace=current_trace())
+    if config.ANSWER_CACHE_ENABLED:
+        token_iterator = _stream_and_cache_answer(token_iterator, db_path, role, language_code, question, question_vector, source_documents)
+    return source_documents, token_iterator, stats
+
+def _refine_prompt(original_question, original_answer, refinement_type, role, language_code="tr"):
+    if refinement_type in ("detaylandır", "elaborate"):
         refinement_instruction = "Expand the above answer with more technical terms and explanations."
-    elif refinement_type == "sadeleştir":
+    elif refinement_type in ("sadeleştir", "simplify"):
         refinement_instruction = "Rephrase the above answer in simpler language that anyone can understand."
     else:
-        return "Invalid refinement type."
+        return None
     language_instruction = ""
     if language_code == "en":
         language_instruction = "Provide the refined answer in English."
     elif language_code == "tr":
         language_instruction = "Provide the refined answer in Turkish."
-    prompt_text = f"""You are acting as a '{role}'.
+    return f"""You are acting as a '{role}'.
 User's question: "{original_question}"
 Initial answer: "{original_answer}"
 
@@ -35,22 +113,27 @@ TASK: {refinement_instruction}
 {language_instruction}
 Only provide the refined answer.
 """
+
+def refine_answer(original_question, original_answer, refinement_type, role, language_code="tr"):
+    prompt_text = _refine_prompt(original_question, original_answer, refinement_type, role, language_code)
+    if prompt_text is None:
+        return "Invalid refinement type."
     try:
-        refined_response = llm.invoke(prompt_text)
+        refined_response = generate(prompt_text)
         return refined_response 
     except Exception as e:
         print(f"Error while refining answer: {e}")
         return "An error occurred while refining the answer."
 
+def stream_refine_answer(original_question, original_answer, refinement_type, role, language_code="tr"):
+    prompt_text = _refine_prompt(original_question, original_answer, refinement_type, role, language_code)
+    if prompt_text is None:
+        return iter(["Invalid refinement type."]), {}
+    stats = {}
+    return _stream_with_stats(prompt_text, stats), stats
+
 def generate_suggested_questions(document_chunks, role, language_code="tr", num_questions=3):
-    llm = OllamaLLM(model="gemma:2b")
-    context_text = ""
-    char_limit = 2000
-    for chunk_doc in document_chunks:
-        if len(context_text) + len(chunk_doc.page_content) < char_limit:
-            context_text += chunk_doc.page_content + "\n\n"
-        else:
-            break
+    context_text = pack_context([chunk_doc.page_content for chunk_doc in document_chunks], config.CONTEXT_TOKENS_QUESTIONS)
     if not context_text:
         context_text = "General questions about the document content."
     if language_code == "en":
@@ -69,25 +152,19 @@ Content Summary:
 {output_format_instruction}
 """
     try:
-        response = llm.invoke(prompt_text)
+        response = cached_generate("suggested_questions", prompt_text)
         suggested_questions = [q.strip() for q in response.split('\n') if q.strip()]
         return suggested_questions[:num_questions]
     except Exception as e:
         print(f"Error while generating suggested questions: {e}")
-        return []
+        raise AnalysisError("An error occurred while generating suggested questions.") from e
 
-def summarize_documents(document_chunks, role, language_code="tr"):
-    llm = OllamaLLM(model="gemma:2b")
-    full_text = ""
-    char_limit_for_summary = 10000
-    for chunk_doc in document_chunks:
-        if len(full_text) + len(chunk_doc.page_content) < char_limit_for_summary:
-            full_text += chunk_doc.page_content + "\n\n"
-        else:
-            full_text += "\n\n[Part of the content was truncated due to token limits.]"
-            break
-    if not full_text.strip():
-        return "No content available to summarize."
+def _summary_language(language_code):
+    return "English" if language_code == "en" else "Turkish"
+
+def _summary_prompt(text, role, language_code="tr"):
+    if not text.strip():
+        return None
     if language_code == "en":
         summary_language_instruction = "Provide the summary in English."
         role_instruction = f"You are acting as a '{role}'."
@@ -96,33 +173,133 @@ def summarize_documents(document_chunks, role, language_code="tr"):
         summary_language_instruction = "Provide the summary in Turkish."
         role_instruction = f"You are acting as a '{role}'."
         task_instruction = "Generate a comprehensive summary of the following text."
-    prompt_text = f"""{role_instruction}
+    return f"""{role_instruction}
 {task_instruction}
 {summary_language_instruction}
 
 Text:
 ---
-{full_text.strip()}
+{text.strip()}
 ---
 
 Please provide a well-structured summary including the main points of the above text.
 """
+
+def _section_summary_prompt(text, role, language_code="tr"):
+    return f"""You are acting as a '{role}'.
+The text below is one section of a longer document. Summarize this section concisely, keeping key facts, names, numbers and dates.
+Provide the summary in {_summary_language(language_code)}.
+
+Section:
+---
+{text.strip()}
+---
+
+Only provide the summary of this section.
+"""
+
+def _combine_summaries_prompt(text, role, language_code="tr"):
+    return f"""You are acting as a '{role}'.
+The text below consists of summaries of consecutive sections of one document. Merge them into a single concise summary that preserves the important facts, names, numbers and dates.
+Provide the summary in {_summary_language(language_code)}.
+
+Section summaries:
+---
+{text.strip()}
+---
+
+Only provide the merged summary.
+"""
+
+def _group_texts(texts, char_limit):
+    groups, current, current_len = [], [], 0
+    for text in texts:
+        if current and current_len + len(text) > char_limit:
+            groups.append("\n\n".join(current))
+            current, current_len = [], 0
+        current.append(text)
+        current_len += len(text) + 2
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+def _summarize_groups(groups, task, prompt_builder, role, language_code, progress_callback=None, progress_offset=0, progress_total=0):
+    # Concurrency is bounded here and, across users, by the LLM generation queue.
+    summaries = [None] * len(groups)
+    with ThreadPoolExecutor(max_workers=config.SUMMARY_MAX_WORKERS) as executor:
+        # Each call runs in a copy of this context, so a background summary stays background in the pool.
+        futures = {executor.submit(contextvars.copy_context().run, cached_generate, task, prompt_builder(group, role, language_code)): i for i, group in enumerate(groups)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            summaries[futures[future]] = future.result().strip()
+            if progress_callback:
+                progress_callback(progress_offset + done, progress_total)
+    return summaries
+
+def summarize_sections(document_chunks, role, language_code="tr", progress_callback=None):
+    """Map step: one summary per consecutive group of chunks (each group fits one prompt).
+
+    Results go through the result cache, so repeated runs and other analyses can reuse them.
+    """
+    groups = _group_texts(_chunk_texts(document_chunks), config.SUMMARY_CHAR_LIMIT)
+    return _summarize_groups(groups, "summary_section", _section_summary_prompt, role, language_code, progress_callback, 0, len(groups))
+
+def _chunk_texts(document_chunks):
+    # Repeated chunks and the overlap between neighbours would only be summarized twice.
+    return dedupe_texts([chunk_doc.page_content for chunk_doc in document_chunks])
+
+def _analysis_texts(document_chunks):
+    """Texts the single-prompt analyses pack their context from: the chunks themselves.
+
+    Cached section summaries are not used even when they exist, so a document's
+    prompt does not depend on whether its summary job has finished yet.
+    """
+    return [chunk_doc.page_content for chunk_doc in document_chunks]
+
+def _summary_source_text(document_chunks, role, language_code="tr", progress_callback=None):
+    """Reduce the whole corpus to text that fits one summary prompt (hierarchical map-reduce).
+
+    Every section is still summarized, and each reduce level adds about half as
+    many generations again. Wall time is therefore linear in document length,
+    divided by the SUMMARY_MAX_WORKERS sections generated at a time.
+    """
+    texts = _chunk_texts(document_chunks)
+    if sum(len(text) + 2 for text in texts) <= config.SUMMARY_CHAR_LIMIT:
+        return "\n\n".join(texts)
+    summaries = summarize_sections(document_chunks, role, language_code, progress_callback)
+    level = 1
+    while sum(len(summary) + 2 for summary in summaries) > config.SUMMARY_CHAR_LIMIT and len(summaries) > 1:
+        groups = _group_texts(summaries, config.SUMMARY_CHAR_LIMIT)
+        if len(groups) == len(summaries):
+            # Every summary fills a prompt on its own; merge pairwise to keep shrinking.
+            groups = ["\n\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+        summaries = _summarize_groups(groups, f"summary_reduce_{level}", _combine_summaries_prompt, role, language_code)
+        level += 1
+    return "\n\n".join(summaries)[:config.SUMMARY_CHAR_LIMIT]
+
+def summarize_documents(document_chunks, role, language_code="tr", progress_callback=None):
     try:
-        response = llm.invoke(prompt_text)
+        prompt_text = _summary_prompt(_summary_source_text(document_chunks, role, language_code, progress_callback), role, language_code)
+        if prompt_text is None:
+            return "No content available to summarize."
+        response = cached_generate("summary", prompt_text)
         return response
     except Exception as e:
         print(f"Error while generating summary: {e}")
-        return "An error occurred while generating the summary."
+        raise AnalysisError("An error occurred while generating the summary.") from e
+
+def stream_summary(document_chunks, role, language_code="tr", progress_callback=None):
+    try:
+        prompt_text = _summary_prompt(_summary_source_text(document_chunks, role, language_code, progress_callback), role, language_code)
+    except Exception as e:
+        print(f"Error while summarizing document sections: {e}")
+        return iter(["An error occurred while generating the summary."]), {}
+    if prompt_text is None:
+        return iter(["No content available to summarize."]), {}
+    stats = {}
+    return _stream_with_stats(prompt_text, stats, cache_task="summary"), stats
 
 def extract_keywords_from_documents(document_chunks, role, language_code="tr", num_keywords=10):
-    llm = OllamaLLM(model="gemma:2b")
-    full_text = ""
-    char_limit_for_keywords = 5000 
-    for chunk_doc in document_chunks:
-        if len(full_text) + len(chunk_doc.page_content) < char_limit_for_keywords:
-            full_text += chunk_doc.page_content + "\n\n"
-        else:
-            break
+    full_text = pack_context(_analysis_texts(document_chunks), config.CONTEXT_TOKENS_KEYWORDS)
     if not full_text.strip():
         return []
     if language_code == "en":
@@ -147,22 +324,15 @@ Text:
 {output_format_instruction}
 """
     try:
-        response = llm.invoke(prompt_text)
+        response = cached_generate("keywords", prompt_text)
         keywords = [kw.strip() for kw in response.split(',') if kw.strip()]
         return keywords[:num_keywords]
     except Exception as e:
         print(f"Error while extracting keywords: {e}")
-        return []
+        raise AnalysisError("An error occurred while extracting keywords.") from e
 
 def generate_concept_map_data(document_chunks, role, language_code="tr"):
-    llm = OllamaLLM(model="gemma:2b")
-    full_text = ""
-    char_limit_for_map = 7000
-    for chunk_doc in document_chunks:
-        if len(full_text) + len(chunk_doc.page_content) < char_limit_for_map:
-            full_text += chunk_doc.page_content + "\n\n"
-        else:
-            break
+    full_text = pack_context(_analysis_texts(document_chunks), config.CONTEXT_TOKENS_CONCEPT_MAP)
     if not full_text.strip():
         return "No content found for concept map."
     if language_code == "en":
@@ -206,36 +376,27 @@ Lütfen SADECE Mermaid.js kod bloğunu (` ```mermaid ... ``` `) yanıt olarak ve
 """
 
     try:
-        response = llm.invoke(prompt_text)
-        # Modelin doğrudan ```mermaid ... ``` bloğunu döndürdüğünü varsayıyoruz.
-        # Eğer değilse, bu bloğu ayıklamak için ek işlem gerekebilir.
-        if "```mermaid" in response and "```" in response.split("```mermaid")[1]:
-            mermaid_code = "```mermaid" + response.split("```mermaid")[1].split("```")[0] + "```"
-            return mermaid_code.strip()
-        else: # Basit bir fallback veya hata
-            print(f"Model beklenen Mermaid formatında yanıt vermedi: {response}")
-            # Belki de sadece metin tabanlı bir hiyerarşi istemek daha güvenli olabilir.
-            # Şimdilik bu şekilde bırakalım.
-            return "Konsept haritası üretilemedi (beklenen formatta değil)." 
-            
+        response = cached_generate("concept_map", prompt_text)
     except Exception as e:
         print(f"Konsept haritası üretilirken hata: {e}")
-        return "Konsept haritası üretilirken bir sorun oluştu."
+        raise AnalysisError("Konsept haritası üretilirken bir sorun oluştu.") from e
+    # Modelin doğrudan ```mermaid ... ``` bloğunu döndürdüğünü varsayıyoruz.
+    # Eğer değilse, bu bloğu ayıklamak için ek işlem gerekebilir.
+    if "```mermaid" in response and "```" in response.split("```mermaid")[1]:
+        mermaid_code = "```mermaid" + response.split("```mermaid")[1].split("```")[0] + "```"
+        return mermaid_code.strip()
+    # Basit bir fallback veya hata
+    print(f"Model beklenen Mermaid formatında yanıt vermedi: {response}")
+    # Belki de sadece metin tabanlı bir hiyerarşi istemek daha güvenli olabilir.
+    raise AnalysisError("Konsept haritası üretilemedi (beklenen formatta değil).")
 
 def extract_timeline_from_documents(document_chunks, role, language_code="tr"):
     """
     Yüklenen belgelerden tarihsel olayları çıkarıp bir zaman çizelgesi oluşturur.
     """
-    llm = OllamaLLM(model="gemma:2b")
-
-    # Metnin tamamını veya önemli bir kısmını alalım
-    full_text = ""
-    char_limit_for_timeline = 8000 # Zaman çizelgesi için daha fazla bağlam gerekebilir
-    for chunk_doc in document_chunks:
-        if len(full_text) + len(chunk_doc.page_content) < char_limit_for_timeline:
-            full_text += chunk_doc.page_content + "\n\n"
-        else:
-            break
+
+    # Tüm belgeden, token bütçesine sığan temsilci parçaları alalım
+    full_text = pack_context(_analysis_texts(document_chunks), config.CONTEXT_TOKENS_TIMELINE)
     
     if not full_text.strip():
         return "Zaman çizelgesi için içerik bulunamadı."
@@ -263,9 +424,9 @@ Lütfen bulunan olayları kronolojik sıraya göre, her biri yeni bir satırda o
 """
 
     try:
-        response = llm.invoke(prompt_text)
+        response = cached_generate("timeline", prompt_text)
         # Yanıtın doğrudan markdown listesi veya ilgili mesaj olduğunu varsayıyoruz.
         return response 
     except Exception as e:
         print(f"Zaman çizelgesi çıkarılırken hata: {e}")
-        return "Zaman çizelgesi çıkarılırken bir sorun oluştu."
\ No newline at end of file
+        raise AnalysisError("Zaman çizelgesi çıkarılırken bir sorun oluştu.") from e
\ No newline at end of file
@@ -0,0 +1,125 @@
+import os
+
+EMBEDDING_MODEL = os.getenv("RAG_EMBEDDING_MODEL", "gemma:2b")
+LLM_MODEL = os.getenv("RAG_LLM_MODEL", "gemma:2b")
+
+CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "150"))
+# "document" chunks the whole text of a PDF by estimated tokens, across page
+# breaks; "page" splits every page on its own by RAG_CHUNK_SIZE characters.
+CHUNKER = os.getenv("RAG_CHUNKER", "document")
+CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "300"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("RAG_CHUNK_OVERLAP_TOKENS", "40"))
+# Token counts are estimated from characters; the models' tokenizers are not available locally.
+CHARS_PER_TOKEN = float(os.getenv("RAG_CHARS_PER_TOKEN", "3.5"))
+# Ingest-time removal of repeated text: header/footer lines found on at least
+# RAG_BOILERPLATE_MIN_PAGE_FRACTION of the pages (within the first and last
+# RAG_BOILERPLATE_EDGE_LINES lines) are blanked, and chunks whose MinHash
+# similarity to an earlier chunk reaches RAG_DEDUP_THRESHOLD are dropped.
+DEDUP_ENABLED = os.getenv("RAG_DEDUP", "1") != "0"
+BOILERPLATE_EDGE_LINES = int(os.getenv("RAG_BOILERPLATE_EDGE_LINES", "3"))
+BOILERPLATE_MIN_PAGE_FRACTION = float(os.getenv("RAG_BOILERPLATE_MIN_PAGE_FRACTION", "0.5"))
+BOILERPLATE_SAMPLE_PAGES = int(os.getenv("RAG_BOILERPLATE_SAMPLE_PAGES", "50"))
+DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.85"))
+DEDUP_MINHASH_PERMUTATIONS = int(os.getenv("RAG_DEDUP_MINHASH_PERMUTATIONS", "64"))
+DEDUP_LSH_BANDS = int(os.getenv("RAG_DEDUP_LSH_BANDS", "16"))
+
+DATA_DIR = os.getenv("RAG_DATA_DIR", "data")
+VECTORDB_PATH = os.getenv("RAG_VECTORDB_PATH", "vectordb/db.faiss")
+CACHE_DIR = os.getenv("RAG_CACHE_DIR", "cache")
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "32"))
+EMBED_CONCURRENCY = int(os.getenv("RAG_EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("RAG_EMBED_MAX_RETRIES", "3"))
+
+EMBED_CACHE_ENABLED = os.getenv("RAG_EMBED_CACHE", "1") != "0"
+EMBED_CACHE_MAX_MB = int(os.getenv("RAG_EMBED_CACHE_MAX_MB", "512"))
+EMBED_CACHE_DTYPE = os.getenv("RAG_EMBED_CACHE_DTYPE", "float16")
+
+EXTRACT_WORKERS = int(os.getenv("RAG_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+EXTRACT_PAGES_PER_SHARD = int(os.getenv("RAG_EXTRACT_PAGES_PER_SHARD", "25"))
+
+STREAMING_PAGE_THRESHOLD = int(os.getenv("RAG_STREAMING_PAGE_THRESHOLD", "300"))
+STREAM_BATCH_SIZE = int(os.getenv("RAG_STREAM_BATCH_SIZE", "64"))
+STREAM_QUEUE_SIZE = int(os.getenv("RAG_STREAM_QUEUE_SIZE", "2"))
+STREAM_CHECKPOINT_EVERY = int(os.getenv("RAG_STREAM_CHECKPOINT_EVERY", "10"))
+
+OLLAMA_KEEP_ALIVE_SECONDS = int(os.getenv("RAG_OLLAMA_KEEP_ALIVE_SECONDS", "1800"))
+OLLAMA_TIMEOUT_SECONDS = float(os.getenv("RAG_OLLAMA_TIMEOUT_SECONDS", "300"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("RAG_OLLAMA_MAX_CONNECTIONS", "16"))
+LLM_MAX_CONCURRENCY = int(os.getenv("RAG_LLM_MAX_CONCURRENCY", "2"))
+
+RESULT_CACHE_ENABLED = os.getenv("RAG_RESULT_CACHE", "1") != "0"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RAG_RESULT_CACHE_MAX_ENTRIES", "2000"))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RAG_RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+SUMMARY_CHAR_LIMIT = int(os.getenv("RAG_SUMMARY_CHAR_LIMIT", "10000"))
+SUMMARY_MAX_WORKERS = int(os.getenv("RAG_SUMMARY_MAX_WORKERS", str(LLM_MAX_CONCURRENCY)))
+
+# Token budgets for the context each single-prompt analysis packs from the corpus.
+CONTEXT_TOKENS_QUESTIONS = int(os.getenv("RAG_CONTEXT_TOKENS_QUESTIONS", "512"))
+CONTEXT_TOKENS_KEYWORDS = int(os.getenv("RAG_CONTEXT_TOKENS_KEYWORDS", "1024"))
+CONTEXT_TOKENS_CONCEPT_MAP = int(os.getenv("RAG_CONTEXT_TOKENS_CONCEPT_MAP", "1536"))
+CONTEXT_TOKENS_TIMELINE = int(os.getenv("RAG_CONTEXT_TOKENS_TIMELINE", "2048"))
+
+ANALYSIS_JOB_WORKERS = int(os.getenv("RAG_ANALYSIS_JOB_WORKERS", "5"))
+ANALYSIS_JOB_GROUPS_KEPT = int(os.getenv("RAG_ANALYSIS_JOB_GROUPS_KEPT", "32"))
+ANALYSIS_POLL_SECONDS = float(os.getenv("RAG_ANALYSIS_POLL_SECONDS", "2"))
+
+PREVIEW_ZOOM = float(os.getenv("RAG_PREVIEW_ZOOM", "1.0"))
+PREVIEW_THUMBNAIL_ZOOM = float(os.getenv("RAG_PREVIEW_THUMBNAIL_ZOOM", "0.2"))
+PREVIEW_MAX_DOCUMENTS = int(os.getenv("RAG_PREVIEW_MAX_DOCUMENTS", "8"))
+PREVIEW_CACHE_MAX_MB = int(os.getenv("RAG_PREVIEW_CACHE_MAX_MB", "128"))
+PREVIEW_PREFETCH_PAGES = int(os.getenv("RAG_PREVIEW_PREFETCH_PAGES", "1"))
+PREVIEW_THUMBNAILS = int(os.getenv("RAG_PREVIEW_THUMBNAILS", "5"))
+
+RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "auto")
+RETRIEVAL_TOP_K = int(os.getenv("RAG_RETRIEVAL_TOP_K", "4"))
+HYBRID_FETCH_K = int(os.getenv("RAG_HYBRID_FETCH_K", "20"))
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+LEXICAL_FAST_PATH_MAX_TERMS = int(os.getenv("RAG_LEXICAL_FAST_PATH_MAX_TERMS", "4"))
+LEXICAL_DOMINANCE_RATIO = float(os.getenv("RAG_LEXICAL_DOMINANCE_RATIO", "3.0"))
+
+INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "auto")
+INDEX_AUTO_FLAT_MAX = int(os.getenv("RAG_INDEX_AUTO_FLAT_MAX", "20000"))
+INDEX_AUTO_PQ_MIN = int(os.getenv("RAG_INDEX_AUTO_PQ_MIN", "200000"))
+INDEX_TRAIN_SAMPLE = int(os.getenv("RAG_INDEX_TRAIN_SAMPLE", "100000"))
+INDEX_RETRAIN_GROWTH = float(os.getenv("RAG_INDEX_RETRAIN_GROWTH", "4"))
+INDEX_NPROBE = int(os.getenv("RAG_INDEX_NPROBE", "16"))
+INDEX_HNSW_M = int(os.getenv("RAG_INDEX_HNSW_M", "32"))
+INDEX_HNSW_EF_SEARCH = int(os.getenv("RAG_INDEX_HNSW_EF_SEARCH", "64"))
+INDEX_PQ_BYTES = int(os.getenv("RAG_INDEX_PQ_BYTES", "64"))
+
+ANSWER_CACHE_ENABLED = os.getenv("RAG_ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("RAG_ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("RAG_ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+TRACE_ENABLED = os.getenv("RAG_TRACE", "1") != "0"
+TRACE_BUFFER_SIZE = int(os.getenv("RAG_TRACE_BUFFER_SIZE", "2000"))
+TRACE_JSONL_PATH = os.getenv("RAG_TRACE_JSONL", "")
+METRICS_PORT = int(os.getenv("RAG_METRICS_PORT", "0"))
+
+API_HOST = os.getenv("RAG_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("RAG_API_PORT", "8000"))
+API_URL = os.getenv("RAG_API_URL", "")
+API_MAX_CONCURRENT_QUERIES = int(os.getenv("RAG_API_MAX_CONCURRENT_QUERIES", "8"))
+API_MAX_QUEUED_QUERIES = int(os.getenv("RAG_API_MAX_QUEUED_QUERIES", "64"))
+API_MAX_CONCURRENT_INGESTS = int(os.getenv("RAG_API_MAX_CONCURRENT_INGESTS", "1"))
+API_MAX_QUEUED_INGESTS = int(os.getenv("RAG_API_MAX_QUEUED_INGESTS", "4"))
+API_MAX_CONCURRENT_ANALYSES = int(os.getenv("RAG_API_MAX_CONCURRENT_ANALYSES", "4"))
+API_MAX_QUEUED_ANALYSES = int(os.getenv("RAG_API_MAX_QUEUED_ANALYSES", "16"))
+API_QUEUE_TIMEOUT_SECONDS = float(os.getenv("RAG_API_QUEUE_TIMEOUT_SECONDS", "30"))
+API_RETRY_AFTER_SECONDS = int(os.getenv("RAG_API_RETRY_AFTER_SECONDS", "5"))
+API_MAX_UPLOAD_MB = int(os.getenv("RAG_API_MAX_UPLOAD_MB", "200"))
+API_DEFAULT_ROLE = os.getenv("RAG_API_DEFAULT_ROLE", "Analyst")
+API_DEFAULT_LANGUAGE = os.getenv("RAG_API_DEFAULT_LANGUAGE", "en")
+
+VECTORDB_ROOT = os.getenv("RAG_VECTORDB_ROOT", os.path.dirname(VECTORDB_PATH) or "vectordb")
+INDEX_VERSIONS_KEPT = int(os.getenv("RAG_INDEX_VERSIONS_KEPT", "3"))
+INDEX_CACHE_MAX_MB = int(os.getenv("RAG_INDEX_CACHE_MAX_MB", "2048"))
+
+INDEX_MMAP = os.getenv("RAG_INDEX_MMAP", "1") != "0"
+# Unpickling runs code from the file, so indexes in the old index.pkl format are only opened when asked for.
+LEGACY_PICKLE_INDEXES = os.getenv("RAG_LEGACY_PICKLE_INDEXES", "0") != "0"
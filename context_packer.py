@@ -0,0 +1,179 @@
+import hashlib
+import math
+import re
+from collections import deque
+import numpy as np
+import config
+from embedding_cache import get_embedding_cache, normalize_text
+from telemetry import traced, annotate
+
+# Builds the text the single-prompt analyses (suggested questions, keywords,
+# concept map, timeline) send to the model. Instead of the first N characters,
+# chunks are picked from across the whole corpus until a token budget is full:
+# the chunk vectors already in the embedding cache are clustered and the chunks
+# nearest each cluster centre go in first, so every topic is represented once
+# before any topic gets a second chunk. Without vectors, chunks are spread
+# evenly over the corpus instead. Repeated and overlapping text is skipped.
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SHINGLE_SIZE = 5
+_KMEANS_SAMPLE = 5000
+_KMEANS_ITERATIONS = 12
+
+def estimate_tokens(text):
+    """Model tokens in text, estimated without the model's tokenizer (errs high for non-English text)."""
+    return max(len(text.split()), math.ceil(len(text) / config.CHARS_PER_TOKEN))
+
+def truncate_to_tokens(text, token_budget):
+    """The start of text that fits token_budget (by estimate_tokens), cut at a word boundary."""
+    if estimate_tokens(text) <= token_budget:
+        return text
+    max_chars = int(token_budget * config.CHARS_PER_TOKEN)
+    cut = text[:max_chars]
+    if cut and not cut[-1].isspace() and len(text) > max_chars and not text[max_chars].isspace():
+        # Do not end on half a word.
+        cut = cut.rsplit(None, 1)[0] if len(cut.split()) > 1 else cut
+    words = cut.split()
+    return " ".join(words[:token_budget]) if len(words) > token_budget else cut.rstrip()
+
+def _shingles(text):
+    words = _WORD.findall(text.lower())
+    if len(words) < _SHINGLE_SIZE:
+        return {hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=8).digest()} if words else set()
+    return {hashlib.blake2b(" ".join(words[i:i + _SHINGLE_SIZE]).encode("utf-8"), digest_size=8).digest() for i in range(len(words) - _SHINGLE_SIZE + 1)}
+
+def _trim_overlap(previous, text, max_overlap=400, min_overlap=20):
+    """Drop the start of text that repeats the end of previous (the splitter's chunk overlap)."""
+    for size in range(min(len(previous), len(text), max_overlap), min_overlap - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+def _unique_positions(texts):
+    seen = set()
+    positions = []
+    for i, text in enumerate(texts):
+        key = normalize_text(text).lower()
+        if key and key not in seen:
+            seen.add(key)
+            positions.append(i)
+    return positions
+
+def dedupe_texts(texts):
+    """texts without exact repeats and without the overlap consecutive chunks share."""
+    result = []
+    for i in _unique_positions(texts):
+        text = _trim_overlap(result[-1], texts[i]) if result else texts[i]
+        if text.strip():
+            result.append(text)
+    return result
+
+def cached_vectors(texts):
+    """Vectors for texts from the embedding cache (None where missing); never calls the model."""
+    if not config.EMBED_CACHE_ENABLED or not texts:
+        return [None] * len(texts)
+    return get_embedding_cache().get_many(texts)
+
+def _spread_order(count):
+    """0..count-1 coarse to fine (middle, quarters, eighths, ...), so any prefix covers the whole range."""
+    order = []
+    intervals = deque([(0, count)])
+    while intervals:
+        low, high = intervals.popleft()
+        if low >= high:
+            continue
+        middle = (low + high) // 2
+        order.append(middle)
+        intervals.append((low, middle))
+        intervals.append((middle + 1, high))
+    return order
+
+def _kmeans(vectors, k, seed=0):
+    """Cluster centres of unit-length vectors (k-means++ seeding, fitted on a sample)."""
+    rng = np.random.default_rng(seed)
+    sample = vectors if len(vectors) <= _KMEANS_SAMPLE else vectors[rng.choice(len(vectors), _KMEANS_SAMPLE, replace=False)]
+    centres = [sample[rng.integers(len(sample))]]
+    distances = 1.0 - sample @ centres[0]
+    for _ in range(1, k):
+        total = distances.clip(min=0).sum()
+        index = rng.choice(len(sample), p=distances.clip(min=0) / total) if total > 0 else rng.integers(len(sample))
+        centres.append(sample[index])
+        distances = np.minimum(distances, 1.0 - sample @ sample[index])
+    centres = np.stack(centres)
+    for _ in range(_KMEANS_ITERATIONS):
+        labels = np.argmax(sample @ centres.T, axis=1)
+        for cluster in range(k):
+            members = sample[labels == cluster]
+            if len(members):
+                centre = members.mean(axis=0)
+                centres[cluster] = centre / (np.linalg.norm(centre) or 1.0)
+    return centres
+
+def _cluster_order(vectors, k):
+    """Positions ordered round-robin over clusters (largest first), nearest to the centre first within each."""
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    centres = _kmeans(vectors, k)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    similarity = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), 8192):
+        scores = vectors[start:start + 8192] @ centres.T
+        labels[start:start + 8192] = np.argmax(scores, axis=1)
+        similarity[start:start + 8192] = scores.max(axis=1)
+    clusters = [np.flatnonzero(labels == cluster) for cluster in range(k)]
+    clusters = [members[np.argsort(-similarity[members], kind="stable")].tolist() for members in clusters if len(members)]
+    clusters.sort(key=len, reverse=True)
+    order = []
+    for rank in range(max(len(members) for members in clusters)):
+        order.extend(members[rank] for members in clusters if rank < len(members))
+    return order
+
+@traced("context.pack")
+def pack_context(texts, token_budget, vectors=None, max_overlap=0.8):
+    """Join a representative subset of texts that fits token_budget, in their original order.
+
+    vectors (one per text, None where unknown) enable topic clustering and are
+    looked up in the embedding cache when not given; without them texts are
+    taken evenly from across the list. A text is skipped when more than
+    max_overlap of its word shingles are already in the context.
+    """
+    kept = _unique_positions(texts)
+    texts = [texts[i] for i in kept]
+    tokens = [estimate_tokens(text) for text in texts]
+    annotate(chunks=len(texts), budget=token_budget)
+    if sum(tokens) + 2 * len(texts) <= token_budget:
+        annotate(selected=len(texts), tokens=sum(tokens), strategy="all")
+        return "\n\n".join(dedupe_texts(texts))
+
+    vectors = cached_vectors(texts) if vectors is None else [vectors[i] for i in kept]
+    known = {i: vector for i, vector in enumerate(vectors) if vector is not None}
+    if len(known) >= max(2, len(texts) // 2):
+        positions = sorted(known)
+        typical_tokens = float(np.median(tokens)) or 1.0
+        k = max(1, min(len(positions), int(token_budget // (typical_tokens + 2))))
+        order = [positions[i] for i in _cluster_order(np.asarray([known[i] for i in positions], dtype=np.float32), k)]
+        # Texts without a cached vector still get a chance once the clustered ones are placed.
+        order += [i for i in _spread_order(len(texts)) if i not in known]
+        strategy = "clusters"
+    else:
+        order = _spread_order(len(texts))
+        strategy = "spread"
+
+    selected, used, seen_shingles = [], 0, set()
+    smallest = min(tokens)
+    for i in order:
+        if token_budget - used < smallest + 2:
+            break
+        if used + tokens[i] + 2 > token_budget:
+            continue
+        shingles = _shingles(texts[i])
+        if shingles and len(shingles & seen_shingles) > max_overlap * len(shingles):
+            continue
+        selected.append(i)
+        used += tokens[i] + 2
+        seen_shingles |= shingles
+    if not selected:
+        # Every text is larger than the budget: the most representative one, cut to fit, beats an empty prompt.
+        annotate(selected=1, tokens=token_budget, strategy=strategy + "+truncated")
+        return truncate_to_tokens(texts[order[0]], token_budget)
+    annotate(selected=len(selected), tokens=used, strategy=strategy)
+    return "\n\n".join(dedupe_texts([texts[i] for i in sorted(selected)]))
@@ -1,15 +1,104 @@
-import os
-import faiss
+import time
 import pickle
-from langchain_ollama import OllamaEmbeddings 
-from langchain_community.vectorstores import FAISS 
-
-def embed_and_store(documents, db_path="vectordb/db.faiss"): 
-    embeddings = OllamaEmbeddings(model="gemma:2b")
-    
-    vectorstore = FAISS.from_documents(documents, embedding=embeddings) 
-    vectorstore.save_local(db_path)
-
-def load_vectorstore(db_path="vectordb/db.faiss"):
-    embeddings = OllamaEmbeddings(model="gemma:2b") 
-    return FAISS.load_local(db_path, embeddings, allow_dangerous_deserialization=True)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import config
+from llm_client import get_embeddings
+from embedding_cache import get_embedding_cache, text_key
+from index_store import load_index_files
+from index_types import apply_search_params
+from namespaces import current_index_dir
+from telemetry import traced, annotate, increment
+
+def _embed_batch_with_retry(embeddings, texts, max_retries):
+    attempt = 0
+    while True:
+        try:
+            vectors = embeddings.embed_documents(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}.")
+            return vectors
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            print(f"Embedding batch of {len(texts)} chunks failed (attempt {attempt}/{max_retries}), retrying: {e}")
+            time.sleep(min(2 ** (attempt - 1), 10))
+
+@traced("embed.texts")
+def embed_texts(texts, batch_size=None, max_workers=None, max_retries=None, progress_callback=None, embeddings=None):
+    batch_size = batch_size or config.EMBED_BATCH_SIZE
+    max_workers = max_workers or config.EMBED_CONCURRENCY
+    max_retries = config.EMBED_MAX_RETRIES if max_retries is None else max_retries
+    embeddings = embeddings or get_embeddings()
+
+    batches = [(start, texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)]
+    annotate(texts=len(texts), batches=len(batches))
+    vectors = [None] * len(texts)
+    done = 0
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_embed_batch_with_retry, embeddings, batch, max_retries): (start, len(batch)) for start, batch in batches}
+        for future in as_completed(futures):
+            start, size = futures[future]
+            try:
+                vectors[start:start + size] = future.result()
+            except Exception:
+                for pending in futures:
+                    pending.cancel()
+                raise
+            done += size
+            if progress_callback:
+                elapsed = time.perf_counter() - started_at
+                progress_callback(done, len(texts), done / elapsed if elapsed > 0 else 0.0)
+    return vectors
+
+@traced("embed.documents")
+def embed_documents(documents, progress_callback=None):
+    texts = [doc.page_content for doc in documents]
+    annotate(chunks=len(texts))
+    if not config.EMBED_CACHE_ENABLED:
+        return embed_texts(texts, progress_callback=progress_callback)
+
+    cache = get_embedding_cache()
+    vectors = [vector.tolist() if vector is not None else None for vector in cache.get_many(texts)]
+    missing_by_key = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            missing_by_key.setdefault(text_key(texts[i]), []).append(i)
+    cache_misses = sum(len(positions) for positions in missing_by_key.values())
+    annotate(cache_hits=len(texts) - cache_misses, cache_misses=cache_misses)
+    increment("embedding_cache_lookups", len(texts) - cache_misses, result="hit")
+    increment("embedding_cache_lookups", cache_misses, result="miss")
+    if missing_by_key:
+        missing_texts = [texts[positions[0]] for positions in missing_by_key.values()]
+        cached_count = len(texts) - cache_misses
+        def report_progress(done, total, chunks_per_sec):
+            if progress_callback:
+                progress_callback(cached_count + done * (len(texts) - cached_count) // total, len(texts), chunks_per_sec)
+        new_vectors = embed_texts(missing_texts, progress_callback=report_progress)
+        cache.put_many(missing_texts, new_vectors)
+        for positions, vector in zip(missing_by_key.values(), new_vectors):
+            for i in positions:
+                vectors[i] = vector
+    elif progress_callback and texts:
+        progress_callback(len(texts), len(texts), 0.0)
+    return vectors
+
+@traced("embed.and_store")
+def embed_and_store(documents, db_path=config.VECTORDB_PATH):
+    from index_manager import document_id_for_chunks, sync_index
+    documents_by_source = {}
+    for doc in documents:
+        documents_by_source.setdefault(doc.metadata.get("source", ""), []).append(doc)
+    documents_by_id = {
+        document_id_for_chunks(source_documents): {"documents": source_documents, "source": source}
+        for source, source_documents in documents_by_source.items()
+    }
+    return sync_index(documents_by_id, db_path)
+
+@traced("index.load")
+def load_vectorstore(db_path=config.VECTORDB_PATH):
+    embeddings = get_embeddings()
+    vectorstore = load_index_files(current_index_dir(db_path), embeddings)
+    apply_search_params(vectorstore.index)
+    return vectorstore
@@ -0,0 +1,226 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+import config
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text):
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+def _slot_tag(key):
+    # 0 marks a slot that is being written.
+    return np.uint64(int(key[:16], 16) or 1)
+
+class EmbeddingCache:
+    """Vectors live in a memory-mapped array; a SQLite table maps text hashes to rows (slots).
+
+    Several processes (the app and the API server) may share one cache
+    directory: the dimension and capacity are re-read from the meta table
+    inside each write transaction, vectors.bin only ever grows, and the
+    mapping is reopened when a slot lies past its end. A reader's key -> slot
+    lookup is not atomic with reading the slot, which another process may be
+    evicting and overwriting, so slot_keys.bin holds a tag of the key stored
+    in each slot: writers clear it, write the vector and set it, and readers
+    only accept a vector whose tag matched before and after reading it.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, cache_dir, max_bytes, dtype="float16"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._tags = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        meta = self._load_meta()
+        if meta.get("dtype", self.dtype.name) != self.dtype.name or (self.capacity and not (os.path.exists(self._vectors_path) and os.path.exists(self._tags_path))):
+            self._reset()
+
+    def _load_meta(self):
+        meta = dict(self._db.execute("SELECT name, value FROM meta").fetchall())
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self.capacity = int(meta.get("capacity", 0))
+        return meta
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.cache_dir, "vectors.bin")
+
+    @property
+    def _tags_path(self):
+        return os.path.join(self.cache_dir, "slot_keys.bin")
+
+    def _reset(self):
+        self._db.execute("DELETE FROM entries")
+        self._db.execute("DELETE FROM meta")
+        self._vectors = None
+        self._tags = None
+        self.dim = None
+        self.capacity = 0
+        for path in (self._vectors_path, self._tags_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _max_slots(self):
+        return max(1, self.max_bytes // (self.dim * self.dtype.itemsize))
+
+    def _open_vectors(self):
+        if self._vectors is None or self._vectors.shape[0] != self.capacity:
+            self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(self.capacity, self.dim))
+            self._tags = np.memmap(self._tags_path, dtype=np.uint64, mode="r+", shape=(self.capacity,))
+        return self._vectors, self._tags
+
+    def _grow(self, needed_slots):
+        # Called inside the write transaction, after _load_meta, so self.capacity is current.
+        new_capacity = max(self.capacity, self.INITIAL_CAPACITY)
+        while new_capacity < needed_slots:
+            new_capacity *= 2
+        new_capacity = min(new_capacity, self._max_slots())
+        if new_capacity <= self.capacity:
+            return
+        for path, size in ((self._vectors_path, new_capacity * self.dim * self.dtype.itemsize), (self._tags_path, new_capacity * 8)):
+            with open(path, "ab") as f:
+                # Never shrink: the file may already be larger than this process last saw.
+                if os.fstat(f.fileno()).st_size < size:
+                    f.truncate(size)
+        self._vectors = None
+        self._tags = None
+        self.capacity = new_capacity
+        self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('capacity', ?)", (str(new_capacity),))
+
+    def _free_slots(self, count):
+        used = {slot for (slot,) in self._db.execute("SELECT slot FROM entries")}
+        free = [slot for slot in range(self.capacity) if slot not in used][:count]
+        if len(free) < count:
+            # Evict least recently used entries to make room.
+            victims = self._db.execute("SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (count - len(free),)).fetchall()
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in victims])
+            self.evictions += len(victims)
+            free.extend(slot for _, slot in victims)
+        return free
+
+    def get_many(self, texts):
+        keys = [text_key(text) for text in texts]
+        results = [None] * len(texts)
+        with self._lock:
+            if self.dim is None:
+                self._load_meta()
+            if self.dim is None:
+                self.misses += len(texts)
+                return results
+            slots = {}
+            unique_keys = list(set(keys))
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                rows = self._db.execute(f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+                slots.update(rows)
+            if slots:
+                if max(slots.values()) >= self.capacity:
+                    # Another process grew the cache since this one last looked.
+                    self._load_meta()
+                vectors, tags = self._open_vectors()
+                for i, key in enumerate(keys):
+                    if key in slots:
+                        slot, tag = slots[key], _slot_tag(key)
+                        if tags[slot] != tag:
+                            continue
+                        vector = np.array(vectors[slot], dtype=np.float32)
+                        if tags[slot] == tag:
+                            results[i] = vector
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key, result in zip(keys, results) if result is not None])
+            found = sum(1 for r in results if r is not None)
+            self.hits += found
+            self.misses += len(texts) - found
+        return results
+
+    def put_many(self, texts, vectors):
+        items = {}
+        for text, vector in zip(texts, vectors):
+            items[text_key(text)] = np.asarray(vector, dtype=np.float32)
+        if not items:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # Other processes may have set the dimension or grown the file since the last write.
+                self._load_meta()
+                if self.dim is None:
+                    self.dim = len(next(iter(items.values())))
+                    self._db.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                         [("dim", str(self.dim)), ("dtype", self.dtype.name)])
+                items = {key: vector for key, vector in items.items() if vector.shape == (self.dim,)}
+                existing = set()
+                keys = list(items)
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    existing.update(key for (key,) in self._db.execute(f"SELECT key FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch))
+                new_keys = [key for key in keys if key not in existing][:self._max_slots()]
+                if not new_keys:
+                    self._db.execute("COMMIT")
+                    return
+                count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                self._grow(count + len(new_keys))
+                free = self._free_slots(len(new_keys))
+                vectors_map, tags = self._open_vectors()
+                now = time.time()
+                for key, slot in zip(new_keys, free):
+                    tags[slot] = 0
+                    vectors_map[slot] = items[key]
+                    tags[slot] = _slot_tag(key)
+                self._db.executemany("INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                                     [(key, slot, now) for key, slot in zip(new_keys, free)])
+                vectors_map.flush()
+                tags.flush()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bytes": entries * (self.dim or 0) * self.dtype.itemsize,
+                "max_bytes": self.max_bytes,
+            }
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(model=None):
+    model = model or config.EMBEDDING_MODEL
+    with _caches_lock:
+        if model not in _caches:
+            model_dir = re.sub(r"[^A-Za-z0-9._-]", "_", model)
+            _caches[model] = EmbeddingCache(
+                os.path.join(config.CACHE_DIR, "embeddings", model_dir),
+                max_bytes=config.EMBED_CACHE_MAX_MB * 1024 * 1024,
+                dtype=config.EMBED_CACHE_DTYPE,
+            )
+        return _caches[model]
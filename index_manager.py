@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+from langchain_community.vectorstores import FAISS
+import config
+from embedder import get_embeddings, embed_documents
+from index_store import PickledIndexError, load_index_files, save_index_files
+from index_types import TRAINED_TYPES, choose_index_type, index_type_of, build_index, reconstruct, remove_positions
+from namespaces import current_index_dir, new_version_dir, publish, write_lock
+from telemetry import traced, annotate
+
+MANIFEST_NAME = "manifest.json"
+
+def _empty_manifest():
+    return {"version": 0, "embedding_model": config.EMBEDDING_MODEL, "documents": {}}
+
+def load_manifest(db_path=config.VECTORDB_PATH):
+    try:
+        with open(os.path.join(current_index_dir(db_path), MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return _empty_manifest()
+
+def save_manifest(manifest, index_dir):
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+def document_id_for_chunks(documents):
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(str(doc.metadata.get("source", "")).encode("utf-8"))
+        digest.update(doc.page_content.encode("utf-8"))
+    return digest.hexdigest()
+
+def chunk_ids(doc_id, count):
+    return [f"{doc_id}:{i}" for i in range(count)]
+
+def iter_document_chunks(vectorstore, doc_id, count):
+    """The chunks of one indexed document, read from the docstore one at a time."""
+    for chunk_id in chunk_ids(doc_id, count):
+        document = vectorstore.docstore.search(chunk_id)
+        if not isinstance(document, str):
+            yield document
+
+def open_index(db_path=config.VECTORDB_PATH):
+    manifest = load_manifest(db_path)
+    empty_manifest = _empty_manifest()
+    empty_manifest["version"] = manifest.get("version", 0)
+    if manifest.get("embedding_model") != config.EMBEDDING_MODEL or not manifest["documents"]:
+        # Vectors from another embedding model cannot be mixed with new ones.
+        return None, empty_manifest
+    try:
+        # Writers change the index in place, so it is read into memory rather than mapped.
+        vectorstore = load_index_files(current_index_dir(db_path), get_embeddings(), mmap=False)
+    except PickledIndexError:
+        # Starting over would publish a new index and delete the pickled one.
+        raise
+    except Exception as e:
+        print(f"Index at {db_path} could not be loaded, starting a new one: {e}")
+        return None, empty_manifest
+    return vectorstore, manifest
+
+def _add_chunks(vectorstore, doc_id, documents, vectors, start=0):
+    ids = [f"{doc_id}:{start + i}" for i in range(len(documents))]
+    text_embeddings = [(doc.page_content, list(map(float, vector))) for doc, vector in zip(documents, vectors)]
+    metadatas = [dict(doc.metadata, doc_id=doc_id) for doc in documents]
+    if text_embeddings:
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(text_embeddings, embedding=get_embeddings(), metadatas=metadatas, ids=ids)
+        else:
+            vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return vectorstore
+
+def add_document(vectorstore, manifest, doc_id, documents, vectors, source=None):
+    if doc_id in manifest["documents"]:
+        raise ValueError(f"Document {doc_id} is already indexed.")
+    vectorstore = _add_chunks(vectorstore, doc_id, documents, vectors)
+    manifest["documents"][doc_id] = {
+        "source": source if source is not None else (documents[0].metadata.get("source") if documents else None),
+        "chunk_count": len(documents),
+        "complete": True,
+    }
+    return vectorstore
+
+def append_chunks(vectorstore, manifest, doc_id, documents, vectors, source=None):
+    """Add the next batch of a document that is being indexed incrementally."""
+    entry = manifest["documents"].setdefault(doc_id, {"source": source, "chunk_count": 0, "complete": False})
+    if entry.get("complete", True):
+        raise ValueError(f"Document {doc_id} is already fully indexed.")
+    vectorstore = _add_chunks(vectorstore, doc_id, documents, vectors, start=entry["chunk_count"])
+    entry["chunk_count"] += len(documents)
+    return vectorstore
+
+def mark_complete(manifest, doc_id):
+    manifest["documents"][doc_id]["complete"] = True
+
+def is_complete(manifest, doc_id):
+    entry = manifest["documents"].get(doc_id)
+    return bool(entry) and entry.get("complete", True)
+
+def _delete_chunks(vectorstore, ids):
+    if index_type_of(vectorstore.index) == "flat":
+        vectorstore.delete(ids)
+        return
+    # Same bookkeeping as FAISS.delete, but with a removal every index type supports.
+    positions_by_id = {chunk_id: position for position, chunk_id in vectorstore.index_to_docstore_id.items()}
+    positions = {positions_by_id[chunk_id] for chunk_id in ids if chunk_id in positions_by_id}
+    vectorstore.index = remove_positions(vectorstore.index, sorted(positions))
+    vectorstore.docstore.delete([chunk_id for chunk_id in ids if chunk_id in positions_by_id])
+    remaining = [chunk_id for position, chunk_id in sorted(vectorstore.index_to_docstore_id.items()) if position not in positions]
+    vectorstore.index_to_docstore_id = dict(enumerate(remaining))
+
+def remove_document(vectorstore, manifest, doc_id):
+    entry = manifest["documents"].pop(doc_id, None)
+    if entry and entry["chunk_count"] and vectorstore is not None:
+        _delete_chunks(vectorstore, chunk_ids(doc_id, entry["chunk_count"]))
+    return vectorstore
+
+def optimize_index(vectorstore, manifest):
+    """Switch to the index type configured for the current corpus size, retraining as the corpus grows."""
+    if vectorstore is None or vectorstore.index.ntotal == 0:
+        return vectorstore
+    count = vectorstore.index.ntotal
+    target = choose_index_type(count)
+    current = index_type_of(vectorstore.index)
+    trained_on = manifest.get("index", {}).get("trained_on", count)
+    # PQ codes only reconstruct approximately, so a PQ index is not retrained on its own output.
+    outgrown = current in TRAINED_TYPES and current != "ivfpq" and count >= config.INDEX_RETRAIN_GROWTH * trained_on
+    if target != current or outgrown:
+        vectorstore.index = build_index(reconstruct(vectorstore.index), target)
+        manifest["index"] = {"type": target, "trained_on": count}
+    elif "index" not in manifest:
+        manifest["index"] = {"type": current, "trained_on": count}
+    return vectorstore
+
+def save_index(vectorstore, manifest, db_path=config.VECTORDB_PATH):
+    """Write the index and manifest to a new version directory and publish it atomically."""
+    manifest["version"] = manifest.get("version", 0) + 1
+    manifest["embedding_model"] = config.EMBEDDING_MODEL
+    version_dir = new_version_dir(db_path, manifest["version"])
+    if vectorstore is not None:
+        optimize_index(vectorstore, manifest)
+        save_index_files(vectorstore, version_dir)
+    save_manifest(manifest, version_dir)
+    publish(db_path, version_dir)
+
+@traced("index.remove")
+def remove_documents(doc_ids, db_path=config.VECTORDB_PATH):
+    """Remove documents from the index; returns the doc_ids that were indexed and are gone now."""
+    with write_lock(db_path):
+        vectorstore, manifest = open_index(db_path)
+        removed = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id in manifest["documents"]]
+        for doc_id in removed:
+            vectorstore = remove_document(vectorstore, manifest, doc_id)
+        if removed:
+            save_index(vectorstore, manifest, db_path)
+    annotate(removed=len(removed))
+    return removed
+
+@traced("index.sync")
+def sync_index(documents_by_id, db_path=config.VECTORDB_PATH, embed_fn=embed_documents, keep_existing=False):
+    """Make the index hold exactly ``documents_by_id`` ({doc_id: {"documents", "vectors"?, "source"?}}).
+
+    Only documents missing from the manifest are embedded and added, and only
+    documents that are no longer wanted are removed. With ``keep_existing``
+    (shared workspaces), complete documents already indexed stay as well, except
+    an earlier version of an incoming document: one with the same source but
+    other content is replaced. The manifest is read under the write lock, so
+    concurrent uploads keep each other's.
+    """
+    with write_lock(db_path):
+        return _sync_index(documents_by_id, db_path, embed_fn, keep_existing)
+
+def _sync_index(documents_by_id, db_path, embed_fn, keep_existing=False):
+    vectorstore, manifest = open_index(db_path)
+    was_reset = vectorstore is None and os.path.exists(os.path.join(current_index_dir(db_path), "index.faiss"))
+    stats = {"added": 0, "removed": 0, "kept": 0}
+
+    incoming_sources = {entry["source"] for entry in documents_by_id.values() if entry.get("source")}
+    for doc_id in list(manifest["documents"]):
+        unwanted = doc_id not in documents_by_id and (not keep_existing or manifest["documents"][doc_id].get("source") in incoming_sources)
+        if unwanted or not is_complete(manifest, doc_id):
+            vectorstore = remove_document(vectorstore, manifest, doc_id)
+            stats["removed"] += 1
+
+    for doc_id, entry in documents_by_id.items():
+        if doc_id in manifest["documents"]:
+            stats["kept"] += 1
+            continue
+        vectors = entry.get("vectors")
+        if vectors is None:
+            vectors = embed_fn(entry["documents"]) if entry["documents"] else []
+        vectorstore = add_document(vectorstore, manifest, doc_id, entry["documents"], vectors, entry.get("source"))
+        stats["added"] += 1
+
+    if stats["added"] or stats["removed"] or was_reset:
+        save_index(vectorstore, manifest, db_path)
+    annotate(**stats)
+    return vectorstore, manifest, stats
@@ -0,0 +1,212 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+import config
+from index_types import mmap_flags
+
+# On-disk format of one published index version, without pickle:
+#
+#     index.faiss      faiss.write_index output, memory-mapped when serving
+#     docstore.sqlite  chunks(position, id, text, metadata JSON); row `position`
+#                      belongs to FAISS vector `position`
+#     manifest.json    written by index_manager
+#
+# Opening a version reads neither the vectors nor the chunks into memory:
+# search results fetch their chunks by id, and positions map to ids through
+# the same table. Writers add to and delete from an in-memory overlay that is
+# merged into a new docstore.sqlite when the next version is saved.
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+LEGACY_PICKLE_FILE = "index.pkl"
+
+_SCHEMA = "CREATE TABLE chunks (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+
+class _ReadOnlyDatabase:
+    """A shared read-only connection; published versions never change, so SQLite can skip locking."""
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def count(self):
+        return self.execute("SELECT COUNT(*) FROM chunks")[0][0]
+
+def _document(chunk_id, text, metadata):
+    return Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Docstore reading chunks from docstore.sqlite by id, with pending additions and deletions in memory."""
+
+    def __init__(self, database):
+        self.database = database
+        self.added = {}
+        self.deleted = set()
+
+    def search(self, search):
+        if search in self.added:
+            return self.added[search]
+        if search not in self.deleted:
+            rows = self.database.execute("SELECT text, metadata FROM chunks WHERE id = ?", (search,))
+            if rows:
+                return _document(search, *rows[0])
+        # Same answer as the in-memory docstore, which the FAISS wrapper checks for.
+        return f"ID {search} not found."
+
+    def add(self, texts):
+        for chunk_id, document in texts.items():
+            if not isinstance(self.search(chunk_id), str):
+                raise ValueError(f"Tried to add ids that already exist: {chunk_id}")
+            self.deleted.discard(chunk_id)
+            self.added[chunk_id] = document
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            if self.added.pop(chunk_id, None) is None:
+                self.deleted.add(chunk_id)
+
+class SQLiteIdMap(MutableMapping):
+    """index_to_docstore_id backed by the position column; assignments stay in memory until the next save."""
+
+    def __init__(self, database):
+        self.database = database
+        self.base_count = database.count()
+        self.overlay = {}
+
+    def __getitem__(self, position):
+        if position in self.overlay:
+            return self.overlay[position]
+        if 0 <= position < self.base_count:
+            return self.database.execute("SELECT id FROM chunks WHERE position = ?", (int(position),))[0][0]
+        raise KeyError(position)
+
+    def __setitem__(self, position, chunk_id):
+        self.overlay[position] = chunk_id
+
+    def __delitem__(self, position):
+        raise TypeError("Positions cannot be removed one by one; FAISS.delete rebuilds the whole mapping.")
+
+    def __len__(self):
+        return self.base_count + sum(1 for position in self.overlay if position >= self.base_count)
+
+    def __iter__(self):
+        return (position for position, _ in self.items())
+
+    def items(self):
+        for (position, chunk_id) in self.database.execute("SELECT position, id FROM chunks ORDER BY position"):
+            yield position, self.overlay.get(position, chunk_id)
+        for position in sorted(p for p in self.overlay if p >= self.base_count):
+            yield position, self.overlay[position]
+
+    def values(self):
+        # The FAISS wrapper scans all ids when deleting; one query instead of one per position.
+        return [chunk_id for _, chunk_id in self.items()]
+
+    def is_append_only(self):
+        return all(position >= self.base_count for position in self.overlay)
+
+def _read_index(index_dir, mmap):
+    path = os.path.join(index_dir, INDEX_FILE)
+    if mmap and config.INDEX_MMAP:
+        try:
+            with open(os.path.join(index_dir, "manifest.json"), "r", encoding="utf-8") as f:
+                index_type = json.load(f).get("index", {}).get("type", "flat")
+        except (OSError, ValueError):
+            index_type = "flat"
+        try:
+            return faiss.read_index(path, mmap_flags(index_type))
+        except RuntimeError as e:
+            print(f"Index at {path} could not be memory-mapped, reading it into memory: {e}")
+    return faiss.read_index(path)
+
+class PickledIndexError(Exception):
+    """The index is only saved in the legacy pickle format, which is not opened unless RAG_LEGACY_PICKLE_INDEXES is set."""
+
+def load_index_files(index_dir, embeddings, mmap=True):
+    """Open the vector store saved in index_dir. Serving opens it memory-mapped; writers pass mmap=False."""
+    database_path = os.path.join(index_dir, DOCSTORE_FILE)
+    if not os.path.exists(database_path):
+        if os.path.exists(os.path.join(index_dir, LEGACY_PICKLE_FILE)):
+            if not config.LEGACY_PICKLE_INDEXES:
+                raise PickledIndexError(f"{index_dir} only has a pickled index ({LEGACY_PICKLE_FILE}); set RAG_LEGACY_PICKLE_INDEXES=1 to open it if you trust it")
+            # Saved before the SQLite docstore; rewritten in the new format on the next save.
+            return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+        raise FileNotFoundError(f"No docstore in {index_dir}")
+    database = _ReadOnlyDatabase(database_path)
+    return FAISS(embeddings, _read_index(index_dir, mmap), SQLiteDocstore(database), SQLiteIdMap(database))
+
+def _copy_rows(connection, source_path, positions_by_id):
+    # Rows kept from the previous version are copied inside SQLite, renumbered to their new positions.
+    connection.execute("CREATE TEMP TABLE new_positions (id TEXT PRIMARY KEY, position INTEGER NOT NULL)")
+    connection.executemany("INSERT INTO new_positions VALUES (?, ?)", positions_by_id.items())
+    # ATTACH is not allowed inside the transaction the inserts opened.
+    connection.commit()
+    connection.execute("ATTACH DATABASE ? AS previous", (f"file:{source_path}?mode=ro",))
+    connection.execute("INSERT INTO chunks SELECT n.position, p.id, p.text, p.metadata FROM previous.chunks p JOIN new_positions n ON n.id = p.id")
+    connection.commit()
+    connection.execute("DETACH DATABASE previous")
+
+def save_index_files(vectorstore, index_dir):
+    """Write index.faiss and docstore.sqlite, then point the vector store at the written files."""
+    os.makedirs(index_dir, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(index_dir, INDEX_FILE))
+    database_path = os.path.join(index_dir, DOCSTORE_FILE)
+    docstore = vectorstore.docstore
+    id_map = vectorstore.index_to_docstore_id
+    sqlite_base = isinstance(docstore, SQLiteDocstore)
+    append_only = sqlite_base and isinstance(id_map, SQLiteIdMap) and id_map.database is docstore.database and id_map.is_append_only() and not docstore.deleted
+
+    if append_only:
+        shutil.copyfile(docstore.database.path, database_path)
+        connection = sqlite3.connect(database_path)
+        new_rows = sorted(id_map.overlay.items())
+    else:
+        connection = sqlite3.connect(database_path)
+        connection.execute(_SCHEMA)
+        new_rows = []
+        if sqlite_base:
+            positions_by_id = {}
+            for position, chunk_id in id_map.items():
+                if chunk_id in docstore.added:
+                    new_rows.append((position, chunk_id))
+                else:
+                    positions_by_id[chunk_id] = position
+            _copy_rows(connection, docstore.database.path, positions_by_id)
+        else:
+            new_rows = sorted(id_map.items())
+    with connection:
+        connection.executemany(
+            "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+            ((position, chunk_id, document.page_content, json.dumps(document.metadata, ensure_ascii=False, default=str))
+             for position, chunk_id in new_rows
+             for document in [docstore.search(chunk_id)]),
+        )
+    connection.close()
+
+    # Later saves from this vector store (e.g. streaming checkpoints) start from what was just written.
+    database = _ReadOnlyDatabase(database_path)
+    vectorstore.docstore = SQLiteDocstore(database)
+    vectorstore.index_to_docstore_id = SQLiteIdMap(database)
+
+def iter_chunk_texts(vectorstore):
+    """(chunk id, text) for every vector, in index order, without loading Document objects where possible."""
+    docstore = vectorstore.docstore
+    id_map = vectorstore.index_to_docstore_id
+    if isinstance(docstore, SQLiteDocstore) and isinstance(id_map, SQLiteIdMap) and not id_map.overlay and not docstore.added and not docstore.deleted:
+        yield from docstore.database.execute("SELECT id, text FROM chunks ORDER BY position")
+        return
+    for position in range(vectorstore.index.ntotal):
+        chunk_id = id_map[position]
+        yield chunk_id, docstore.search(chunk_id).page_content
@@ -0,0 +1,116 @@
+import math
+import numpy as np
+import faiss
+import config
+
+# FAISS index layouts for the vector store. Small corpora keep the exact flat
+# index LangChain builds; larger ones move to an inverted-file index whose
+# centroids (and quantizer codebooks) are trained on a sample of the vectors.
+# Every layout keeps the flat index's convention that vector i belongs to
+# index_to_docstore_id[i], so the LangChain wrapper works unchanged.
+
+INDEX_TYPES = ("auto", "flat", "hnsw", "ivf", "ivfsq", "ivfpq")
+TRAINED_TYPES = ("ivf", "ivfsq", "ivfpq")
+
+def choose_index_type(count, requested=None):
+    requested = requested or config.INDEX_TYPE
+    if requested != "auto":
+        return requested
+    if count < config.INDEX_AUTO_FLAT_MAX:
+        return "flat"
+    if count < config.INDEX_AUTO_PQ_MIN:
+        return "ivfsq"
+    return "ivfpq"
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    ivf = faiss.try_extract_index_ivf(index)
+    ivf = faiss.downcast_index(ivf) if ivf is not None else None
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(ivf, faiss.IndexIVFScalarQuantizer):
+        return "ivfsq"
+    if isinstance(ivf, faiss.IndexIVFFlat):
+        return "ivf"
+    return type(index).__name__
+
+def _nlist(count):
+    # ~4·sqrt(n) lists, with at least 39 training points per centroid as FAISS recommends.
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+def _pq_subquantizers(dim):
+    return max(m for m in range(1, min(dim, config.INDEX_PQ_BYTES) + 1) if dim % m == 0)
+
+def factory_string(index_type, dim, count):
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{config.INDEX_HNSW_M}"
+    if index_type == "ivf":
+        return f"IVF{_nlist(count)},Flat"
+    if index_type == "ivfsq":
+        return f"IVF{_nlist(count)},SQ8"
+    if index_type == "ivfpq":
+        # 8-bit codebooks need 256·39 training points; small corpora get smaller ones.
+        nbits = 8 if count >= 256 * 39 else max(1, int(math.log2(max(count // 39, 2))))
+        return f"IVF{_nlist(count)},PQ{_pq_subquantizers(dim)}x{nbits}"
+    raise ValueError(f"Unknown index type: {index_type}")
+
+def apply_search_params(index):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(config.INDEX_NPROBE, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.INDEX_HNSW_EF_SEARCH
+    return index
+
+def mmap_flags(index_type):
+    """faiss.read_index flags that map the stored vectors from disk instead of copying them."""
+    # Inverted lists map with IO_FLAG_MMAP; flat and HNSW storage need IO_FLAG_MMAP_IFC.
+    return faiss.IO_FLAG_MMAP if index_type in TRAINED_TYPES else faiss.IO_FLAG_MMAP_IFC
+
+def build_index(vectors, index_type):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    index = faiss.index_factory(dim, factory_string(index_type, dim, count), faiss.METRIC_L2)
+    if not index.is_trained:
+        sample_size = min(count, config.INDEX_TRAIN_SAMPLE)
+        sample = vectors[np.random.default_rng(0).choice(count, sample_size, replace=False)] if sample_size < count else vectors
+        index.train(sample)
+    index.add(vectors)
+    return apply_search_params(index)
+
+def reconstruct(index, positions=None):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    if positions is None:
+        return index.reconstruct_n(0, index.ntotal)
+    return index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+def remove_positions(index, positions):
+    """Remove vectors and renumber the rest contiguously, as IndexFlat.remove_ids does."""
+    if index_type_of(index) == "flat":
+        index.remove_ids(np.asarray(positions, dtype=np.int64))
+        return index
+    # IVF keeps the old labels on removal and HNSW cannot remove at all, so the
+    # survivors are re-added to an emptied copy that keeps the trained state.
+    keep = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), np.asarray(positions, dtype=np.int64))
+    vectors = reconstruct(index, keep) if len(keep) else None
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    if vectors is not None:
+        rebuilt.add(vectors)
+    return apply_search_params(rebuilt)
+
+def index_bytes(index):
+    count = index.ntotal
+    if isinstance(index, faiss.IndexHNSW):
+        return count * index.d * 4 + index.hnsw.neighbors.size() * 4
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return count * (ivf.code_size + 8) + ivf.nlist * ivf.d * 4
+    return count * index.d * 4
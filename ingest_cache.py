@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+from langchain.docstore.document import Document
+import config
+from file_lock import FileLock
+
+# Bump when the layout of a cache entry or the extraction/chunking logic changes.
+INGEST_CACHE_VERSION = 4
+
+def file_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def ingest_config():
+    return {
+        "version": INGEST_CACHE_VERSION,
+        "chunker": config.CHUNKER,
+        "chunk_size": config.CHUNK_SIZE,
+        "chunk_overlap": config.CHUNK_OVERLAP,
+        "chunk_tokens": config.CHUNK_TOKENS,
+        "chunk_overlap_tokens": config.CHUNK_OVERLAP_TOKENS,
+        "chars_per_token": config.CHARS_PER_TOKEN,
+        "dedup": config.DEDUP_ENABLED and {
+            "edge_lines": config.BOILERPLATE_EDGE_LINES,
+            "min_page_fraction": config.BOILERPLATE_MIN_PAGE_FRACTION,
+            "sample_pages": config.BOILERPLATE_SAMPLE_PAGES,
+            "threshold": config.DEDUP_THRESHOLD,
+            "permutations": config.DEDUP_MINHASH_PERMUTATIONS,
+            "bands": config.DEDUP_LSH_BANDS,
+        },
+        "embedding_model": config.EMBEDDING_MODEL,
+    }
+
+def ingest_key(file_hash):
+    config_json = json.dumps(ingest_config(), sort_keys=True)
+    return hashlib.sha256(f"{file_hash}:{config_json}".encode("utf-8")).hexdigest()
+
+def corpus_key(ingest_keys):
+    joined = "\n".join(sorted(ingest_keys))
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+def _entry_dir(key, cache_dir=None):
+    return os.path.join(cache_dir or config.CACHE_DIR, "ingest", key[:2], key)
+
+_entry_locks = {}
+_entry_locks_lock = threading.Lock()
+
+def entry_lock(key, cache_dir=None):
+    """Lock held while an entry is built batch by batch, across threads and processes."""
+    lock_path = f"{_entry_dir(key, cache_dir)}.lock"
+    with _entry_locks_lock:
+        if lock_path not in _entry_locks:
+            _entry_locks[lock_path] = FileLock(lock_path)
+        return _entry_locks[lock_path]
+
+def _write_json(path, value):
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _read_json(path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _write_jsonl(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+def _read_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def load_entry(key, cache_dir=None, with_vectors=True):
+    entry_dir = _entry_dir(key, cache_dir)
+    meta = _read_json(os.path.join(entry_dir, "meta.json"))
+    if not meta or not meta.get("complete"):
+        return None
+    try:
+        pages = _read_jsonl(os.path.join(entry_dir, "pages.jsonl"))
+        chunks = [Document(page_content=row["page_content"], metadata=row["metadata"])
+                  for row in _read_jsonl(os.path.join(entry_dir, "chunks.jsonl"))]
+        vectors = np.fromfile(os.path.join(entry_dir, "vectors.f32"), dtype=np.float32) if with_vectors else None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ingest cache entry {key} is unreadable, ignoring it: {e}")
+        return None
+    if meta["count"] != len(chunks):
+        return None
+    if vectors is not None:
+        if vectors.size != meta["count"] * meta["dim"]:
+            return None
+        vectors = vectors.reshape(meta["count"], meta["dim"])
+    return {"pages": pages, "chunks": chunks, "vectors": vectors, "meta": meta}
+
+def load_entry_meta(key, cache_dir=None):
+    """meta.json of a complete entry, or None; reads none of its chunks or vectors."""
+    meta = _read_json(os.path.join(_entry_dir(key, cache_dir), "meta.json"))
+    return meta if meta and meta.get("complete") else None
+
+def _iter_batches(entry_dir, count, dim, batch_size):
+    if not count:
+        return
+    vectors = np.memmap(os.path.join(entry_dir, "vectors.f32"), dtype=np.float32, mode="r", shape=(count, dim))
+    chunks = []
+    with open(os.path.join(entry_dir, "chunks.jsonl"), "r", encoding="utf-8") as f:
+        for position, line in enumerate(f):
+            if position >= count:
+                break
+            row = json.loads(line)
+            chunks.append(Document(page_content=row["page_content"], metadata=row["metadata"]))
+            if len(chunks) == batch_size:
+                yield chunks, np.array(vectors[position + 1 - len(chunks):position + 1])
+                chunks = []
+    if chunks:
+        yield chunks, np.array(vectors[count - len(chunks):count])
+
+def iter_entry_batches(key, batch_size, cache_dir=None):
+    """Yield (chunks, vectors) batches of a complete entry without loading it whole."""
+    meta = load_entry_meta(key, cache_dir)
+    if meta:
+        yield from _iter_batches(_entry_dir(key, cache_dir), meta["count"], meta["dim"], batch_size)
+
+def save_entry(key, pages, chunks, vectors, source=None, cache_dir=None):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    entry_dir = _entry_dir(key, cache_dir)
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    # Sessions are threads of one process, so the temp dir is per call, not per process.
+    tmp_dir = tempfile.mkdtemp(prefix=f"{os.path.basename(entry_dir)}.tmp-", dir=os.path.dirname(entry_dir))
+    _write_jsonl(os.path.join(tmp_dir, "pages.jsonl"), pages)
+    _write_jsonl(os.path.join(tmp_dir, "chunks.jsonl"),
+                 ({"page_content": c.page_content, "metadata": c.metadata} for c in chunks))
+    vectors.tofile(os.path.join(tmp_dir, "vectors.f32"))
+    _write_json(os.path.join(tmp_dir, "meta.json"), {
+        "source": source,
+        "count": len(chunks),
+        "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+        "config": ingest_config(),
+        "complete": True,
+    })
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another call stored the same key in between; the key covers the content, so its entry is the same.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _truncate_lines(path, line_count):
+    with open(path, "r+b") as f:
+        for _ in range(line_count):
+            if not f.readline():
+                break
+        f.truncate(f.tell())
+
+class StreamingEntryWriter:
+    """Builds a cache entry batch by batch in ``<entry>.partial`` and checkpoints its progress.
+
+    After a crash, ``checkpoint`` holds the last durable position, and reopening the
+    writer truncates anything written after it, so ingestion resumes from there.
+    Hold ``entry_lock(key)`` from opening the writer until ``finish``: the partial
+    directory is shared by everyone ingesting the same file.
+    """
+
+    def __init__(self, key, source=None, cache_dir=None):
+        self.key = key
+        self.source = source
+        self.entry_dir = _entry_dir(key, cache_dir)
+        self.partial_dir = f"{self.entry_dir}.partial"
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self._checkpoint_path = os.path.join(self.partial_dir, "checkpoint.json")
+        self.checkpoint = _read_json(self._checkpoint_path) or {"pages_done": 0, "page_rows": 0, "count": 0, "dim": 0}
+        if self.checkpoint.get("config") not in (None, ingest_config()):
+            self.checkpoint = {"pages_done": 0, "page_rows": 0, "count": 0, "dim": 0}
+        self._pending = {"page_rows": 0, "count": 0}
+        self._rollback_to_checkpoint()
+
+    def _path(self, name):
+        return os.path.join(self.partial_dir, name)
+
+    def _rollback_to_checkpoint(self):
+        for name, rows in (("pages.jsonl", self.checkpoint["page_rows"]), ("chunks.jsonl", self.checkpoint["count"])):
+            if os.path.exists(self._path(name)):
+                _truncate_lines(self._path(name), rows)
+            else:
+                open(self._path(name), "wb").close()
+        vectors_path = self._path("vectors.f32")
+        if not os.path.exists(vectors_path):
+            open(vectors_path, "wb").close()
+        with open(vectors_path, "r+b") as f:
+            f.truncate(self.checkpoint["count"] * self.checkpoint["dim"] * 4)
+
+    def append(self, pages, chunks, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with open(self._path("pages.jsonl"), "a", encoding="utf-8") as f:
+            for row in pages:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        with open(self._path("chunks.jsonl"), "a", encoding="utf-8") as f:
+            for c in chunks:
+                f.write(json.dumps({"page_content": c.page_content, "metadata": c.metadata}, ensure_ascii=False) + "\n")
+        with open(self._path("vectors.f32"), "ab") as f:
+            vectors.tofile(f)
+        self._pending["page_rows"] += len(pages)
+        self._pending["count"] += len(chunks)
+        if vectors.ndim == 2 and vectors.shape[0]:
+            self.checkpoint["dim"] = int(vectors.shape[1])
+
+    def commit(self, pages_done):
+        self.checkpoint = {
+            "pages_done": pages_done,
+            "page_rows": self.checkpoint["page_rows"] + self._pending["page_rows"],
+            "count": self.checkpoint["count"] + self._pending["count"],
+            "dim": self.checkpoint["dim"],
+            "config": ingest_config(),
+        }
+        self._pending = {"page_rows": 0, "count": 0}
+        _write_json(self._checkpoint_path, self.checkpoint)
+
+    def committed_text_length(self):
+        """Length of the committed pages' text joined with "\n", where a resumed document chunker continues."""
+        if not self.checkpoint["page_rows"]:
+            return 0
+        length = -1
+        with open(self._path("pages.jsonl"), "r", encoding="utf-8") as f:
+            for position, line in enumerate(f):
+                if position >= self.checkpoint["page_rows"]:
+                    break
+                length += len(json.loads(line)["page_content"]) + 1
+        return length
+
+    def iter_committed(self, batch_size):
+        """Yield (chunks, vectors) batches of everything up to the last checkpoint."""
+        yield from _iter_batches(self.partial_dir, self.checkpoint["count"], self.checkpoint["dim"], batch_size)
+
+    def finish(self):
+        _write_json(self._path("meta.json"), {
+            "source": self.source,
+            "count": self.checkpoint["count"],
+            "dim": self.checkpoint["dim"],
+            "config": ingest_config(),
+            "complete": True,
+        })
+        os.remove(self._checkpoint_path)
+        shutil.rmtree(self.entry_dir, ignore_errors=True)
+        os.replace(self.partial_dir, self.entry_dir)
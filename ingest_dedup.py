@@ -0,0 +1,212 @@
+import bisect
+import math
+import re
+from collections import Counter
+import fitz
+import numpy as np
+import config
+from telemetry import traced, annotate
+
+# Ingest-time removal of repeated text, before anything is embedded:
+#
+#  * boilerplate: lines near the top or bottom of a page (running headers,
+#    footers, page numbers, disclaimers) that recur on a large share of pages
+#    are blanked out of the page text. They are replaced by spaces rather than
+#    cut, so the character offsets of the remaining words still match their
+#    word boxes and the PDF.
+#  * near-duplicates: pages, and then chunks, whose MinHash signatures estimate
+#    a word shingle Jaccard similarity of at least RAG_DEDUP_THRESHOLD with an
+#    earlier one are emptied or dropped. The chunks that are kept list the pages
+#    of the removed copies in metadata["duplicate_pages"], so every page the
+#    text appeared on can still be cited.
+
+_DIGITS = re.compile(r"\d+")
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SHINGLE_SIZE = 5
+
+def _line_key(line):
+    # Page numbers and dates change from page to page; the rest of a running header does not.
+    return _DIGITS.sub("#", _WHITESPACE.sub(" ", line).strip().lower())
+
+def _edge_lines(text, edge_lines):
+    """(start, end, key) of the first and last edge_lines non-blank lines of text."""
+    lines = []
+    position = 0
+    for line in text.splitlines(keepends=True):
+        if not line.isspace():
+            lines.append((position, position + len(line.rstrip("\r\n"))))
+        position += len(line)
+    if len(lines) > 2 * edge_lines:
+        lines = lines[:edge_lines] + lines[-edge_lines:]
+    return [(start, end, _line_key(text[start:end])) for start, end in lines]
+
+def find_boilerplate_lines(page_texts, edge_lines=None, min_fraction=None):
+    """Keys of the edge lines that recur on at least min_fraction of the pages (and on 3 pages or more)."""
+    edge_lines = edge_lines or config.BOILERPLATE_EDGE_LINES
+    min_fraction = config.BOILERPLATE_MIN_PAGE_FRACTION if min_fraction is None else min_fraction
+    counts = Counter()
+    pages = 0
+    for text in page_texts:
+        pages += 1
+        counts.update({key for _, _, key in _edge_lines(text, edge_lines)})
+    needed = max(3, math.ceil(min_fraction * pages))
+    return {key for key, count in counts.items() if count >= needed and key.strip("# ")}
+
+def sample_page_texts(pdf_path, max_pages=None):
+    """Texts of up to max_pages pages spread over the PDF, for finding boilerplate before streaming it."""
+    max_pages = max_pages or config.BOILERPLATE_SAMPLE_PAGES
+    with fitz.open(pdf_path) as doc:
+        step = max(1, doc.page_count / max_pages)
+        return [doc.load_page(int(i * step)).get_text() for i in range(min(max_pages, doc.page_count))]
+
+def remove_boilerplate(page_data, boilerplate_lines, edge_lines=None):
+    """Blank the boilerplate lines of one page in place; returns the number of lines removed."""
+    if not boilerplate_lines:
+        return 0
+    text = page_data["page_content"]
+    removed = [(start, end) for start, end, key in _edge_lines(text, edge_lines or config.BOILERPLATE_EDGE_LINES) if key in boilerplate_lines]
+    if not removed:
+        return 0
+    characters = list(text)
+    for start, end in removed:
+        characters[start:end] = " " * (end - start)
+    page_data["page_content"] = "".join(characters)
+    words = page_data.get("words")
+    if words:
+        # Words are in text order; keep the runs between the removed lines.
+        kept, position = [], 0
+        for start, end in removed:
+            kept.extend(words[position:bisect.bisect_left(words, [start])])
+            position = max(position, bisect.bisect_left(words, [end]))
+        page_data["words"] = kept + words[position:]
+    return len(removed)
+
+def _hash_parameters(count, seed=0):
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, 1 << 63, size=count, dtype=np.uint64) | np.uint64(1)
+    return multipliers, rng.integers(0, 1 << 63, size=count, dtype=np.uint64)
+
+_HASH_PARAMETERS = {}
+_SHINGLE_MULTIPLIERS = np.array([0x9E3779B1 ** i % (1 << 64) for i in range(_SHINGLE_SIZE)], dtype=np.uint64)
+
+def minhash_signature(text, permutations=None):
+    """MinHash of the 5-word shingles of text (one uint32 per permutation); None for texts without words."""
+    permutations = permutations or config.DEDUP_MINHASH_PERMUTATIONS
+    if permutations not in _HASH_PARAMETERS:
+        _HASH_PARAMETERS[permutations] = _hash_parameters(permutations)
+    multipliers, offsets = _HASH_PARAMETERS[permutations]
+    words = _WORD.findall(text.lower())
+    if not words:
+        return None
+    # hash() is salted per process, which is fine: signatures are only compared within one ingest.
+    word_hashes = np.fromiter(map(hash, words), dtype=np.int64, count=len(words)).view(np.uint64)
+    # A shingle's hash is a polynomial over its word hashes; uint64 arithmetic wraps around.
+    size = min(_SHINGLE_SIZE, len(words))
+    shingles = np.zeros(len(words) - size + 1, dtype=np.uint64)
+    for i in range(size):
+        shingles += word_hashes[i:len(words) - size + 1 + i] * _SHINGLE_MULTIPLIERS[i]
+    # Multiply-shift hashing: the top 32 bits of a * x + b, one (a, b) per permutation.
+    return ((np.unique(shingles)[:, None] * multipliers + offsets) >> np.uint64(32)).min(axis=0).astype(np.uint32)
+
+class MinHashIndex:
+    """Locality-sensitive index of MinHash signatures: signatures are cut into
+    bands, and only texts sharing a band are compared on the full signature."""
+
+    def __init__(self, threshold=None, bands=None):
+        self.threshold = config.DEDUP_THRESHOLD if threshold is None else threshold
+        self.bands = bands or config.DEDUP_LSH_BANDS
+        self._signatures = []
+        self._buckets = {}
+
+    def _band_keys(self, signature):
+        rows = len(signature) // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def find(self, signature):
+        """Position of the earliest added signature at least threshold similar to this one, or None."""
+        candidates = {self._buckets[key] for key in self._band_keys(signature) if key in self._buckets}
+        return next((i for i in sorted(candidates) if np.mean(self._signatures[i] == signature) >= self.threshold), None)
+
+    def add(self, signature):
+        position = len(self._signatures)
+        self._signatures.append(signature)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, position)
+        return position
+
+def _pages_of(chunk):
+    spans = chunk.metadata.get("page_spans")
+    if spans:
+        return [span["page"] for span in spans]
+    return [chunk.metadata["page"]] if "page" in chunk.metadata else []
+
+def _add_duplicate_pages(chunk, pages):
+    pages = set(pages) - set(_pages_of(chunk))
+    if pages:
+        chunk.metadata["duplicate_pages"] = sorted(pages | set(chunk.metadata.get("duplicate_pages", [])))
+
+class DuplicatePages:
+    """Empties pages that nearly repeat an earlier page of the same document (a
+    repeated terms page, a page scanned twice). Chunk boundaries rarely line up
+    on two copies of a long passage, so those copies are caught here, before
+    chunking, rather than by dedupe_chunks."""
+
+    def __init__(self, threshold=None):
+        self._index = MinHashIndex(threshold)
+        self._page_numbers = []
+        self.copies = {}
+
+    def add(self, page_data):
+        """Empty page_data in place if it repeats an earlier page; returns whether it did."""
+        signature = minhash_signature(page_data["page_content"])
+        if signature is None:
+            return False
+        original = self._index.find(signature)
+        if original is None:
+            self._index.add(signature)
+            self._page_numbers.append(page_data["metadata"]["page"])
+            return False
+        self.copies.setdefault(self._page_numbers[original], []).append(page_data["metadata"]["page"])
+        # Emptied rather than blanked, so no chunk runs across a page of spaces.
+        page_data["page_content"] = ""
+        page_data["words"] = []
+        return True
+
+    def annotate_chunks(self, chunks):
+        """Record the emptied copies in metadata["duplicate_pages"] of the chunks covering their originals."""
+        if self.copies:
+            for chunk in chunks:
+                _add_duplicate_pages(chunk, [copy for page in _pages_of(chunk) for copy in self.copies.get(page, ())])
+        return chunks
+
+@traced("dedup.pages")
+def remove_document_duplicates(pages_data_list):
+    """Blank the boilerplate lines and empty the repeated pages of one document in place.
+
+    Returns the DuplicatePages that knows the emptied copies, for annotate_chunks.
+    """
+    boilerplate_lines = find_boilerplate_lines(page["page_content"] for page in pages_data_list)
+    lines_removed = sum(remove_boilerplate(page, boilerplate_lines) for page in pages_data_list)
+    duplicate_pages = DuplicatePages()
+    pages_removed = sum(duplicate_pages.add(page) for page in pages_data_list)
+    annotate(pages=len(pages_data_list), boilerplate_patterns=len(boilerplate_lines), lines_removed=lines_removed, pages_removed=pages_removed)
+    return duplicate_pages
+
+@traced("dedup.chunks")
+def dedupe_chunks(chunks):
+    """Drop chunks that nearly repeat an earlier one; the kept chunk records the copies' pages."""
+    index = MinHashIndex()
+    kept, indexed = [], []
+    for chunk in chunks:
+        signature = minhash_signature(chunk.page_content)
+        original = None if signature is None else index.find(signature)
+        if original is not None:
+            _add_duplicate_pages(indexed[original], _pages_of(chunk))
+            continue
+        if signature is not None:
+            index.add(signature)
+            indexed.append(chunk)
+        kept.append(chunk)
+    annotate(chunks=len(chunks), duplicates=len(chunks) - len(kept))
+    return kept
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+import fitz
+import config
+from pdf_handler import iter_pages_from_pdf, chunk_pages, DocumentChunker
+from ingest_dedup import find_boilerplate_lines, sample_page_texts, remove_boilerplate, DuplicatePages, dedupe_chunks
+from embedder import embed_documents
+from ingest_cache import StreamingEntryWriter, entry_lock, load_entry_meta, iter_entry_batches
+from index_manager import open_index, append_chunks, remove_document, mark_complete, save_index
+from namespaces import write_lock
+
+# Streaming extract -> chunk -> embed -> index for large PDFs. Each stage hands
+# fixed-size batches to the next through a bounded queue, so a slow embedder
+# blocks extraction instead of letting pages pile up in memory.
+
+_DONE = object()
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+def _put(target_queue, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            target_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(source_queue, stop_event):
+    while not stop_event.is_set():
+        try:
+            return source_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def _dedupe_batch(chunks, duplicate_pages):
+    if not config.DEDUP_ENABLED:
+        return chunks
+    return dedupe_chunks(duplicate_pages.annotate_chunks(chunks))
+
+def iter_page_batches(pdf_path, start_page=0, batch_size=None, chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP, start_offset=0):
+    """Yield (pages_done, pages, chunks) batches that always end on a page boundary.
+
+    With the document chunker, chunks run across page breaks inside a batch, and
+    each batch ends the chunk in progress, so a resumed ingest starts clean at
+    pages_done. start_offset is the text length of the pages before start_page.
+
+    With RAG_DEDUP, boilerplate is found on a sample of pages spread over the
+    whole PDF (the same sample on a resume), and repeated pages and
+    near-duplicate chunks are collapsed within each batch: a copy of something
+    in an earlier batch is kept, as that batch's chunks can no longer record it.
+    """
+    batch_size = batch_size or config.STREAM_BATCH_SIZE
+    chunker = None if config.CHUNKER == "page" else DocumentChunker(start_offset=start_offset)
+    boilerplate_lines = find_boilerplate_lines(sample_page_texts(pdf_path)) if config.DEDUP_ENABLED else set()
+    duplicate_pages = DuplicatePages()
+    pages, chunks = [], []
+    pages_done = start_page
+    for page_index, page_data in iter_pages_from_pdf(pdf_path, start_page):
+        if page_data:
+            if config.DEDUP_ENABLED:
+                remove_boilerplate(page_data, boilerplate_lines)
+                duplicate_pages.add(page_data)
+            pages.append(page_data)
+            chunks.extend(chunk_pages([page_data], chunk_size, chunk_overlap) if chunker is None else chunker.add_page(page_data))
+        pages_done = page_index + 1
+        if len(chunks) >= batch_size:
+            if chunker is not None:
+                chunks.extend(chunker.flush())
+            yield pages_done, pages, _dedupe_batch(chunks, duplicate_pages)
+            pages, chunks = [], []
+            duplicate_pages = DuplicatePages()
+    if chunker is not None:
+        chunks.extend(chunker.flush())
+    if pages or chunks or pages_done > start_page:
+        yield pages_done, pages, _dedupe_batch(chunks, duplicate_pages)
+
+def _index_cached_entry(doc_id, db_path, source, meta, page_count, batch_size):
+    """Index a PDF that has a complete ingest cache entry, batch by batch from the cache."""
+    started_at = time.perf_counter()
+    vectorstore, manifest = open_index(db_path)
+    entry = manifest["documents"].get(doc_id)
+    new_chunks = 0
+    if not (entry and entry.get("complete", True) and entry["chunk_count"] == meta["count"]):
+        if entry:
+            vectorstore = remove_document(vectorstore, manifest, doc_id)
+        manifest["documents"][doc_id] = {"source": source, "chunk_count": 0, "complete": False}
+        for chunks, vectors in iter_entry_batches(doc_id, batch_size):
+            vectorstore = append_chunks(vectorstore, manifest, doc_id, chunks, vectors, source)
+            new_chunks += len(chunks)
+        mark_complete(manifest, doc_id)
+        save_index(vectorstore, manifest, db_path)
+    return vectorstore, manifest, {
+        "pages": page_count,
+        "resumed_from_page": 0,
+        "chunks": meta["count"],
+        "new_chunks": new_chunks,
+        "cached": True,
+        "seconds": time.perf_counter() - started_at,
+    }
+
+def ingest_pdf_streaming(pdf_path, doc_id, db_path=config.VECTORDB_PATH, **options):
+    # Checkpoints publish the index, so other writers to the namespace wait until the document is done.
+    # The same file going into another namespace waits for the cache entry instead of writing it twice.
+    with write_lock(db_path), entry_lock(doc_id):
+        return _ingest_pdf_streaming(pdf_path, doc_id, db_path, **options)
+
+def _ingest_pdf_streaming(pdf_path, doc_id, db_path, source=None, batch_size=None, queue_size=None, checkpoint_every=None, progress_callback=None):
+    batch_size = batch_size or config.STREAM_BATCH_SIZE
+    queue_size = queue_size or config.STREAM_QUEUE_SIZE
+    checkpoint_every = checkpoint_every or config.STREAM_CHECKPOINT_EVERY
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+    cached_meta = load_entry_meta(doc_id)
+    if cached_meta:
+        return _index_cached_entry(doc_id, db_path, source, cached_meta, page_count, batch_size)
+
+    writer = StreamingEntryWriter(doc_id, source=source)
+    start_page = writer.checkpoint["pages_done"]
+    start_offset = writer.committed_text_length()
+    vectorstore, manifest = open_index(db_path)
+
+    # Bring the index in line with the last durable checkpoint before resuming.
+    entry = manifest["documents"].get(doc_id)
+    if entry and (entry.get("complete", True) or entry["chunk_count"] != writer.checkpoint["count"]):
+        vectorstore = remove_document(vectorstore, manifest, doc_id)
+        entry = None
+    if entry is None:
+        manifest["documents"][doc_id] = {"source": source, "chunk_count": 0, "complete": False}
+        for chunks, vectors in writer.iter_committed(batch_size):
+            vectorstore = append_chunks(vectorstore, manifest, doc_id, chunks, vectors, source)
+
+    stop_event = threading.Event()
+    chunk_queue = queue.Queue(maxsize=queue_size)
+    vector_queue = queue.Queue(maxsize=queue_size)
+
+    def extract_stage():
+        try:
+            for batch in iter_page_batches(pdf_path, start_page, batch_size, start_offset=start_offset):
+                if not _put(chunk_queue, batch, stop_event):
+                    return
+            _put(chunk_queue, _DONE, stop_event)
+        except Exception as e:
+            _put(chunk_queue, _StageError(e), stop_event)
+
+    def embed_stage():
+        try:
+            while True:
+                item = _get(chunk_queue, stop_event)
+                if item is _DONE or isinstance(item, _StageError):
+                    _put(vector_queue, item, stop_event)
+                    return
+                pages_done, pages, chunks = item
+                vectors = embed_documents(chunks) if chunks else []
+                if not _put(vector_queue, (pages_done, pages, chunks, vectors), stop_event):
+                    return
+        except Exception as e:
+            _put(vector_queue, _StageError(e), stop_event)
+
+    workers = [threading.Thread(target=extract_stage, daemon=True), threading.Thread(target=embed_stage, daemon=True)]
+    for worker in workers:
+        worker.start()
+
+    started_at = time.perf_counter()
+    chunks_done = 0
+    batches_since_checkpoint = 0
+    pages_done = start_page
+    try:
+        while True:
+            item = _get(vector_queue, stop_event)
+            if item is _DONE:
+                break
+            if isinstance(item, _StageError):
+                raise item.error
+            pages_done, pages, chunks, vectors = item
+            writer.append(pages, chunks, vectors)
+            vectorstore = append_chunks(vectorstore, manifest, doc_id, chunks, vectors, source)
+            chunks_done += len(chunks)
+            batches_since_checkpoint += 1
+            if batches_since_checkpoint >= checkpoint_every:
+                # The cache checkpoint goes first: on resume it is the source of truth.
+                writer.commit(pages_done)
+                save_index(vectorstore, manifest, db_path)
+                batches_since_checkpoint = 0
+            if progress_callback:
+                elapsed = time.perf_counter() - started_at
+                progress_callback(pages_done, page_count, chunks_done, chunks_done / elapsed if elapsed > 0 else 0.0)
+    finally:
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+    writer.commit(pages_done)
+    mark_complete(manifest, doc_id)
+    save_index(vectorstore, manifest, db_path)
+    writer.finish()
+    return vectorstore, manifest, {
+        "pages": page_count,
+        "resumed_from_page": start_page,
+        "chunks": writer.checkpoint["count"],
+        "new_chunks": chunks_done,
+        "cached": False,
+        "seconds": time.perf_counter() - started_at,
+    }
@@ -0,0 +1,161 @@
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+import numpy as np
+import config
+from index_store import iter_chunk_texts
+from namespaces import current_index_dir
+from vectorstore_registry import get_vectorstore, index_version, loaded_paths
+
+# BM25 over the chunks already stored in the FAISS docstore. Postings are kept
+# in CSR form: the chunk rows and term frequencies for term t live in
+# postings_rows/postings_tf[offsets[t]:offsets[t + 1]]. Scoring a query is a
+# handful of vectorized numpy updates, with no Ollama call.
+
+LEXICAL_INDEX_NAME = "lexical.npz"
+
+# Keeps identifiers such as "12.3", "art-5" or "ISO/IEC" in one token; the
+# Devanagari range covers vowel signs, which str.isalnum() does not accept.
+_TOKEN = re.compile(r"[\w\u0900-\u097f]+(?:[-./:][\w\u0900-\u097f]+)*")
+
+def tokenize(text):
+    return _TOKEN.findall(unicodedata.normalize("NFKC", text).lower())
+
+class BM25Index:
+    def __init__(self, chunk_ids, vocabulary, offsets, postings_rows, postings_tf, doc_lengths, k1=1.5, b=0.75):
+        self.chunk_ids = chunk_ids
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings_rows = postings_rows
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        document_frequency = np.diff(offsets)
+        self.idf = np.log1p((len(chunk_ids) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        self._length_norm = (k1 * (1 - b + b * doc_lengths / max(self.avg_length, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunk_ids, texts):
+        vocabulary = {}
+        term_rows, term_tf = [], []
+        doc_lengths = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(term_rows):
+                    term_rows.append([])
+                    term_tf.append([])
+                term_rows[term_id].append(row)
+                term_tf[term_id].append(tf)
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(rows) for rows in term_rows])
+        postings_rows = np.fromiter((row for rows in term_rows for row in rows), dtype=np.int32, count=int(offsets[-1]))
+        postings_tf = np.fromiter((tf for tfs in term_tf for tf in tfs), dtype=np.float32, count=int(offsets[-1]))
+        return cls(list(chunk_ids), vocabulary, offsets, postings_rows, postings_tf, doc_lengths)
+
+    def search(self, query, k=4):
+        """Return [(chunk_id, score)] for the best k chunks; chunks sharing no query term are never returned."""
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            matched = True
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.postings_rows[start:end]
+            tf = self.postings_tf[start:end]
+            scores[rows] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._length_norm[rows])
+        if not matched:
+            return []
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[row], float(scores[row])) for row in top]
+
+    def save(self, path, version):
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            chunk_ids=np.array(json.dumps(self.chunk_ids)),
+            vocabulary=np.array(json.dumps(self.vocabulary, ensure_ascii=False)),
+            version=np.array(version),
+            offsets=self.offsets,
+            postings_rows=self.postings_rows,
+            postings_tf=self.postings_tf,
+            doc_lengths=self.doc_lengths,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, version):
+        """Return the saved index, or None if it was built for another index version."""
+        with np.load(path) as data:
+            if str(data["version"]) != version:
+                return None
+            return cls(json.loads(str(data["chunk_ids"])), json.loads(str(data["vocabulary"])), data["offsets"], data["postings_rows"], data["postings_tf"], data["doc_lengths"])
+
+    def stats(self):
+        return {
+            "chunks": len(self.chunk_ids),
+            "terms": len(self.vocabulary),
+            "postings": int(self.offsets[-1]),
+            "bytes": self.offsets.nbytes + self.postings_rows.nbytes + self.postings_tf.nbytes + self.doc_lengths.nbytes,
+        }
+
+_entries = {}
+_build_locks = {}
+_lock = threading.Lock()
+
+def get_lexical_index(db_path=config.VECTORDB_PATH):
+    """Return the BM25 index for the FAISS index at db_path, building it once per index version."""
+    version = index_version(db_path)
+    if version is None:
+        return None
+    with _lock:
+        entry = _entries.get(db_path)
+        if entry and entry["version"] == version:
+            return entry["index"]
+        # Built under a lock of its own namespace, so one tenant's build does not hold up the others.
+        build_lock = _build_locks.setdefault(db_path, threading.Lock())
+    with build_lock:
+        with _lock:
+            entry = _entries.get(db_path)
+        if entry and entry["version"] == version:
+            return entry["index"]
+        started_at = time.perf_counter()
+        # Saved next to the FAISS files, so each published version has its own.
+        path = os.path.join(current_index_dir(db_path), LEXICAL_INDEX_NAME)
+        saved_version = json.dumps(version)
+        index = None
+        if os.path.exists(path):
+            try:
+                index = BM25Index.load(path, saved_version)
+            except Exception as e:
+                print(f"Lexical index could not be loaded from {path}: {e}")
+        if index is None:
+            vectorstore = get_vectorstore(db_path)
+            if vectorstore is None:
+                return None
+            chunk_ids, texts = [], []
+            for chunk_id, text in iter_chunk_texts(vectorstore):
+                chunk_ids.append(chunk_id)
+                texts.append(text)
+            index = BM25Index.build(chunk_ids, texts)
+            index.save(path, saved_version)
+        with _lock:
+            _entries[db_path] = {"index": index, "version": version, "load_seconds": time.perf_counter() - started_at}
+            # A namespace's keyword index is kept only while its vector index is.
+            for stale_path in set(_entries) - loaded_paths() - {db_path}:
+                del _entries[stale_path]
+        return index
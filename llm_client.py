@@ -0,0 +1,145 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import httpx
+from langchain_ollama import OllamaLLM, OllamaEmbeddings
+import config
+from telemetry import span, record_span, current_trace
+
+# One LLM and one embedding client per process. Each wraps a single httpx
+# client, so HTTP connections to Ollama are pooled and reused across calls,
+# sessions and threads.
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client_kwargs():
+    return {
+        "timeout": httpx.Timeout(config.OLLAMA_TIMEOUT_SECONDS, connect=10.0),
+        "limits": httpx.Limits(max_connections=config.OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=config.OLLAMA_MAX_CONNECTIONS),
+    }
+
+def _get_client(name, factory):
+    key = (name, config.OLLAMA_BASE_URL, config.LLM_MODEL if name == "llm" else config.EMBEDDING_MODEL)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+def get_llm():
+    return _get_client("llm", lambda: OllamaLLM(
+        model=config.LLM_MODEL,
+        base_url=config.OLLAMA_BASE_URL,
+        keep_alive=config.OLLAMA_KEEP_ALIVE_SECONDS,
+        client_kwargs=_client_kwargs(),
+    ))
+
+def get_embeddings():
+    return _get_client("embeddings", lambda: OllamaEmbeddings(
+        model=config.EMBEDDING_MODEL,
+        base_url=config.OLLAMA_BASE_URL,
+        keep_alive=config.OLLAMA_KEEP_ALIVE_SECONDS,
+        client_kwargs=_client_kwargs(),
+    ))
+
+class FairLimiter:
+    """Semaphore that hands out slots in arrival order, so waiting callers are served first-come first-served.
+
+    Background callers (post-ingest analyses) queue behind every interactive
+    caller and hold at most ``background_limit`` slots between them, so a
+    question asked while analyses run gets the next free slot, and with
+    ``limit`` above 1 a slot is always left for it.
+    """
+
+    def __init__(self, limit, background_limit=None):
+        self.limit = limit
+        self.background_limit = max(1, limit - 1) if background_limit is None else background_limit
+        self.active = 0
+        self.active_background = 0
+        self._waiting = deque()
+        self._background_waiting = deque()
+        self._condition = threading.Condition()
+
+    @property
+    def waiting(self):
+        return len(self._waiting) + len(self._background_waiting)
+
+    def _can_start(self, ticket, background):
+        if self.active >= self.limit:
+            return False
+        if not background:
+            return self._waiting[0] is ticket
+        return not self._waiting and self._background_waiting[0] is ticket and self.active_background < self.background_limit
+
+    @contextmanager
+    def slot(self, background=False):
+        ticket = object()
+        queue = self._background_waiting if background else self._waiting
+        with self._condition:
+            queue.append(ticket)
+            while not self._can_start(ticket, background):
+                self._condition.wait()
+            queue.popleft()
+            self.active += 1
+            self.active_background += background
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.active -= 1
+                self.active_background -= background
+                self._condition.notify_all()
+
+generation_limiter = FairLimiter(config.LLM_MAX_CONCURRENCY)
+
+# Set for the duration of a background analysis; thread pools started inside
+# one carry it over by running their work in a copy of the context.
+_background = contextvars.ContextVar("llm_background", default=False)
+
+@contextmanager
+def background_priority():
+    """Generations inside this block yield to interactive ones (see FairLimiter)."""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+def _prompt_attributes(prompt_text):
+    # Whitespace tokens are only an estimate of model tokens, but they track prompt growth.
+    return {"prompt_chars": len(prompt_text), "prompt_tokens": len(prompt_text.split())}
+
+def generate(prompt_text):
+    with span("llm.generate", **_prompt_attributes(prompt_text)) as attributes:
+        queued_at = time.perf_counter()
+        with generation_limiter.slot(_background.get()):
+            attributes["queue_wait_seconds"] = time.perf_counter() - queued_at
+            response = get_llm().invoke(prompt_text)
+        attributes["output_chars"] = len(response)
+        return response
+
+def stream(prompt_text):
+    trace_id, parent_id = current_trace()
+    attributes = _prompt_attributes(prompt_text)
+    started_at = time.time()
+    queued_at = time.perf_counter()
+    output_chars = tokens = 0
+    error = None
+    try:
+        with generation_limiter.slot(_background.get()):
+            attributes["queue_wait_seconds"] = time.perf_counter() - queued_at
+            for token in get_llm().stream(prompt_text):
+                if not tokens:
+                    attributes["time_to_first_token"] = time.perf_counter() - queued_at
+                tokens += 1
+                output_chars += len(token)
+                yield token
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        attributes.update(tokens=tokens, output_chars=output_chars)
+        record_span("llm.stream", time.perf_counter() - queued_at, attributes, started_at, trace_id, parent_id, error)
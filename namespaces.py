@@ -0,0 +1,93 @@
+import os
+import re
+import shutil
+import threading
+import uuid
+import config
+from file_lock import FileLock
+
+# Every corpus or workspace gets its own index directory ("namespace") under
+# RAG_VECTORDB_ROOT, so tenants never write to each other's index. Inside a
+# namespace each save goes to a fresh version directory and is published by
+# atomically replacing the CURRENT pointer file; readers resolve CURRENT once
+# and see either the previous or the new index, never a half-written one.
+#
+#     vectordb/<namespace>/CURRENT          -> "v00000007-1a2b3c4d"
+#     vectordb/<namespace>/v00000007-1a2b3c4d/{index.faiss, docstore.sqlite, manifest.json, lexical.npz}
+#
+# A namespace directory without CURRENT is read in place (the layout before
+# versioned publishing) and is converted on its next save.
+
+CURRENT_NAME = "CURRENT"
+WRITE_LOCK_NAME = ".write.lock"
+_LEGACY_FILES = ("index.faiss", "index.pkl", "docstore.sqlite", "manifest.json", "lexical.npz")
+_NAMESPACE_PATTERN = re.compile(r"[^A-Za-z0-9_.-]+")
+
+_write_locks = {}
+_write_locks_lock = threading.Lock()
+
+def namespace_path(namespace):
+    """Index directory for a workspace name or corpus key."""
+    name = _NAMESPACE_PATTERN.sub("-", str(namespace)).strip(".-")[:64]
+    if not name:
+        raise ValueError(f"Invalid index namespace: {namespace!r}")
+    return os.path.join(config.VECTORDB_ROOT, name)
+
+def corpus_namespace(corpus_key):
+    """Namespace for an uploaded document set: the same files share one index."""
+    return namespace_path(f"corpus-{corpus_key[:24]}")
+
+def current_index_dir(db_path):
+    """Directory holding the published index files of the namespace at db_path."""
+    try:
+        with open(os.path.join(db_path, CURRENT_NAME), "r", encoding="utf-8") as f:
+            version_name = f.read().strip()
+    except OSError:
+        return db_path
+    return os.path.join(db_path, version_name) if version_name else db_path
+
+def new_version_dir(db_path, version):
+    path = os.path.join(db_path, f"v{version:08d}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    return path
+
+def publish(db_path, version_dir):
+    """Point CURRENT at version_dir, then drop superseded versions."""
+    pointer = os.path.join(db_path, CURRENT_NAME)
+    temporary = f"{pointer}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(version_dir))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, pointer)
+    for file_name in _LEGACY_FILES:
+        legacy_path = os.path.join(db_path, file_name)
+        if os.path.isfile(legacy_path):
+            os.remove(legacy_path)
+    prune_versions(db_path)
+
+def prune_versions(db_path, keep=None):
+    """Remove all but the newest `keep` versions; older ones may still be open in a reader for a moment."""
+    keep = keep or config.INDEX_VERSIONS_KEPT
+    current = os.path.basename(current_index_dir(db_path))
+    versions = sorted(name for name in os.listdir(db_path) if name.startswith("v") and os.path.isdir(os.path.join(db_path, name)))
+    for name in versions[:-keep]:
+        if name != current:
+            shutil.rmtree(os.path.join(db_path, name), ignore_errors=True)
+
+def write_lock(db_path):
+    """Serializes writers to one namespace, across threads and processes (re-entrant, so a writer can call sync_index).
+
+    Every writer reads the manifest, changes it and publishes a new version while
+    holding this lock, so no writer publishes over another one's documents.
+    """
+    db_path = os.path.abspath(db_path)
+    with _write_locks_lock:
+        if db_path not in _write_locks:
+            _write_locks[db_path] = FileLock(os.path.join(db_path, WRITE_LOCK_NAME))
+        return _write_locks[db_path]
+
+def list_namespaces():
+    if not os.path.isdir(config.VECTORDB_ROOT):
+        return []
+    return sorted(name for name in os.listdir(config.VECTORDB_ROOT) if os.path.isdir(os.path.join(config.VECTORDB_ROOT, name)))
@@ -1,65 +1,365 @@
+import bisect
+import re
 import fitz
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import numpy as np
 from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 import os
-from io import BytesIO
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import config
+from telemetry import traced, annotate
+from ingest_dedup import remove_document_duplicates, dedupe_chunks
 
-def extract_pages_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
+def _word_boxes(page, text):
+    """Map each word on the page to its character span in `text`: [start, end, line, x0, y0, x1, y1]."""
+    words = []
+    cursor = 0
+    line_ids = {}
+    for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words", sort=False):
+        start = text.find(word, cursor)
+        if start < 0:
+            continue
+        cursor = start + len(word)
+        line = line_ids.setdefault((block_no, line_no), len(line_ids))
+        words.append([start, cursor, line, round(x0, 1), round(y0, 1), round(x1, 1), round(y1, 1)])
+    return words
+
+def _extract_page_range(doc, source_name, start_page, end_page):
     pages_data = []
-    for page_num, page in enumerate(doc):
+    for page_num in range(start_page, end_page):
+        page = doc.load_page(page_num)
         text = page.get_text()
         if text.strip():
-            pages_data.append({"page_content": text, "metadata": {"source": os.path.basename(pdf_path), "page": page_num + 1}})
+            pages_data.append({"page_content": text, "metadata": {"source": source_name, "page": page_num + 1}, "words": _word_boxes(page, text)})
     return pages_data
 
-def chunk_pages(pages_data_list):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
+@traced("pdf.extract_pages")
+def extract_pages_from_pdf(pdf_path):
+    doc = fitz.open(pdf_path)
+    try:
+        pages_data = _extract_page_range(doc, os.path.basename(pdf_path), 0, doc.page_count)
+        annotate(source=os.path.basename(pdf_path), page_count=doc.page_count, pages=len(pages_data))
+        return pages_data
+    finally:
+        doc.close()
+
+def iter_pages_from_pdf(pdf_path, start_page=0):
+    """Yield (page_index, page_data) one page at a time; page_data is None for empty pages."""
+    doc = fitz.open(pdf_path)
+    try:
+        source_name = os.path.basename(pdf_path)
+        for page_num in range(start_page, doc.page_count):
+            pages_data = _extract_page_range(doc, source_name, page_num, page_num + 1)
+            yield page_num, (pages_data[0] if pages_data else None)
+    finally:
+        doc.close()
+
+def chunk_bboxes(words, char_start, char_end):
+    """Union the boxes of the words inside [char_start, char_end) into one rectangle per text line."""
+    lines = {}
+    for i in range(bisect.bisect_left(words, [char_start]), len(words)):
+        start, end, line, x0, y0, x1, y1 = words[i]
+        if start >= char_end:
+            break
+        if end <= char_start:
+            continue
+        box = lines.get(line)
+        if box is None:
+            lines[line] = [x0, y0, x1, y1]
+            continue
+        # Plain comparisons: this runs once per word of every chunk.
+        if x0 < box[0]:
+            box[0] = x0
+        if y0 < box[1]:
+            box[1] = y0
+        if x1 > box[2]:
+            box[2] = x1
+        if y1 > box[3]:
+            box[3] = y1
+    return list(lines.values())
+
+@traced("pdf.chunk_pages")
+def chunk_pages(pages_data_list, chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP):
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
     
     all_chunks = []
     for page_data in pages_data_list:
-        chunks_from_page = text_splitter.split_text(page_data["page_content"])
+        chunks_from_page = text_splitter.create_documents([page_data["page_content"]], metadatas=[page_data["metadata"]])
         
-        for chunk_content in chunks_from_page:
-            doc = Document(page_content=chunk_content, metadata=page_data["metadata"].copy())
+        for doc in chunks_from_page:
+            char_start = doc.metadata.pop("start_index", -1)
+            if char_start >= 0:
+                doc.metadata["char_start"] = char_start
+                doc.metadata["char_end"] = char_start + len(doc.page_content)
+                if page_data.get("words"):
+                    doc.metadata["bboxes"] = chunk_bboxes(page_data["words"], char_start, doc.metadata["char_end"])
             all_chunks.append(doc)
             
+    annotate(pages=len(pages_data_list), chunks=len(all_chunks))
     return all_chunks
 
-def get_pdf_page_image_bytes(pdf_path, page_number, highlight_texts=None):
-    doc = None
-    try:
-        doc = fitz.open(pdf_path)
-        if not (0 <= page_number < len(doc)):
-            if doc: doc.close()
-            return None
+def _code_point_table(characters):
+    # Lookup by code point; everything past U+3000 maps to the last entry, which is False.
+    table = np.zeros(0x3002, dtype=bool)
+    table[[ord(c) for c in characters]] = True
+    return table
 
-        page = doc.load_page(page_number)
-        
-        if highlight_texts:
-            for text_to_highlight in highlight_texts:
-                try:
-                    text_instances = page.search_for(text_to_highlight)
-                    if text_instances:
-                        for inst in text_instances:
-                            highlight = page.add_highlight_annot(inst)
-                except Exception as search_error:
-                    print(f"Error while searching for text '{text_to_highlight}': {search_error}")
-
-        pix = page.get_pixmap()
-        img_bytes = BytesIO()
-        pix.save(img_bytes, "png")
-        img_bytes.seek(0)
+# Code points str.split() treats as whitespace.
+_WHITESPACE = _code_point_table(" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000")
+_SENTENCE_PUNCTUATION = _code_point_table(".!?;:")
+_CLOSING_PUNCTUATION = _code_point_table("\"')]")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+
+def _words(text):
+    """(starts, ends, ends_sentence) of the whitespace-separated words in text, found without a Python loop per word."""
+    code_points = np.minimum(np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32), len(_WHITESPACE) - 1)
+    is_word = np.concatenate([[False], ~_WHITESPACE[code_points], [False]])
+    edges = np.flatnonzero(is_word[1:] != is_word[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    last = code_points[ends - 1]
+    before_last = code_points[np.maximum(ends - 2, 0)]
+    ends_sentence = _SENTENCE_PUNCTUATION[last] | (_CLOSING_PUNCTUATION[last] & _SENTENCE_PUNCTUATION[before_last] & (ends - starts > 1))
+    # The last word before each blank line ends a paragraph.
+    breaks = np.fromiter((match.start() for match in _PARAGRAPH_BREAK.finditer(text)), dtype=np.int64)
+    paragraph_ends = np.searchsorted(ends, breaks, side="right") - 1
+    ends_sentence[paragraph_ends[paragraph_ends >= 0]] = True
+    return starts, ends, ends_sentence
+
+class DocumentChunker:
+    """Splits the text of one document into chunks of about ``chunk_tokens`` tokens, fed one page at a time.
+
+    The pages are read as one text joined with "\n", so a chunk can run across a
+    page break; char_start/char_end are offsets in that text and page_spans
+    locates the chunk on every page it covers. Chunks end at a sentence end in
+    their last fifth where there is one, and the next chunk repeats about
+    ``overlap_tokens`` tokens, starting at a sentence where possible. Only the
+    text not yet emitted is kept, so memory does not grow with the document.
+    """
+
+    def __init__(self, chunk_tokens=None, overlap_tokens=None, start_offset=0):
+        self.chunk_tokens = chunk_tokens or config.CHUNK_TOKENS
+        self.overlap_tokens = config.CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        self._length = start_offset
+        self._text = ""
+        self._text_start = start_offset
+        self._pages = []
+        self._emitted_end = start_offset
+        self._clear_words()
+
+    def _clear_words(self):
+        # One entry per word not yet left behind: document offsets, estimated tokens, sentence end.
+        self._starts = np.empty(0, dtype=np.int64)
+        self._ends = np.empty(0, dtype=np.int64)
+        self._tokens = np.empty(0, dtype=np.float64)
+        self._sentence_ends = np.empty(0, dtype=bool)
+
+    def add_page(self, page_data):
+        """Take the next page; returns the chunks completed by it."""
+        text = page_data["page_content"]
+        if self._length:
+            self._append_text("\n")
+        start = self._length
+        self._append_text(text)
+        self._pages.append((start, self._length, page_data))
+        starts, ends, sentence_ends = _words(text)
+        self._starts = np.concatenate([self._starts, starts + start])
+        self._ends = np.concatenate([self._ends, ends + start])
+        self._tokens = np.concatenate([self._tokens, np.maximum(1.0, (ends - starts + 1) / config.CHARS_PER_TOKEN)])
+        self._sentence_ends = np.concatenate([self._sentence_ends, sentence_ends])
+        return self._emit(final=False)
+
+    def flush(self):
+        """Emit the rest as the last chunk(s); later pages start a new chunk."""
+        chunks = self._emit(final=True)
+        self._clear_words()
+        self._pages = []
+        self._text, self._text_start = "", self._length
+        return chunks
+
+    def _append_text(self, text):
+        self._text += text
+        self._length += len(text)
+
+    def _emit(self, final):
+        chunks = []
+        # A chunk is cut only once half a chunk more is buffered, so the document never ends in a sliver.
+        while len(self._starts):
+            if self._tokens.sum() <= 1.5 * self.chunk_tokens:
+                if not final or self._ends[-1] <= self._emitted_end:
+                    break
+                end = len(self._starts)
+            else:
+                end = self._chunk_end()
+            self._emitted_end = int(self._ends[end - 1])
+            chunks.append(self._make_chunk(int(self._starts[0]), self._emitted_end))
+            self._drop_words(end if end == len(self._starts) else self._overlap_start(end))
+        return chunks
+
+    def _chunk_end(self):
+        # Every word counts at least one token, so no chunk holds more than chunk_tokens words.
+        totals = np.cumsum(self._tokens[:int(self.chunk_tokens) + 1])
+        end = max(1, int(np.searchsorted(totals, self.chunk_tokens, side="right")))
+        window = max(1, end // 5)
+        sentence_ends = np.flatnonzero(self._sentence_ends[end - window:end])
+        return end - window + int(sentence_ends[-1]) + 1 if len(sentence_ends) else end
+
+    def _overlap_start(self, end):
+        # Words end-1, end-2, ... back to word 1, so the next chunk always starts further on.
+        totals = np.cumsum(self._tokens[end - 1:0:-1])
+        start = end - int(np.searchsorted(totals, self.overlap_tokens, side="right"))
+        sentence_starts = np.flatnonzero(self._sentence_ends[start - 1:end - 1])
+        return start + int(sentence_starts[0]) if len(sentence_starts) else start
+
+    def _drop_words(self, count):
+        self._starts, self._ends = self._starts[count:], self._ends[count:]
+        self._tokens, self._sentence_ends = self._tokens[count:], self._sentence_ends[count:]
+        keep_from = int(self._starts[0]) if len(self._starts) else self._length
+        self._text = self._text[keep_from - self._text_start:]
+        self._text_start = keep_from
+        self._pages = [page for page in self._pages if page[1] > keep_from]
+
+    def _make_chunk(self, char_start, char_end):
+        spans = []
+        for page_start, page_end, page_data in self._pages:
+            # Pages emptied as duplicates (see ingest_dedup) hold none of the chunk.
+            if page_end <= char_start or page_start >= char_end or page_start == page_end:
+                continue
+            span = {"page": page_data["metadata"]["page"], "char_start": max(char_start, page_start) - page_start, "char_end": min(char_end, page_end) - page_start}
+            if page_data.get("words"):
+                span["bboxes"] = chunk_bboxes(page_data["words"], span["char_start"], span["char_end"])
+            spans.append(span)
+        first_page = next(page_data for page_start, page_end, page_data in self._pages if page_end > char_start)
+        metadata = dict(first_page["metadata"], page=spans[0]["page"], page_end=spans[-1]["page"], char_start=char_start, char_end=char_end, page_spans=spans)
+        return Document(page_content=self._text[char_start - self._text_start:char_end - self._text_start], metadata=metadata)
+
+@traced("pdf.chunk_document")
+def chunk_document(pages_data_list, chunk_tokens=None, overlap_tokens=None):
+    """Chunk the pages of one document as a single text (see DocumentChunker)."""
+    chunker = DocumentChunker(chunk_tokens, overlap_tokens)
+    chunks = []
+    for page_data in pages_data_list:
+        chunks.extend(chunker.add_page(page_data))
+    chunks.extend(chunker.flush())
+    annotate(pages=len(pages_data_list), chunks=len(chunks))
+    return chunks
+
+def split_pages(pages_data_list, chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP):
+    """Chunks of one document's pages with the configured chunker (RAG_CHUNKER).
+
+    With RAG_DEDUP, repeated headers, footers and pages are blanked out of the
+    pages (in place) first, and near-duplicate chunks are collapsed afterwards.
+    """
+    duplicate_pages = remove_document_duplicates(pages_data_list) if config.DEDUP_ENABLED else None
+    if config.CHUNKER == "page":
+        chunks = chunk_pages(pages_data_list, chunk_size, chunk_overlap)
+    else:
+        chunks = chunk_document(pages_data_list)
+    if duplicate_pages is None:
+        return chunks
+    return dedupe_chunks(duplicate_pages.annotate_chunks(chunks))
+
+def _extract_and_chunk_shard(pdf_path, start_page, end_page, chunk_size, chunk_overlap, chunking):
+    # Runs in a worker process: every shard opens its own fitz handle.
+    doc = fitz.open(pdf_path)
+    try:
+        pages_data = _extract_page_range(doc, os.path.basename(pdf_path), start_page, end_page)
+    finally:
         doc.close()
-        return img_bytes.getvalue()
-        
+    # "shard": page chunks need only this shard. "file": the shard is the whole file, so it
+    # is chunked here too. None: document chunks and boilerplate span shards, so the file is
+    # chunked once all of its shards are back.
+    if chunking == "shard":
+        return pages_data, chunk_pages(pages_data, chunk_size, chunk_overlap)
+    if chunking == "file":
+        return pages_data, split_pages(pages_data, chunk_size, chunk_overlap)
+    return pages_data, []
+
+_process_pool = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+def _get_process_pool(max_workers):
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != max_workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            # "spawn" because forking a multi-threaded server (Streamlit) can deadlock.
+            _process_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pool_workers = max_workers
+        return _process_pool
+
+def _discard_process_pool(pool):
+    # A worker died (MuPDF crash on a malformed PDF, out of memory); the next call starts a fresh pool.
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+@traced("pdf.extract_and_chunk")
+def extract_and_chunk_pdfs(pdf_paths, max_workers=None, pages_per_shard=None, chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP):
+    """Extract and chunk several PDFs on a process pool, sharded by file and page range.
+
+    Returns one (pages_data, chunks) tuple per path, in the order of ``pdf_paths``
+    and with pages in document order, the same as split_pages(extract_pages_from_pdf(path))
+    gives (pages_data is cleaned of boilerplate in place when RAG_DEDUP is on).
+    Files that fit in one shard are chunked in the worker that extracts them;
+    the chunks of larger files are cut here once all their shards are back.
+    """
+    max_workers = max_workers or config.EXTRACT_WORKERS
+    pages_per_shard = pages_per_shard or config.EXTRACT_PAGES_PER_SHARD
+    chunk_by_shard = config.CHUNKER == "page" and not config.DEDUP_ENABLED
+
+    shards = []
+    for file_index, pdf_path in enumerate(pdf_paths):
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        whole_file = page_count <= pages_per_shard
+        for start_page in range(0, page_count, pages_per_shard):
+            chunking = "shard" if chunk_by_shard else "file" if whole_file else None
+            shards.append((file_index, pdf_path, start_page, min(start_page + pages_per_shard, page_count), chunking))
+
+    if max_workers <= 1 or len(shards) <= 1:
+        shard_results = [_extract_and_chunk_shard(path, start, end, chunk_size, chunk_overlap, chunking) for _, path, start, end, chunking in shards]
+    else:
+        pool = _get_process_pool(max_workers)
+        try:
+            shard_results = list(pool.map(
+                _extract_and_chunk_shard,
+                [path for _, path, _, _, _ in shards],
+                [start for _, _, start, _, _ in shards],
+                [end for _, _, _, end, _ in shards],
+                [chunk_size] * len(shards),
+                [chunk_overlap] * len(shards),
+                [chunking for _, _, _, _, chunking in shards],
+            ))
+        except BrokenProcessPool as e:
+            # Retry in this process: a file that really crashes MuPDF then fails with a normal error.
+            print(f"Extraction worker died ({e}); extracting sequentially.")
+            _discard_process_pool(pool)
+            shard_results = [_extract_and_chunk_shard(path, start, end, chunk_size, chunk_overlap, chunking) for _, path, start, end, chunking in shards]
+
+    results = [([], []) for _ in pdf_paths]
+    chunked_files = set()
+    for (file_index, _, _, _, chunking), (pages_data, chunks) in zip(shards, shard_results):
+        results[file_index][0].extend(pages_data)
+        results[file_index][1].extend(chunks)
+        if chunking:
+            chunked_files.add(file_index)
+    for file_index, (pages_data, chunks) in enumerate(results):
+        if file_index not in chunked_files:
+            chunks.extend(split_pages(pages_data, chunk_size, chunk_overlap))
+    annotate(files=len(pdf_paths), shards=len(shards), pages=sum(len(p) for p, _ in results), chunks=sum(len(c) for _, c in results))
+    return results
+
+def get_pdf_page_image_bytes(pdf_path, page_number, highlight_texts=None, zoom=None, file_key=None, highlight_rects=None):
+    from preview_service import get_preview_service
+    try:
+        return get_preview_service().render_page(pdf_path, page_number, highlight_texts, zoom=zoom, file_key=file_key, highlight_rects=highlight_rects)
     except Exception as e:
         print(f"Error while retrieving page image ({pdf_path}, page {page_number}): {e}")
-        if doc:
-            doc.close()
-        return None
-    except Exception as e:
-        print(f"Error while retrieving page image: {e}")
-        if 'doc' in locals() and doc:
-            doc.close()
         return None
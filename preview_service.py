@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import fitz
+import config
+from telemetry import traced, annotate
+
+# Page previews are requested on every Streamlit rerun, so the service keeps
+# recently used PDFs open and the rendered PNGs in memory. Renders are keyed by
+# (file identity, page, zoom, highlights); the byte budget evicts the least
+# recently shown pages first.
+
+def file_identity(pdf_path):
+    stat = os.stat(pdf_path)
+    return (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime_ns)
+
+class PreviewService:
+    def __init__(self, max_documents, max_bytes, prefetch_pages=1):
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.prefetch_pages = prefetch_pages
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()
+        self._renders = OrderedDict()
+        self._lock = threading.Lock()
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview-prefetch")
+
+    def _open(self, pdf_path, file_key):
+        """Return (document, lock); a fitz document must not be used from two threads at once."""
+        with self._lock:
+            handle = self._documents.get(file_key)
+            if handle is not None:
+                self._documents.move_to_end(file_key)
+                return handle
+            handle = self._documents[file_key] = (fitz.open(pdf_path), threading.Lock())
+            while len(self._documents) > self.max_documents:
+                _, (old_doc, old_lock) = self._documents.popitem(last=False)
+                with old_lock:
+                    old_doc.close()
+            return handle
+
+    def _cached(self, key):
+        with self._lock:
+            image = self._renders.get(key)
+            if image is not None:
+                self._renders.move_to_end(key)
+            return image
+
+    def _store(self, key, image):
+        with self._lock:
+            if key in self._renders or len(image) > self.max_bytes:
+                return
+            self._renders[key] = image
+            self.bytes += len(image)
+            while self.bytes > self.max_bytes:
+                _, old_image = self._renders.popitem(last=False)
+                self.bytes -= len(old_image)
+
+    def _render(self, pdf_path, file_key, page_number, zoom, highlight_texts, highlight_rects=()):
+        doc, doc_lock = self._open(pdf_path, file_key)
+        with doc_lock:
+            if not (0 <= page_number < doc.page_count):
+                return None
+            page = doc.load_page(page_number)
+            annotations = [page.add_highlight_annot(fitz.Rect(rect)) for rect in highlight_rects]
+            for text_to_highlight in highlight_texts:
+                try:
+                    for inst in page.search_for(text_to_highlight):
+                        annotations.append(page.add_highlight_annot(inst))
+                except Exception as search_error:
+                    print(f"Error while searching for text '{text_to_highlight}': {search_error}")
+            try:
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+                return pix.tobytes("png")
+            finally:
+                # The document stays open, so highlights must not outlive this render.
+                for annotation in annotations:
+                    page.delete_annot(annotation)
+
+    @traced("preview.render_page")
+    def render_page(self, pdf_path, page_number, highlight_texts=None, zoom=None, file_key=None, prefetch=True, highlight_rects=None):
+        """Render a page as PNG. Chunk boxes from extraction go in `highlight_rects`; `highlight_texts` are searched for on the page."""
+        zoom = zoom or config.PREVIEW_ZOOM
+        file_key = file_key or file_identity(pdf_path)
+        highlight_texts = tuple(sorted(set(highlight_texts or ())))
+        highlight_rects = tuple(sorted(set(tuple(rect) for rect in highlight_rects or ())))
+        key = (file_key, page_number, zoom, highlight_texts + highlight_rects)
+        image = self._cached(key)
+        annotate(page=page_number, zoom=zoom, cache_hit=image is not None)
+        if image is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            image = self._render(pdf_path, file_key, page_number, zoom, highlight_texts, highlight_rects)
+            if image is not None:
+                self._store(key, image)
+        if prefetch and image is not None:
+            self.prefetch(pdf_path, page_number, zoom, file_key)
+        return image
+
+    def thumbnail(self, pdf_path, page_number, file_key=None):
+        return self.render_page(pdf_path, page_number, zoom=config.PREVIEW_THUMBNAIL_ZOOM, file_key=file_key, prefetch=False)
+
+    def prefetch(self, pdf_path, page_number, zoom=None, file_key=None):
+        """Render the neighbouring pages in the background so flipping to them is instant."""
+        zoom = zoom or config.PREVIEW_ZOOM
+        file_key = file_key or file_identity(pdf_path)
+        for offset in range(1, self.prefetch_pages + 1):
+            for neighbour in (page_number + offset, page_number - offset):
+                if neighbour >= 0 and self._cached((file_key, neighbour, zoom, ())) is None:
+                    self._prefetcher.submit(self._prefetch_one, pdf_path, file_key, neighbour, zoom)
+
+    def _prefetch_one(self, pdf_path, file_key, page_number, zoom):
+        key = (file_key, page_number, zoom, ())
+        if self._cached(key) is not None:
+            return
+        try:
+            image = self._render(pdf_path, file_key, page_number, zoom, ())
+        except Exception as e:
+            print(f"Error while prefetching page {page_number} of {pdf_path}: {e}")
+            return
+        if image is not None:
+            self._store(key, image)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "renders": len(self._renders),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+            }
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_preview_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PreviewService(config.PREVIEW_MAX_DOCUMENTS, config.PREVIEW_CACHE_MAX_MB * 1024 * 1024, config.PREVIEW_PREFETCH_PAGES)
+        return _service
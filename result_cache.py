@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import config
+from telemetry import increment
+from llm_client import generate, stream
+
+# Results of the document-analysis prompts (summary, keywords, concept map,
+# timeline, suggested questions) are pure functions of the rendered prompt:
+# it already contains the document text, role, language and the template
+# itself. Keying on (task, model, prompt) therefore invalidates entries
+# automatically when any of those change, including template edits.
+
+class ResultCache:
+    def __init__(self, path, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stats_by_task = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, task TEXT NOT NULL, value TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def _record(self, task, hit):
+        task_stats = self.stats_by_task.setdefault(task, {"hits": 0, "misses": 0})
+        task_stats["hits" if hit else "misses"] += 1
+        increment("result_cache_lookups", task=task, result="hit" if hit else "miss")
+
+    def get(self, task, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                row = None
+            self._record(task, row is not None)
+            if row is None:
+                return None
+            self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+
+    def put(self, task, key, value):
+        with self._lock:
+            now = time.time()
+            self._db.execute("INSERT OR REPLACE INTO results (key, task, value, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                             (key, task, json.dumps(value, ensure_ascii=False), now, now))
+            if self.ttl_seconds:
+                self._db.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+            overflow = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)", (overflow,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM results")
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            hits = sum(s["hits"] for s in self.stats_by_task.values())
+            misses = sum(s["misses"] for s in self.stats_by_task.values())
+            return {
+                "entries": entries,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "by_task": {task: dict(s) for task, s in self.stats_by_task.items()},
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_result_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(os.path.join(config.CACHE_DIR, "results.sqlite"), config.RESULT_CACHE_MAX_ENTRIES, config.RESULT_CACHE_TTL_SECONDS)
+        return _cache
+
+def result_key(task, prompt_text):
+    payload = json.dumps([task, config.LLM_MODEL, prompt_text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def cached_generate(task, prompt_text):
+    if not config.RESULT_CACHE_ENABLED:
+        return generate(prompt_text)
+    cache = get_result_cache()
+    key = result_key(task, prompt_text)
+    cached = cache.get(task, key)
+    if cached is not None:
+        return cached
+    response = generate(prompt_text)
+    cache.put(task, key, response)
+    return response
+
+def cached_stream(task, prompt_text):
+    if not config.RESULT_CACHE_ENABLED:
+        yield from stream(prompt_text)
+        return
+    cache = get_result_cache()
+    key = result_key(task, prompt_text)
+    cached = cache.get(task, key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for token in stream(prompt_text):
+        parts.append(token)
+        yield token
+    cache.put(task, key, "".join(parts))
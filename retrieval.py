@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import defaultdict, deque
+import config
+from lexical_index import get_lexical_index, tokenize
+from telemetry import traced, annotate
+
+# Answer retrieval over the FAISS index and the BM25 index built from the same
+# chunks. "hybrid" fuses both rankings with reciprocal rank fusion; "lexical"
+# never calls the embedding model, and "auto" uses it for short keyword-style
+# queries, falling back to hybrid when no chunk contains the terms.
+
+RETRIEVAL_MODES = ("auto", "hybrid", "vector", "lexical")
+_QUESTION_WORDS = {"what", "why", "how", "when", "where", "who", "which", "explain", "describe", "compare", "क्या", "क्यों", "कैसे", "कब", "कहाँ", "कौन"}
+
+def is_keyword_query(question):
+    tokens = tokenize(question)
+    if not tokens or "?" in question or len(tokens) > config.LEXICAL_FAST_PATH_MAX_TERMS:
+        return False
+    return not _QUESTION_WORDS.intersection(tokens)
+
+def reciprocal_rank_fusion(rankings, k=None, rrf_k=None):
+    """Fuse ranked lists of chunk ids; each list contributes 1 / (rrf_k + rank) per id."""
+    rrf_k = rrf_k or config.RRF_K
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] += 1.0 / (rrf_k + rank)
+    fused = sorted(scores, key=scores.get, reverse=True)
+    return fused[:k] if k else fused
+
+@traced("retrieval.vector")
+def _vector_search(vectorstore, question, k, query_vector=None):
+    if query_vector is not None:
+        return vectorstore.similarity_search_by_vector(list(map(float, query_vector)), k=k)
+    return vectorstore.similarity_search(question, k=k)
+
+@traced("retrieval.lexical")
+def _lexical_search(vectorstore, lexical_index, question, k):
+    """Return [(document, bm25_score)] best first."""
+    results = ((vectorstore.docstore.search(chunk_id), score) for chunk_id, score in lexical_index.search(question, k))
+    # The docstore answers unknown ids with an error string rather than raising.
+    return [(doc, score) for doc, score in results if not isinstance(doc, str)]
+
+@traced("retrieval")
+def retrieve(vectorstore, question, mode=None, k=None, db_path=config.VECTORDB_PATH, query_vector=None):
+    """Return (documents, stats) for the question using the given retrieval mode.
+
+    Pass ``query_vector`` when the question has already been embedded.
+    """
+    mode = mode or config.RETRIEVAL_MODE
+    k = k or config.RETRIEVAL_TOP_K
+    stats = {"requested_mode": mode}
+    started_at = time.perf_counter()
+    lexical_index = get_lexical_index(db_path) if mode != "vector" else None
+    if lexical_index is None and mode != "vector":
+        mode = "vector"
+    if mode == "auto":
+        mode = "lexical" if is_keyword_query(question) else "hybrid"
+
+    documents = []
+    if mode == "lexical":
+        lexical_started_at = time.perf_counter()
+        documents = [doc for doc, _ in _lexical_search(vectorstore, lexical_index, question, k)]
+        stats["lexical_seconds"] = time.perf_counter() - lexical_started_at
+        if not documents and stats["requested_mode"] == "auto":
+            mode = "hybrid"
+    if mode == "vector":
+        vector_started_at = time.perf_counter()
+        documents = _vector_search(vectorstore, question, k, query_vector)
+        stats["vector_seconds"] = time.perf_counter() - vector_started_at
+    elif mode == "hybrid":
+        fetch_k = max(k, config.HYBRID_FETCH_K)
+        lexical_started_at = time.perf_counter()
+        lexical_results = _lexical_search(vectorstore, lexical_index, question, fetch_k)
+        lexical_documents = [doc for doc, _ in lexical_results]
+        stats["lexical_seconds"] = time.perf_counter() - lexical_started_at
+        vector_started_at = time.perf_counter()
+        vector_documents = _vector_search(vectorstore, question, fetch_k, query_vector)
+        stats["vector_seconds"] = time.perf_counter() - vector_started_at
+        by_id = {doc.id: doc for doc in vector_documents + lexical_documents}
+        fused_ids = reciprocal_rank_fusion([[doc.id for doc in vector_documents], [doc.id for doc in lexical_documents]], k=k)
+        # Rank fusion rewards chunks both retrievers agree on, which can bury a
+        # chunk that is the only one containing a rare exact term. Keep such a
+        # clear lexical winner on top.
+        if lexical_results and (len(lexical_results) == 1 or lexical_results[0][1] >= config.LEXICAL_DOMINANCE_RATIO * lexical_results[1][1]):
+            fused_ids = [lexical_documents[0].id] + [chunk_id for chunk_id in fused_ids if chunk_id != lexical_documents[0].id][:k - 1]
+        documents = [by_id[chunk_id] for chunk_id in fused_ids]
+
+    stats["mode"] = mode
+    stats["retrieval_seconds"] = time.perf_counter() - started_at
+    _record(mode, stats["retrieval_seconds"])
+    annotate(requested_mode=stats["requested_mode"], mode=mode, documents=len(documents))
+    return documents, stats
+
+_latencies = defaultdict(lambda: deque(maxlen=500))
+_latencies_lock = threading.Lock()
+
+def _record(mode, seconds):
+    with _latencies_lock:
+        _latencies[mode].append(seconds)
+
+def retrieval_stats():
+    """Per-mode query count and p50/p95 latency over the most recent queries."""
+    with _latencies_lock:
+        snapshot = {mode: sorted(samples) for mode, samples in _latencies.items()}
+    return {
+        mode: {
+            "queries": len(samples),
+            "p50_seconds": samples[len(samples) // 2],
+            "p95_seconds": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        }
+        for mode, samples in snapshot.items() if samples
+    }
@@ -0,0 +1,189 @@
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config
+
+# Lightweight spans and counters for the RAG pipeline. A span records its
+# duration and whatever attributes the stage adds (chunk counts, prompt sizes,
+# cache hits). Finished spans go to an in-memory ring buffer for the
+# diagnostics panel, to latency histograms for the Prometheus endpoint and,
+# if RAG_TRACE_JSONL is set, to a JSONL file.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_recent = deque(maxlen=config.TRACE_BUFFER_SIZE)
+_histograms = defaultdict(lambda: {"count": 0, "sum": 0.0, "buckets": [0] * len(DURATION_BUCKETS)})
+_counters = defaultdict(float)
+_lock = threading.Lock()
+_local = threading.local()
+_jsonl_lock = threading.Lock()
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+def record_span(name, duration, attributes=None, started_at=None, trace_id=None, parent_id=None, error=None):
+    """Record a finished span; use this where a `with span(...)` block cannot wrap the work, e.g. generators."""
+    if not config.TRACE_ENABLED:
+        return
+    finished = {
+        "name": name,
+        "trace_id": trace_id or uuid.uuid4().hex[:16],
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent_id,
+        "start": started_at if started_at is not None else time.time() - duration,
+        "duration": duration,
+        "attributes": attributes or {},
+    }
+    if error is not None:
+        finished["error"] = error
+    with _lock:
+        _recent.append(finished)
+        histogram = _histograms[name]
+        histogram["count"] += 1
+        histogram["sum"] += duration
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                histogram["buckets"][i] += 1
+    if config.TRACE_JSONL_PATH:
+        line = json.dumps(finished, ensure_ascii=False, default=str)
+        with _jsonl_lock, open(config.TRACE_JSONL_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+@contextmanager
+def span(name, **attributes):
+    """Time the block as a span nested under the current one; yields the attribute dict to add to."""
+    if not config.TRACE_ENABLED:
+        yield attributes
+        return
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    current = {"trace_id": parent["trace_id"] if parent else uuid.uuid4().hex[:16], "span_id": uuid.uuid4().hex[:16], "attributes": attributes}
+    stack.append(current)
+    started_at = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        stack.pop()
+        record_span(name, time.perf_counter() - started, attributes, started_at, current["trace_id"], parent["span_id"] if parent else None, error)
+
+def annotate(**attributes):
+    """Add attributes to the innermost open span on this thread (no-op outside a span)."""
+    stack = _stack()
+    if stack:
+        stack[-1]["attributes"].update(attributes)
+
+def current_trace():
+    """(trace_id, span_id) of the innermost open span on this thread, or (None, None)."""
+    stack = _stack()
+    return (stack[-1]["trace_id"], stack[-1]["span_id"]) if stack else (None, None)
+
+def traced(name, **static_attributes):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **static_attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def increment(name, value=1, **labels):
+    if not config.TRACE_ENABLED:
+        return
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += value
+
+def recent_spans(limit=None, name=None):
+    with _lock:
+        spans = [s for s in _recent if name is None or s["name"] == name]
+    return spans[-limit:] if limit else spans
+
+def span_summary():
+    """Per span name: count, total and recent p50/p95/max durations."""
+    by_name = defaultdict(list)
+    for finished in recent_spans():
+        by_name[finished["name"]].append(finished["duration"])
+    with _lock:
+        totals = {name: (h["count"], h["sum"]) for name, h in _histograms.items()}
+    summary = {}
+    for name, (count, total) in totals.items():
+        durations = sorted(by_name.get(name) or [0.0])
+        summary[name] = {
+            "count": count,
+            "total_seconds": total,
+            "p50_seconds": durations[len(durations) // 2],
+            "p95_seconds": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "max_seconds": durations[-1],
+        }
+    return summary
+
+def counters():
+    with _lock:
+        return {(name, labels): value for (name, labels), value in _counters.items()}
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels) + "}"
+
+def prometheus_text():
+    lines = ["# TYPE rag_span_duration_seconds histogram"]
+    with _lock:
+        histograms = {name: dict(h, buckets=list(h["buckets"])) for name, h in _histograms.items()}
+        counter_items = list(_counters.items())
+    for name, histogram in sorted(histograms.items()):
+        for bound, bucket_count in zip(DURATION_BUCKETS, histogram["buckets"]):
+            lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {bucket_count}')
+        lines.append(f'rag_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'rag_span_duration_seconds_sum{{span="{name}"}} {histogram["sum"]}')
+        lines.append(f'rag_span_duration_seconds_count{{span="{name}"}} {histogram["count"]}')
+    for metric in sorted({name for (name, _), _ in counter_items}):
+        lines.append(f"# TYPE rag_{metric}_total counter")
+        for (name, labels), value in counter_items:
+            if name == metric:
+                lines.append(f"rag_{name}_total{_label_text(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port=None, host="127.0.0.1"):
+    """Serve /metrics in Prometheus text format on a background thread (once per process)."""
+    global _metrics_server
+    port = port or config.METRICS_PORT
+    with _metrics_server_lock:
+        if _metrics_server is None and port:
+            try:
+                _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Metrics endpoint could not be started on port {port}: {e}")
+                return None
+            threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+        return _metrics_server
@@ -0,0 +1,126 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+import config
+from embedder import load_vectorstore
+from index_types import index_bytes, index_type_of
+from namespaces import current_index_dir
+
+# Streamlit imports this module once per server process, so every session and
+# rerun shares the loaded indexes below. Indexes are kept in LRU order and the
+# least recently used namespaces are dropped once the estimated size of all
+# loaded indexes exceeds RAG_INDEX_CACHE_MAX_MB. Each namespace loads under its
+# own lock, so a tenant loading a large index does not block the others.
+_entries = OrderedDict()
+_lock = threading.Lock()
+_load_locks = {}
+_evictions = 0
+
+def index_version(db_path=config.VECTORDB_PATH):
+    # The manifest is written after the FAISS files, so its mtime marks a complete save.
+    index_dir = current_index_dir(db_path)
+    for file_name in ("manifest.json", "index.faiss"):
+        try:
+            stat = os.stat(os.path.join(index_dir, file_name))
+            # Saves replace the file, so the inode changes even within one mtime tick.
+            return (os.path.basename(index_dir), file_name, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            continue
+    return None
+
+def estimate_vectorstore_bytes(vectorstore):
+    vector_bytes = index_bytes(vectorstore.index)
+    # Chunks in docstore.sqlite stay on disk; only an in-memory docstore is counted.
+    docstore_bytes = 0
+    for doc in getattr(vectorstore.docstore, "_dict", {}).values():
+        docstore_bytes += sys.getsizeof(doc.page_content) + len(json.dumps(doc.metadata, ensure_ascii=False, default=str))
+    return vector_bytes + docstore_bytes
+
+def _cached(db_path, version):
+    with _lock:
+        entry = _entries.get(db_path)
+        if entry and entry["version"] == version:
+            _entries.move_to_end(db_path)
+            entry["hits"] += 1
+            entry["last_used"] = time.time()
+            return entry
+        return None
+
+def _evict(keep):
+    global _evictions
+    while len(_entries) > 1 and sum(entry["bytes"] for entry in _entries.values()) > config.INDEX_CACHE_MAX_MB * 1024 * 1024:
+        db_path = next(path for path in _entries if path != keep)
+        del _entries[db_path]
+        _evictions += 1
+
+def get_vectorstore(db_path=config.VECTORDB_PATH, _retry=True):
+    version = index_version(db_path)
+    if version is None:
+        return None
+    entry = _cached(db_path, version)
+    if entry:
+        return entry["vectorstore"]
+    with _lock:
+        load_lock = _load_locks.setdefault(db_path, threading.Lock())
+    with load_lock:
+        # Another request may have loaded this version while we waited.
+        entry = _cached(db_path, version)
+        if entry:
+            return entry["vectorstore"]
+        with _lock:
+            previous = _entries.get(db_path)
+        started_at = time.perf_counter()
+        try:
+            vectorstore = load_vectorstore(db_path)
+        except Exception as e:
+            if not _retry or index_version(db_path) == version:
+                print(f"Vector database could not be loaded from {db_path}: {e}")
+                return None
+        else:
+            new_entry = {
+                "vectorstore": vectorstore,
+                "version": version,
+                "bytes": estimate_vectorstore_bytes(vectorstore),
+                "load_seconds": time.perf_counter() - started_at,
+                "loaded_at": time.time(),
+                "last_used": time.time(),
+                "hits": 0,
+                "loads": (previous["loads"] + 1) if previous else 1,
+            }
+            with _lock:
+                _entries[db_path] = new_entry
+                _entries.move_to_end(db_path)
+                _evict(keep=db_path)
+            return vectorstore
+    # A newer version was published, and the one being read pruned, mid-load.
+    return get_vectorstore(db_path, _retry=False)
+
+def invalidate(db_path=None):
+    with _lock:
+        if db_path is None:
+            _entries.clear()
+        else:
+            _entries.pop(db_path, None)
+
+def cache_stats():
+    with _lock:
+        return {
+            "indexes": len(_entries),
+            "bytes": sum(entry["bytes"] for entry in _entries.values()),
+            "budget_bytes": config.INDEX_CACHE_MAX_MB * 1024 * 1024,
+            "evictions": _evictions,
+        }
+
+def loaded_paths():
+    with _lock:
+        return set(_entries)
+
+def registry_stats():
+    with _lock:
+        return {
+            db_path: {key: value for key, value in entry.items() if key != "vectorstore"} | {"vectors": entry["vectorstore"].index.ntotal, "index_type": index_type_of(entry["vectorstore"].index)}
+            for db_path, entry in _entries.items()
+        }